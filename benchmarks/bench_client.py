@@ -0,0 +1,176 @@
+"""
+Load and latency benchmarks for the kiefer clients.
+
+Runs common access patterns against a local :class:`MockUPServer` and
+reports requests per second, p50/p99 latency, CPU time per request and
+memory. The server runs in a process of its own and every pattern in a
+fresh process, so CPU time and RSS only cover the client side of a single
+pattern; ``rss MB`` is the peak RSS of that process, ``+rss MB`` its growth
+while the pattern ran:
+
+::
+
+    PYTHONPATH=. python benchmarks/bench_client.py --requests 2000
+    PYTHONPATH=. python benchmarks/bench_client.py --patterns threaded async
+"""
+import argparse
+import asyncio
+import multiprocessing
+import resource
+import sys
+import time
+
+from kiefer.batch import fan_out
+from kiefer.client import create_session
+from kiefer.mockserver import MockUPServer
+
+PATTERNS = ('sequential', 'threaded', 'async', 'paginated')
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+    return rss / (1024.0 * 1024.0) if sys.platform == 'darwin' else rss / 1024.0
+
+
+class ServerHandle(MockUPServer):
+    """A :class:`MockUPServer` running in another process."""
+
+    def __init__(self, url, items, page_size):
+        # Doesn't bind a socket, only creates clients for the server at url
+        self._url = url
+        self.items = items
+        self.page_size = page_size
+
+    @property
+    def url(self):
+        return self._url
+
+
+def serve(args, conn):
+    with MockUPServer(latency=args.latency, page_size=args.page_size,
+                      items=args.items, seed=0) as server:
+        conn.send(server.url)
+        conn.recv()  # serve until the benchmark is done
+
+
+def timed(latencies, func):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+    return wrapper
+
+
+def run_sequential(server, args, latencies):
+    client = server.client('bench')
+    get_move = timed(latencies, client.get_move)
+    for i in range(args.requests):
+        get_move('moves-{}'.format(i % server.items))
+    return args.requests
+
+
+def run_threaded(server, args, latencies):
+    session = create_session(pool_maxsize=args.workers)
+    client = server.client('bench', session=session)
+    get_move = timed(latencies, client.get_move)
+    xids = ['moves-{}'.format(i % server.items) for i in range(args.requests)]
+    for res in fan_out(get_move, xids, max_workers=args.workers):
+        if res.error is not None:
+            raise res.error
+    return args.requests
+
+
+def run_async(server, args, latencies):
+    from kiefer.aio import AsyncKieferClient
+
+    async def worker(client, xids):
+        for xid in xids:
+            start = time.perf_counter()
+            await client.get_move(xid)
+            latencies.append(time.perf_counter() - start)
+
+    async def main():
+        client = server.client('bench', client_cls=AsyncKieferClient,
+                               max_concurrency=args.workers)
+        xids = iter(['moves-{}'.format(i % server.items)
+                     for i in range(args.requests)])
+        async with client:
+            await asyncio.gather(*[worker(client, xids)
+                                   for _ in range(args.workers)])
+
+    asyncio.run(main())
+    return args.requests
+
+
+def run_paginated(server, args, latencies):
+    client = server.client('bench')
+    client._get_url = timed(latencies, client._get_url)
+    while len(latencies) < args.requests:
+        for _ in client.iter_moves(limit=server.page_size):
+            pass
+    return len(latencies)
+
+
+def run_pattern(name, server, args):
+    latencies = []
+    rss_start = peak_rss_mb()
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    requests = globals()['run_' + name](server, args, latencies)
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    return {'pattern': name,
+            'requests': requests,
+            'req_per_s': requests / wall,
+            'p50_ms': percentile(latencies, 0.5) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'cpu_ms_per_req': cpu / requests * 1000,
+            'peak_rss_mb': peak_rss_mb(),
+            'rss_delta_mb': peak_rss_mb() - rss_start}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--patterns', nargs='+', choices=PATTERNS,
+                        default=list(PATTERNS))
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='server side delay per request in seconds')
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--items', type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    row = '{pattern:<12} {requests:>8} {req_per_s:>10.1f} {p50_ms:>9.2f} ' \
+          '{p99_ms:>9.2f} {cpu_ms_per_req:>11.3f} {peak_rss_mb:>9.1f} ' \
+          '{rss_delta_mb:>9.1f}'
+    print('{:<12} {:>8} {:>10} {:>9} {:>9} {:>11} {:>9} {:>9}'.format(
+        'pattern', 'requests', 'req/s', 'p50 ms', 'p99 ms', 'cpu ms/req',
+        'rss MB', '+rss MB'))
+    # Fresh interpreters, which don't inherit the memory of this one
+    context = multiprocessing.get_context('spawn')
+    conn, server_conn = context.Pipe()
+    server = context.Process(target=serve, args=(args, server_conn))
+    server.start()
+    try:
+        handle = ServerHandle(conn.recv(), args.items, args.page_size)
+        for name in args.patterns:
+            with context.Pool(processes=1) as pool:
+                print(row.format(**pool.apply(run_pattern,
+                                              (name, handle, args))))
+    finally:
+        conn.send(None)
+        server.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,428 @@
+"""
+asyncio support for the Jawbone UP API.
+
+Requires Python 3.6+ and `aiohttp <https://aiohttp.readthedocs.io/>`_.
+"""
+import asyncio
+import os
+from urllib.parse import urljoin, urlsplit
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from kiefer.batch import BatchResult
+from kiefer.cache import cache_key
+from kiefer.client import (CircuitOpenError, KieferClient, KieferClientError,
+                           _clock, _write_chunks)
+from kiefer.stream import ItemStreamParser
+from kiefer.util import LazyResponse, check_status, loads, next_link
+
+
+def create_async_session(limit=100, limit_per_host=0, keepalive_timeout=15):
+    """
+    Create a pooled :class:`aiohttp.ClientSession` for the UP API.
+
+    Call this from within a running event loop. Like the session of the
+    synchronous client, it can be shared by many :class:`AsyncKieferClient`
+    instances.
+
+    :param limit: ``int``, total number of simultaneous connections.
+    :param limit_per_host: ``int``, connections per host (``0`` = no limit).
+    :param keepalive_timeout: ``float``, seconds to keep idle connections open.
+    :return: :class:`aiohttp.ClientSession`
+    """
+    if aiohttp is None:
+        raise ImportError('The asyncio client requires aiohttp.')
+    connector = aiohttp.TCPConnector(limit=limit,
+                                     limit_per_host=limit_per_host,
+                                     keepalive_timeout=keepalive_timeout)
+    return aiohttp.ClientSession(connector=connector)
+
+
+def _encode(payload):
+    # aiohttp only accepts strings (and ints) as query and form values
+    if payload is None:
+        return None
+    return {key: value if isinstance(value, str) else str(value)
+            for key, value in payload.items()}
+
+
+def create_webhook_app(receiver, path='/'):
+    """
+    Create an :class:`aiohttp.web.Application` serving a
+    :class:`kiefer.webhook.WebhookReceiver` at ``path``.
+
+    ::
+
+        app = create_webhook_app(WebhookReceiver(client_id, client_secret))
+        aiohttp.web.run_app(app, port=8000)
+    """
+    if aiohttp is None:
+        raise ImportError('The webhook app requires aiohttp.')
+    from aiohttp import web
+
+    async def handle(request):
+        if request.content_length is not None and \
+                request.content_length > receiver.max_body:
+            return web.Response(status=413, text='Invalid content length')
+        status, message = receiver.handle(await request.read())
+        return web.Response(status=status, text=message)
+
+    app = web.Application(client_max_size=receiver.max_body)
+    app.router.add_post(path, handle)
+    return app
+
+
+class AsyncSingleFlight(object):
+    """
+    asyncio variant of :class:`kiefer.util.SingleFlight`.
+
+    Coroutines awaiting a running call for the same key share its result.
+    Cancelling a waiting coroutine doesn't cancel the shared call.
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, func):
+        """
+        Return ``await func()``, or the result of the running call for ``key``.
+
+        :param key: hashable key identifying the call
+        :param func: callable without arguments returning an awaitable
+        """
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func())
+            self._calls[key] = future
+            future.add_done_callback(lambda f: self._calls.pop(key, None))
+        return await asyncio.shield(future)
+
+    def __len__(self):
+        return len(self._calls)
+
+
+class AsyncKieferClient(KieferClient):
+    """
+    asyncio client for the Jawbone UP API.
+
+    Offers the same endpoints as :class:`kiefer.client.KieferClient`, but
+    every method returns a coroutine and every ``iter_*`` method an
+    asynchronous iterator:
+
+    ::
+
+        async with AsyncKieferClient(access_token) as client:
+            info = await client.get_user_information()
+            async for move in client.iter_moves():
+                ...
+
+    :param access_token: Your access token for the UP API.
+    :param session: :class:`aiohttp.ClientSession`, see
+                    :func:`create_async_session`. If omitted, the client
+                    creates its own session on the first request.
+    :param semaphore: :class:`asyncio.Semaphore` limiting the number of
+                      requests in flight. Share it between clients to bound
+                      the concurrency of a whole process.
+    :param max_concurrency: ``int``, size of the semaphore created if none
+                            is passed in.
+    :param rate_limiter: :class:`kiefer.ratelimit.RateLimiter`, may be shared
+                         with synchronous clients.
+    :param retry: :class:`kiefer.ratelimit.RetryPolicy`
+    :param lazy: ``bool``, see :class:`kiefer.client.KieferClient`
+    :param hooks: see :class:`kiefer.client.KieferClient`
+    :param single_flight: :class:`AsyncSingleFlight` coalescing identical
+                          concurrent GET requests, may be shared between
+                          clients of the same event loop.
+    :param timeout: ``(connect, read)`` timeout in seconds, see
+                    :class:`kiefer.client.KieferClient`
+    :param circuit_breaker: :class:`kiefer.ratelimit.CircuitBreaker`, may be
+                            shared with synchronous clients.
+    """
+
+    def __init__(self, access_token, session=None, semaphore=None,
+                 max_concurrency=100, rate_limiter=None, retry=None,
+                 lazy=False, hooks=None, single_flight=None,
+                 timeout=KieferClient.DEFAULT_TIMEOUT, circuit_breaker=None):
+        if aiohttp is None:
+            raise ImportError('The asyncio client requires aiohttp.')
+        self._set_access_token(access_token)
+        self._owns_session = session is None
+        self.session = session
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(max_concurrency)
+        self._semaphore = semaphore
+        self.rate_limiter = rate_limiter
+        self.retry = retry
+        self.lazy = lazy
+        self.hooks = list(hooks or ())
+        self.single_flight = single_flight
+        if timeout is not None:
+            if not isinstance(timeout, tuple):
+                timeout = (timeout, timeout)
+            timeout = aiohttp.ClientTimeout(sock_connect=timeout[0],
+                                            sock_read=timeout[1])
+        self.timeout = timeout
+        self.circuit_breaker = circuit_breaker
+
+    async def close(self):
+        """Close the underlying session, unless it was passed in by the caller."""
+        if self._owns_session and self.session is not None:
+            await self.session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def get_many(self, resource, xids):
+        """
+        Asynchronous variant of :func:`kiefer.client.KieferClient.get_many`.
+
+        The number of concurrent requests is bounded by the client's
+        semaphore.
+        """
+        method = self._endpoint(resource)
+
+        async def call(xid):
+            try:
+                return BatchResult(xid, await method(xid), None)
+            except Exception as e:
+                return BatchResult(xid, None, e)
+
+        for future in asyncio.as_completed([call(xid) for xid in xids]):
+            yield await future
+
+    async def download_many(self, resource, xids, directory,
+                            overwrite=False):
+        """
+        Asynchronous variant of
+        :func:`kiefer.client.KieferClient.download_many`.
+        """
+        if not resource.endswith('_graph'):
+            raise KieferClientError(
+                "Can't download '{}', only graphs.".format(resource))
+        method = self._endpoint(resource)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        async def call(xid):
+            path = os.path.join(directory, '{}.png'.format(xid))
+            try:
+                if overwrite or not os.path.exists(path):
+                    await method(xid, path)
+                return BatchResult(xid, path, None)
+            except Exception as e:
+                return BatchResult(xid, None, e)
+
+        for future in asyncio.as_completed([call(xid) for xid in xids]):
+            yield await future
+
+    # Request helper methods
+
+    async def _iter_items(self, endpoint, payload=None, prefetch=False):
+        page = await self._get(endpoint, payload)
+        pending = None
+        try:
+            while True:
+                link = next_link(page)
+                next_url = link and urljoin(self.BASE_URL, link)
+                if next_url and prefetch:
+                    pending = asyncio.ensure_future(self._get_url(next_url))
+                for item in page['data']['items']:
+                    yield item
+                if not next_url:
+                    return
+                if pending is None:
+                    page = await self._get_url(next_url)
+                else:
+                    page, pending = await pending, None
+        finally:
+            if pending is not None:
+                pending.cancel()
+
+    async def _stream(self, endpoint, payload=None, path=('data', 'items')):
+        if self.session is None:
+            self.session = create_async_session()
+        start = _clock()
+        if self.rate_limiter is not None:
+            await asyncio.sleep(self.rate_limiter.reserve(self._token_key))
+        headers = {'Authorization': 'Bearer {}'.format(await self._token())}
+        req_url = self.BASE_URL + endpoint
+        self._check_circuit_emit('GET', req_url, start, 0)
+        success = None
+        status, ttfb, download, received, error = 0, 0.0, 0.0, 0, None
+        try:
+            async with self._semaphore:
+                sent = _clock()
+                async with self.session.request('GET', req_url,
+                                                headers=headers,
+                                                params=_encode(payload),
+                                                timeout=self.timeout) as r:
+                    ttfb = _clock() - sent
+                    status = r.status
+                    success = r.status < 500
+                    try:
+                        if r.status != 200:
+                            raw = await r.read()
+                            received = len(raw)
+                            check_status(r.status, lambda: loads(raw), 200,
+                                         KieferClientError)
+                        parser = ItemStreamParser(path)
+                        async for chunk in r.content.iter_chunked(
+                                self.STREAM_CHUNK_SIZE):
+                            received += len(chunk)
+                            for item in parser.feed(chunk):
+                                yield item
+                        parser.close()
+                    finally:
+                        download = _clock() - sent - ttfb
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            success = False
+            error = type(e).__name__
+            raise
+        except asyncio.CancelledError as e:
+            error = type(e).__name__
+            raise
+        finally:
+            self._record(req_url, success)
+            if self.hooks:
+                self._emit('GET', req_url, status, ttfb, download, 0.0, start,
+                           received, 0, error)
+
+    def _check_circuit(self, req_url):
+        host = urlsplit(req_url).netloc
+        if self.circuit_breaker is not None and \
+                not self.circuit_breaker.allow(host):
+            raise CircuitOpenError(
+                'Circuit open for {}, not sending request.'.format(host))
+
+    def _check_circuit_emit(self, method, req_url, start, attempt):
+        try:
+            self._check_circuit(req_url)
+        except CircuitOpenError as e:
+            if self.hooks:
+                self._emit(method, req_url, 0, 0.0, 0.0, 0.0, start, 0,
+                           attempt, type(e).__name__)
+            raise
+
+    def _record(self, req_url, success):
+        # ``success`` is None if the request was cancelled before its
+        # outcome was known
+        if self.circuit_breaker is not None:
+            host = urlsplit(req_url).netloc
+            if success is None:
+                self.circuit_breaker.release(host)
+            else:
+                self.circuit_breaker.record(host, success)
+
+    async def _token(self):
+        # Refreshing blocks, keep it off the event loop
+        if self.token_provider is not None and \
+                self.token_provider.expires_soon():
+            return await asyncio.get_event_loop().run_in_executor(
+                None, self.token_provider.get_token)
+        return self.access_token
+
+    def _get_archived(self, endpoint, decoder=None):
+        # The response archive is only supported by the synchronous client
+        return self._get(endpoint, decoder=decoder)
+
+    async def _get_url(self, req_url, payload=None, decoder=None):
+        if self.single_flight is None:
+            body = await self._request('GET', req_url, 200,
+                                       params=_encode(payload))
+        else:
+            body = await self.single_flight.do(
+                cache_key(self._token_key, req_url, payload),
+                lambda: self._request('GET', req_url, 200,
+                                      params=_encode(payload)))
+        return body if decoder is None else decoder(body)
+
+    async def _download(self, endpoint, target=None):
+        # The image is read completely before it is written to ``target``
+        data = await self._request('GET', self.BASE_URL + endpoint, 200,
+                                   binary=True)
+        if target is None:
+            return data
+        return _write_chunks(target, [data])
+
+    def _post(self, endpoint, payload):
+        return self._request('POST', self.BASE_URL + endpoint, [200, 201],
+                             data=_encode(payload))
+
+    def _delete(self, endpoint):
+        return self._request('DELETE', self.BASE_URL + endpoint, 200)
+
+    async def _request(self, method, req_url, expected_status,
+                       binary=False, **kwargs):
+        if self.session is None:
+            self.session = create_async_session()
+        start = _clock()
+        attempt = 0
+        refreshed = False
+        while True:
+            if self.rate_limiter is not None:
+                await asyncio.sleep(self.rate_limiter.reserve(self._token_key))
+            token = await self._token()
+            headers = {'Authorization': 'Bearer {}'.format(token)}
+            self._check_circuit_emit(method, req_url, start, attempt)
+            async with self._semaphore:
+                sent = _clock()
+                success = None
+                error = None
+                try:
+                    async with self.session.request(method, req_url,
+                                                    headers=headers,
+                                                    timeout=self.timeout,
+                                                    **kwargs) as r:
+                        ttfb = _clock() - sent
+                        raw = await r.read()
+                        download = _clock() - sent - ttfb
+                    success = r.status < 500
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    success = False
+                    error = type(e).__name__
+                    raise
+                except asyncio.CancelledError as e:
+                    error = type(e).__name__
+                    raise
+                finally:
+                    self._record(req_url, success)
+                    if error is not None and self.hooks:
+                        self._emit(method, req_url, 0, 0.0, 0.0, 0.0, start,
+                                   0, attempt, error)
+            if self.rate_limiter is not None:
+                self.rate_limiter.update(self._token_key, r.status, r.headers)
+            if r.status == 401 and self.token_provider is not None \
+                    and not refreshed:
+                await asyncio.get_event_loop().run_in_executor(
+                    None, self.token_provider.refresh, token)
+                refreshed = True
+                continue
+            if self.retry is None or not self.retry.should_retry(
+                    method, r.status, attempt):
+                break
+            await asyncio.sleep(
+                self.retry.delay(attempt, r.headers.get('Retry-After')))
+            attempt += 1
+        decode = 0.0
+        try:
+            check_status(r.status, lambda: loads(raw), expected_status,
+                         KieferClientError)
+            decode_start = _clock()
+            if binary:
+                body = memoryview(raw)
+            elif self.lazy:
+                body = LazyResponse(raw)
+            else:
+                body = loads(raw)
+            decode = _clock() - decode_start
+        finally:
+            if self.hooks:
+                self._emit(method, req_url, r.status, ttfb, download, decode,
+                           start, len(raw), attempt)
+        return body
@@ -0,0 +1,183 @@
+"""
+On-disk archive of raw responses that no longer change.
+
+Ticks of past moves, sleeps and workouts never change once they are
+complete. :class:`ResponseArchive` keeps their raw bodies compressed in an
+append-only segment file; clients created with ``archive=...`` serve them
+from there instead of downloading them again.
+
+Layout of the archive directory:
+
+- ``segments.dat``: compressed bodies, appended one after another
+- ``index.jsonl``: one ``[key, offset, length, codec]`` line per body,
+  written after the body itself, so a crash never leaves an index entry
+  pointing at a partial body
+
+Reads go through a read-only :mod:`mmap` of the segment file. Writers
+hold an exclusive ``fcntl`` lock, so several processes can share one
+archive; entries written by other processes are picked up from the tail
+of the index.
+"""
+import io
+import json
+import mmap
+import os
+import threading
+import time
+import zlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _compress(data, codec):
+    if codec == 'br':
+        return brotli.compress(data)
+    if codec == 'zlib':
+        return zlib.compress(data, 6)
+    return data
+
+
+def _decompress(data, codec):
+    if codec == 'br':
+        return brotli.decompress(data)
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    return data
+
+
+class ResponseArchive(object):
+    """
+    Append-only store of compressed response bodies.
+
+    :param directory: ``str``, archive directory, created if missing
+    :param codec: ``'br'`` (requires the ``brotli`` package), ``'zlib'`` or
+                  ``None``; defaults to ``'br'`` if available, else ``'zlib'``
+    :param settle_time: ``float``, seconds after its last tick until a
+                        response is considered complete and archived
+    """
+
+    def __init__(self, directory, codec='auto', settle_time=2 * 24 * 60 * 60):
+        if codec == 'auto':
+            codec = 'br' if brotli is not None else 'zlib'
+        if codec == 'br' and brotli is None:
+            raise ImportError("Codec 'br' requires the brotli package.")
+        self.directory = directory
+        self.codec = codec
+        self.settle_time = settle_time
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._segment_path = os.path.join(directory, 'segments.dat')
+        self._index_path = os.path.join(directory, 'index.jsonl')
+        self._lock = threading.Lock()
+        self._index = {}
+        self._index_pos = 0
+        self._map = None
+        self._segments = None
+        with self._lock:
+            self._read_index()
+
+    def _read_index(self):
+        try:
+            f = io.open(self._index_path, 'rb')
+        except IOError:
+            return
+        with f:
+            f.seek(self._index_pos)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # Entry is being written by another process
+                    break
+                key, offset, length, codec = json.loads(line.decode('utf-8'))
+                self._index[key] = (offset, length, codec)
+                self._index_pos += len(line)
+
+    def __contains__(self, key):
+        with self._lock:
+            if key not in self._index:
+                self._read_index()
+            return key in self._index
+
+    def __len__(self):
+        with self._lock:
+            self._read_index()
+            return len(self._index)
+
+    def get(self, key):
+        """
+        Return the body stored for ``key`` or ``None``.
+
+        :param key: ``str``, e.g. ``'moves/<xid>/ticks'``
+        """
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                self._read_index()
+                entry = self._index.get(key)
+                if entry is None:
+                    return None
+            offset, length, codec = entry
+            if self._map is None or offset + length > len(self._map):
+                self._remap()
+            data = self._map[offset:offset + length]
+        return _decompress(data, codec)
+
+    def _remap(self):
+        if self._map is not None:
+            self._map.close()
+            self._segments.close()
+        self._segments = io.open(self._segment_path, 'rb')
+        self._map = mmap.mmap(self._segments.fileno(), 0,
+                              access=mmap.ACCESS_READ)
+
+    def put(self, key, body):
+        """
+        Store ``body`` for ``key``; a second body for the same key
+        replaces the first one for all further reads.
+
+        :param key: ``str``
+        :param body: ``bytes``, uncompressed response body
+        """
+        data = _compress(body, self.codec)
+        with self._lock:
+            with io.open(self._segment_path, 'ab') as segments:
+                if fcntl is not None:
+                    fcntl.flock(segments.fileno(), fcntl.LOCK_EX)
+                try:
+                    offset = segments.seek(0, os.SEEK_END)
+                    segments.write(data)
+                    segments.flush()
+                    os.fsync(segments.fileno())
+                    line = json.dumps([key, offset, len(data), self.codec])
+                    with io.open(self._index_path, 'ab') as index:
+                        index.write(line.encode('utf-8') + b'\n')
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(segments.fileno(), fcntl.LOCK_UN)
+            self._read_index()
+
+    def is_settled(self, body):
+        """
+        Return ``True`` if a decoded ticks response is complete, i.e. its
+        last tick is older than ``settle_time``.
+        """
+        items = body['data']['items']
+        if not items:
+            return False
+        return time.time() - max(item['time'] for item in items) > \
+            self.settle_time
+
+    def close(self):
+        """Release the memory map."""
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._segments.close()
+                self._map = self._segments = None
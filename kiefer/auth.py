@@ -1,5 +1,7 @@
 import json
 import os
+import threading
+import time
 
 from requests_oauthlib import OAuth2Session
 import requests
@@ -30,6 +32,13 @@ class KieferAuth(object):
     refresh token or to refresh your access token.
 
     :param config_path: :class:`str`, path to config file.
+    :param token_store: token store from :mod:`kiefer.tokenstore`. Tokens in
+                        the store take precedence over the config file and
+                        new tokens are saved to it.
+    :param user: :class:`str`, key of the user's tokens in the store.
+    :param timeout: ``(connect, read)`` timeout of token requests in
+                    seconds; a refresh holds the user's lock in the token
+                    store, so it must not hang.
     """
     # Don't check scopes after retrieving token, UP API returns no scopes
     os.environ['OAUTHLIB_RELAX_TOKEN_SCOPE'] = '1'
@@ -38,11 +47,13 @@ class KieferAuth(object):
     _token_url = _BASE_URL + 'auth/oauth2/token'
     _refresh_token_url = _BASE_URL + '/nudge/api/v.1.1/users/@me/refreshToken'
 
-    def __init__(self, config_path):
+    def __init__(self, config_path, token_store=None, user='default',
+                 timeout=(5, 30)):
         if not os.path.isfile(config_path):
             raise IOError("No such file '{}'".format(config_path))
 
-        self._config = json.load(open(config_path))
+        with open(config_path) as f:
+            self._config = json.load(f)
         self.client_id = self._config['client_id']
         self.client_secret = self._config['client_secret']
         self.redirect_uri = self._config['redirect_uri']
@@ -51,6 +62,14 @@ class KieferAuth(object):
             self.access_token = self._config['access_token']
         if 'refresh_token' in self._config:
             self.refresh_token = self._config['refresh_token']
+        self.expires_at = self._config.get('expires_at')
+        self.token_store = token_store
+        self.user = user
+        self.timeout = timeout
+        if token_store is not None:
+            stored = token_store.load(user)
+            if stored is not None:
+                self._apply_stored(stored)
 
     def _create_session(self):
         return OAuth2Session(client_id=self.client_id,
@@ -61,7 +80,7 @@ class KieferAuth(object):
         return session.fetch_token(self._token_url,
                                    authorization_response=auth_response,
                                    client_secret=self.client_secret,
-                                   method='GET')
+                                   method='GET', timeout=self.timeout)
 
     def get_access_token(self):
         """
@@ -75,8 +94,7 @@ class KieferAuth(object):
         print('Please go to this URL and grant access: {}'.format(auth_url))
         auth_response = _get_input('Please enter the full callback URL: ')
         token = self._get_token(session, auth_response)
-        self.access_token = token['access_token']
-        self.refresh_token = token['refresh_token']
+        self._set_token(token)
         return self.access_token, self.refresh_token
 
     def set_access_token(self, token):
@@ -122,10 +140,94 @@ class KieferAuth(object):
 
         :return: access token
         """
+        if self.token_store is None:
+            return self._refresh_access_token()
+        with self.token_store.lock(self.user):
+            stored = self.token_store.load(self.user)
+            if stored is not None and \
+                    stored['access_token'] != getattr(self, 'access_token', None):
+                # Another process refreshed already, its refresh token
+                # replaced ours
+                self._apply_stored(stored)
+                return self.access_token, self.refresh_token
+            return self._refresh_access_token()
+
+    def _refresh_access_token(self):
         payload = {'client_id': self.client_id,
                    'client_secret': self.client_secret}
         session = OAuth2Session(client_id=self.client_id)
-        r = session.refresh_token(self._token_url, self.refresh_token, **payload)
-        self.access_token = r['access_token']
-        self.refresh_token = r['refresh_token']
+        r = session.refresh_token(self._token_url, self.refresh_token,
+                                  timeout=self.timeout, **payload)
+        self._set_token(r)
         return self.access_token, self.refresh_token
+
+    def _set_token(self, token):
+        self.access_token = token['access_token']
+        self.refresh_token = token['refresh_token']
+        if token.get('expires_in'):
+            self.expires_at = time.time() + float(token['expires_in'])
+        if self.token_store is not None:
+            self.token_store.save(self.user, {
+                'access_token': self.access_token,
+                'refresh_token': self.refresh_token,
+                'expires_at': self.expires_at})
+
+    def _apply_stored(self, stored):
+        self.access_token = stored['access_token']
+        self.refresh_token = stored.get('refresh_token')
+        self.expires_at = stored.get('expires_at')
+
+
+class TokenProvider(object):
+    """
+    Supplies access tokens to :class:`kiefer.client.KieferClient` and
+    refreshes them when needed.
+
+    Pass it to the client instead of an access token. The token is
+    refreshed shortly before it expires and whenever the API answers with
+    ``401``. Refreshes are single-flight: if many threads notice an expired
+    token at once, only one of them refreshes it while the others wait and
+    then use the new token.
+
+    ::
+
+        provider = TokenProvider(KieferAuth('config.json'))
+        client = KieferClient(provider)
+
+    :param auth: :class:`KieferAuth` with access and refresh token set
+    :param refresh_margin: ``float``, seconds before expiry to refresh
+    :param key: stable identifier of the user, used by caches and rate
+                limiters. Defaults to the initial access token.
+    """
+
+    def __init__(self, auth, refresh_margin=300, key=None):
+        self.auth = auth
+        self.refresh_margin = refresh_margin
+        self.key = key or auth.access_token
+        self._lock = threading.Lock()
+
+    def expires_soon(self):
+        """``True`` if the token expires within ``refresh_margin`` seconds."""
+        expires_at = getattr(self.auth, 'expires_at', None)
+        return expires_at is not None and \
+            time.time() > expires_at - self.refresh_margin
+
+    def get_token(self):
+        """Return a valid access token, refreshing it if it expires soon."""
+        token = self.auth.access_token
+        if self.expires_soon():
+            token = self.refresh(token)
+        return token
+
+    def refresh(self, stale_token):
+        """
+        Refresh the access token, unless another thread already replaced
+        ``stale_token`` in the meantime.
+
+        :param stale_token: ``str``, the token that was found to be expired
+        :return: the new access token
+        """
+        with self._lock:
+            if self.auth.access_token == stale_token:
+                self.auth.refresh_access_token()
+            return self.auth.access_token
@@ -0,0 +1,117 @@
+"""
+Parallel backfill of long histories.
+
+Following the pagination links of a multi-year history is one request
+after another. :func:`backfill` splits the time range into windows
+(``start_time``/``end_time``) and fetches several windows at once. Items
+are yielded oldest first; items on a window border, which the API returns
+for both windows, are yielded once.
+
+The window size adapts to the data: after every window the size is set so
+that the next window holds about ``target_items`` items, e.g. one page.
+"""
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from kiefer.sync import RESOURCES
+
+_DAY = 24 * 60 * 60
+
+
+def _fetch_window(client, method, start, end, params):
+    items = list(getattr(client, method)(start_time=start, end_time=end,
+                                         **params))
+    items.sort(key=lambda item: item.get('time_created') or 0)
+    return items
+
+
+class WindowSizer(object):
+    """
+    Adapts the window size to the observed item density.
+
+    :param initial: ``float``, size of the first windows in seconds
+    :param target_items: ``int``, desired number of items per window
+    :param min_window: ``float``, smallest window in seconds
+    :param max_window: ``float``, largest window in seconds
+    """
+
+    def __init__(self, initial=30 * _DAY, target_items=100, min_window=_DAY,
+                 max_window=365 * _DAY):
+        self.size = initial
+        self.target_items = target_items
+        self.min_window = min_window
+        self.max_window = max_window
+
+    def observe(self, seconds, count):
+        """Adjust the size after a window of ``seconds`` held ``count`` items."""
+        if count == 0:
+            size = seconds * 2
+        else:
+            size = seconds * float(self.target_items) / count
+        self.size = min(self.max_window, max(self.min_window, size))
+
+
+def backfill(client, resource, start_time, end_time, max_workers=8,
+             sizer=None, **params):
+    """
+    Fetch all items of ``resource`` between ``start_time`` and ``end_time``
+    with up to ``max_workers`` concurrent requests.
+
+    ::
+
+        for move in backfill(client, 'moves', start, end, max_workers=8):
+            ...
+
+    :param client: :class:`kiefer.client.KieferClient`; its session should
+                   have at least ``max_workers`` pooled connections
+    :param resource: ``str``, name in ``kiefer.sync.RESOURCES``, e.g.
+                     ``'moves'``, ``'sleeps'`` or ``'heartrates'``
+    :param start_time: ``int``, unix timestamp
+    :param end_time: ``int``, unix timestamp
+    :param max_workers: ``int``, number of windows fetched concurrently
+    :param sizer: :class:`WindowSizer`, controls the window size
+    :param params: further query parameters, e.g. ``limit``
+    :return: generator of items, ordered by ``time_created``
+    """
+    method = 'iter_' + RESOURCES[resource][len('get_'):]
+    sizer = sizer or WindowSizer()
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending = {}
+    done = {}
+    cursor = start_time
+    next_index = emit_index = 0
+    border = set()
+    try:
+        while True:
+            # Finished windows wait in ``done`` until all earlier ones are
+            # yielded; stop submitting while too many of them pile up
+            while cursor < end_time and len(pending) < max_workers and \
+                    len(pending) + len(done) < 2 * max_workers:
+                window_end = min(end_time, cursor + int(sizer.size))
+                future = executor.submit(_fetch_window, client, method,
+                                         cursor, window_end, params)
+                pending[future] = (next_index, cursor, window_end)
+                next_index += 1
+                cursor = window_end
+            if not pending and emit_index == next_index:
+                return
+            finished, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for future in finished:
+                index, start, end = pending.pop(future)
+                items = future.result()
+                sizer.observe(max(end - start, 1), len(items))
+                done[index] = items
+            while emit_index in done:
+                items = done.pop(emit_index)
+                emit_index += 1
+                xids = set()
+                for item in items:
+                    xid = item.get('xid')
+                    if xid in border or xid in xids:
+                        continue
+                    xids.add(xid)
+                    yield item
+                border = xids
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
@@ -0,0 +1,201 @@
+"""
+Helpers to run many UP API requests concurrently.
+"""
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+BatchResult = namedtuple('BatchResult', ['key', 'result', 'error'])
+BatchResult.__doc__ = """
+Outcome of a single request of a batch.
+
+Exactly one of ``result`` and ``error`` is set, ``key`` is the xid
+(or access token) the request was made for.
+"""
+
+
+def fan_out(func, keys, max_workers=8):
+    """
+    Call ``func(key)`` for every key on a thread pool.
+
+    Results are yielded as :class:`BatchResult` in order of completion.
+    A failing call does not abort the batch, its exception is returned as
+    ``error`` instead. At most ``2 * max_workers`` calls are pending at any
+    time, so ``keys`` may be a (long) generator.
+
+    :param func: callable taking a single key
+    :param keys: iterable of keys, e.g. xids
+    :param max_workers: ``int``, number of threads
+    """
+    def call(key):
+        try:
+            return BatchResult(key, func(key), None)
+        except Exception as e:
+            return BatchResult(key, None, e)
+
+    keys = iter(keys)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        for key in keys:
+            pending.add(executor.submit(call, key))
+            if len(pending) >= 2 * max_workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def get_many_users(access_tokens, resource, max_workers=8, session=None,
+                   **kwargs):
+    """
+    Call the same endpoint for many users concurrently.
+
+    All clients share one connection pool. The ``key`` of every
+    :class:`BatchResult` is the access token the request was made with.
+
+    ::
+
+        for res in get_many_users(tokens, 'moves', date=20150601):
+            ...
+
+    :param access_tokens: iterable of access tokens
+    :param resource: ``str``, endpoint name without ``get_`` prefix,
+                     e.g. ``'moves'`` for :func:`KieferClient.get_moves`
+    :param max_workers: ``int``, number of threads
+    :param session: :class:`requests.Session` shared by all clients,
+                    a new one sized for ``max_workers`` is created if omitted
+    :param kwargs: passed on to the endpoint method
+    """
+    from kiefer.client import KieferClient, create_session
+    if session is None:
+        session = create_session(pool_maxsize=max_workers)
+
+    def call(access_token):
+        client = KieferClient(access_token, session=session)
+        return client._endpoint(resource)(**kwargs)
+
+    return fan_out(call, access_tokens, max_workers)
+
+
+WriteResult = namedtuple('WriteResult', ['index', 'method', 'result', 'error',
+                                         'attempts'])
+WriteResult.__doc__ = """
+Outcome of a single record of a :class:`WriteQueue`.
+
+``index`` is the position of the record in the queue, ``method`` the name
+of the client method, ``attempts`` the number of requests made.
+"""
+
+
+class WriteQueue(object):
+    """
+    Sends many ``add_*``, ``update_*`` and ``delete_*`` calls concurrently.
+
+    Records of the same user are sent one after another in the order they
+    were added, records of different users in parallel. Records that fail
+    with a transient error are retried with backoff, before the next record
+    of that user is sent.
+
+    A write is only retried if it can't have been applied twice: throttled
+    (429) requests and connection errors are retried for every method,
+    timeouts after the request was sent and server errors only for
+    deletes, which are idempotent.
+
+    ::
+
+        queue = WriteQueue(max_workers=8)
+        for meal in meals:
+            queue.add(client, 'add_meal', **meal)
+        for res in queue.run():
+            if res.error is not None:
+                print(res.index, res.error)
+
+    :param max_workers: ``int``, number of users written concurrently
+    :param max_retries: ``int``, retries per record
+    :param retry_on: exception classes retried for every method, replaces
+                     the defaults described above
+    :param retry: :class:`kiefer.ratelimit.RetryPolicy` deciding which
+                  error statuses are retried and computing the backoff
+    """
+
+    def __init__(self, max_workers=8, max_retries=3, retry_on=None,
+                 retry=None):
+        from kiefer.ratelimit import RetryPolicy
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.retry_on = tuple(retry_on) if retry_on is not None else None
+        self.retry = retry or RetryPolicy()
+        self._records = []
+
+    def __len__(self):
+        return len(self._records)
+
+    def add(self, client, method, *args, **kwargs):
+        """
+        Queue a write.
+
+        :param client: :class:`kiefer.client.KieferClient` of the user
+        :param method: ``str``, client method, e.g. ``'add_meal'``
+        :param args: positional arguments, e.g. the xid for updates
+        :param kwargs: keyword arguments of the method
+        :return: ``int``, index of the record in the report
+        """
+        if not method.startswith(('add_', 'update_', 'delete_')):
+            raise ValueError("'{}' is not a write method.".format(method))
+        getattr(client, method)  # fail early on unknown methods
+        self._records.append((client, method, args, kwargs))
+        return len(self._records) - 1
+
+    def run(self):
+        """
+        Send all queued records and empty the queue.
+
+        :return: ``list`` of :class:`WriteResult`, in the order the records
+                 were added
+        """
+        records, self._records = self._records, []
+        groups = {}
+        for index, record in enumerate(records):
+            groups.setdefault(record[0]._token_key, []).append((index, record))
+
+        def send_group(group):
+            return [self._send(index, *record) for index, record in group]
+
+        report = [None] * len(records)
+        for res in fan_out(send_group, groups.values(), self.max_workers):
+            if res.error is not None:
+                raise res.error
+            for write_result in res.result:
+                report[write_result.index] = write_result
+        return report
+
+    def _is_transient(self, method, error, attempt):
+        import requests
+        http_method = 'delete' if method.startswith('delete_') else 'post'
+        if self.retry_on is not None:
+            return isinstance(error, self.retry_on)
+        status_code = getattr(error, 'status_code', None)
+        if status_code is not None:
+            return self.retry.should_retry(http_method, status_code, attempt)
+        if http_method == 'delete':
+            return isinstance(error, (requests.ConnectionError,
+                                      requests.Timeout))
+        # A read timeout may hit after the server applied the write
+        return isinstance(error, requests.ConnectionError)
+
+    def _send(self, index, client, method, args, kwargs):
+        attempt = 0
+        while True:
+            try:
+                result = getattr(client, method)(*args, **kwargs)
+                return WriteResult(index, method, result, None, attempt + 1)
+            except Exception as e:
+                if attempt >= self.max_retries or \
+                        not self._is_transient(method, e, attempt):
+                    return WriteResult(index, method, None, e, attempt + 1)
+            time.sleep(self.retry.delay(attempt))
+            attempt += 1
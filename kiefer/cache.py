@@ -0,0 +1,238 @@
+"""
+Response caches for :class:`kiefer.client.KieferClient`.
+
+A cache maps a key built from access token, URL and query parameters to a
+:class:`CacheEntry`. Every entry is tagged with the token and the resource
+it belongs to (e.g. ``meals``), so that writes can invalidate all cached
+responses of that resource.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from kiefer.util import loads
+
+try:
+    from urllib.parse import urlencode
+except ImportError:
+    from urllib import urlencode
+
+
+def _dumps(body):
+    raw = getattr(body, 'raw', None)
+    if raw is not None:
+        # Lazy responses are stored without decoding them
+        return raw.decode('utf-8') if isinstance(raw, bytes) else raw
+    return json.dumps(body)
+
+
+def _token_hash(access_token):
+    # Don't keep plain access tokens in (on-disk) caches
+    return hashlib.sha256(access_token.encode('utf-8')).hexdigest()[:16]
+
+
+def resource_name(endpoint):
+    """
+    Name of the resource an endpoint belongs to.
+
+    ``'users/@me/meals'``, ``'meals/xid'`` and ``'/meals/xid/partialUpdate'``
+    all belong to ``'meals'``.
+
+    :param endpoint: ``str``, endpoint path relative to the API base URL
+    """
+    parts = [part for part in endpoint.split('?')[0].split('/') if part]
+    if parts[:2] == ['users', '@me']:
+        parts = parts[2:] or ['users']
+    return parts[0] if parts else ''
+
+
+def cache_key(access_token, url, params=None):
+    """
+    Build the cache key for a GET request.
+
+    :param access_token: ``str``
+    :param url: ``str``, request URL
+    :param params: ``dict`` of query parameters
+    """
+    query = urlencode(sorted((params or {}).items()))
+    return '{} {}?{}'.format(_token_hash(access_token), url, query)
+
+
+def cache_tag(access_token, endpoint):
+    """
+    Build the invalidation tag for an endpoint.
+
+    :param access_token: ``str``
+    :param endpoint: ``str``, endpoint path relative to the API base URL
+    """
+    return '{} {}'.format(_token_hash(access_token), resource_name(endpoint))
+
+
+class CacheEntry(object):
+    """
+    A cached response body and its HTTP validators.
+
+    :param body: decoded response body
+    :param expires: ``float``, unix timestamp after which the entry is stale
+    :param etag: value of the ``ETag`` response header
+    :param last_modified: value of the ``Last-Modified`` response header
+    """
+    __slots__ = ('body', 'expires', 'etag', 'last_modified')
+
+    def __init__(self, body, expires, etag=None, last_modified=None):
+        self.body = body
+        self.expires = expires
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def is_fresh(self):
+        return time.time() < self.expires
+
+    def conditional_headers(self):
+        """Request headers to revalidate a stale entry."""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class BaseCache(object):
+    """
+    Interface of response caches.
+
+    :param ttl: ``float``, seconds a response is served without asking the
+                API again. Stale entries with validators are revalidated.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+
+    def create_entry(self, body, headers):
+        """
+        Create an entry for a response that expires after ``ttl``.
+
+        :param body: decoded response body
+        :param headers: response headers
+        """
+        return CacheEntry(body, time.time() + self.ttl,
+                          headers.get('ETag'), headers.get('Last-Modified'))
+
+    def get(self, key):
+        """Return the :class:`CacheEntry` for ``key`` or ``None``."""
+        raise NotImplementedError
+
+    def set(self, key, tag, entry):
+        """Store ``entry`` under ``key`` and tag it with ``tag``."""
+        raise NotImplementedError
+
+    def invalidate(self, tag):
+        """Remove all entries tagged with ``tag``."""
+        raise NotImplementedError
+
+
+class MemoryCache(BaseCache):
+    """
+    Thread-safe in-memory LRU cache.
+
+    Bodies are kept as JSON text and decoded on every hit, so callers can
+    modify the responses they get without changing the cache.
+
+    :param maxsize: ``int``, maximum number of entries
+    :param ttl: ``float``, see :class:`BaseCache`
+    """
+
+    def __init__(self, maxsize=1024, ttl=300):
+        super(MemoryCache, self).__init__(ttl)
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            tag, entry = self._entries.pop(key)
+            self._entries[key] = tag, entry
+        return CacheEntry(loads(entry.body), entry.expires, entry.etag,
+                          entry.last_modified)
+
+    def set(self, key, tag, entry):
+        entry = CacheEntry(_dumps(entry.body), entry.expires, entry.etag,
+                           entry.last_modified)
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = tag, entry
+            self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate(self, tag):
+        with self._lock:
+            for key in list(self._tags.get(tag, ())):
+                self._discard(key)
+
+    def _discard(self, key):
+        if key in self._entries:
+            tag, _ = self._entries.pop(key)
+            self._tags[tag].discard(key)
+            if not self._tags[tag]:
+                del self._tags[tag]
+
+
+class SQLiteCache(BaseCache):
+    """
+    On-disk cache backed by sqlite, can be shared between processes.
+
+    :param path: ``str``, path of the database file
+    :param ttl: ``float``, see :class:`BaseCache`
+    """
+
+    def __init__(self, path, ttl=300):
+        super(SQLiteCache, self).__init__(ttl)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS cache ('
+                               'key TEXT PRIMARY KEY, tag TEXT, body TEXT, '
+                               'expires REAL, etag TEXT, last_modified TEXT)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS cache_tag '
+                               'ON cache (tag)')
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT body, expires, etag, last_modified FROM cache '
+                'WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        return CacheEntry(json.loads(row[0]), *row[1:])
+
+    def set(self, key, tag, entry):
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?, ?)',
+                (key, tag, _dumps(entry.body), entry.expires, entry.etag,
+                 entry.last_modified))
+
+    def invalidate(self, tag):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM cache WHERE tag = ?', (tag,))
+
+    def purge(self):
+        """Delete stale entries that cannot be revalidated."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                'DELETE FROM cache WHERE expires < ? AND etag IS NULL '
+                'AND last_modified IS NULL', (time.time(),))
+
+    def close(self):
+        self._conn.close()
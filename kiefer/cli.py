@@ -0,0 +1,82 @@
+"""
+Command line interface, installed as ``kiefer``.
+
+::
+
+    kiefer export --tokens tokens.json --output export/ --format csv \\
+        --resources moves sleeps --workers 8
+
+``tokens.json`` maps user keys to access tokens. Progress is kept in
+``<output>/.export-state.json``; run the same command again to resume an
+interrupted export.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import sys
+
+from kiefer.client import KieferClient, create_session
+from kiefer.export import Exporter, TICK_RESOURCES, WRITERS
+from kiefer.sync import JSONFileStateStore, RESOURCES
+
+
+def export(args):
+    with open(args.tokens) as f:
+        tokens = json.load(f)
+    if not os.path.isdir(args.output):
+        os.makedirs(args.output)
+    state_store = JSONFileStateStore(
+        args.state or os.path.join(args.output, '.export-state.json'))
+    exporter = Exporter(args.output, args.format, args.resources,
+                        state_store, args.page_limit)
+    session = create_session(pool_maxsize=args.workers)
+    clients = dict((user, KieferClient(token, session=session))
+                   for user, token in tokens.items())
+    if args.base_url:
+        for client in clients.values():
+            client.BASE_URL = args.base_url
+    failed = 0
+    for res in exporter.export_users(clients, args.workers):
+        if res.error is not None:
+            failed += 1
+            print('{}: failed: {}'.format(res.key, res.error), file=sys.stderr)
+        else:
+            print('{}: {}'.format(res.key, ', '.join(
+                '{} {}'.format(count, resource)
+                for resource, count in sorted(res.result.items()))))
+    session.close()
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='kiefer')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    parser_export = commands.add_parser(
+        'export', help='export the data of many users to files')
+    parser_export.add_argument('--tokens', required=True,
+                               help='JSON file mapping users to access tokens')
+    parser_export.add_argument('--output', required=True,
+                               help='output directory')
+    parser_export.add_argument('--format', choices=sorted(WRITERS),
+                               default='jsonl')
+    parser_export.add_argument('--resources', nargs='+',
+                               choices=sorted(RESOURCES) + sorted(TICK_RESOURCES))
+    parser_export.add_argument('--workers', type=int, default=4,
+                               help='number of users exported in parallel')
+    parser_export.add_argument('--page-limit', type=int, default=100)
+    parser_export.add_argument('--state',
+                               help='state file, defaults to a file in the '
+                                    'output directory')
+    parser_export.add_argument('--base-url', help=argparse.SUPPRESS)
+    parser_export.set_defaults(func=export)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
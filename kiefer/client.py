@@ -1,22 +1,195 @@
+import io
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+try:
+    from urllib.parse import urljoin, urlsplit
+except ImportError:
+    from urlparse import urljoin, urlsplit
+
 import requests
-from kiefer.util import validate_response
+from requests.adapters import HTTPAdapter
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from kiefer.batch import fan_out
+from kiefer.cache import cache_key, cache_tag
+from kiefer.metrics import RequestEvent, endpoint_template
+from kiefer.stream import iter_items
+from kiefer.ticks import TickColumns
+from kiefer.util import (LazyResponse, _replace, loads, next_link,
+                         prefetch_iter, validate_response)
+
+
+try:
+    _clock = time.perf_counter
+except AttributeError:
+    _clock = time.time
 
 
 class KieferClientError(Exception):
     pass
 
 
+class CircuitOpenError(KieferClientError):
+    """Raised instead of sending a request while the circuit is open."""
+
+
+def create_session(pool_connections=10, pool_maxsize=10, pool_block=False,
+                   keep_alive=True):
+    """
+    Create a connection-pooled :class:`requests.Session` for the UP API.
+
+    A single session can be shared by many :class:`KieferClient` instances,
+    so that all of them reuse the same TCP/TLS connections to jawbone.com.
+
+    :param pool_connections: ``int``, number of host pools to cache.
+    :param pool_maxsize: ``int``, maximum number of connections kept per host.
+    :param pool_block: ``bool``, block when no free connection is available
+                       instead of opening an additional one.
+    :param keep_alive: ``bool``, keep connections open between requests.
+    :return: :class:`requests.Session`
+
+    Responses are requested gzip compressed, or brotli compressed if the
+    ``brotli`` package is installed.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections,
+                          pool_maxsize=pool_maxsize,
+                          pool_block=pool_block)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+    session.headers['Accept-Encoding'] = 'gzip, deflate' + (
+        ', br' if brotli is not None else '')
+    return session
+
+
+def _write_chunks(target, chunks, counter=None):
+    """
+    Write ``chunks`` to ``target``, a path or a file-like object, and
+    return the number of bytes written.
+    """
+    counter = [0] if counter is None else counter
+    if hasattr(target, 'write'):
+        for chunk in chunks:
+            target.write(chunk)
+            counter[0] += len(chunk)
+        return counter[0]
+    # Write to a temporary file first, so a failed download never leaves a
+    # partial file at ``target``
+    part = target + '.part'
+    try:
+        with io.open(part, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                counter[0] += len(chunk)
+        _replace(part, target)
+    except Exception:
+        if os.path.exists(part):
+            os.remove(part)
+        raise
+    return counter[0]
+
+
+def _tick_decoder(columnar):
+    return TickColumns.from_response if columnar else None
+
+
 class KieferClient(object):
     """
     Client class for the Jawbone UP API.
 
-    :param access_token: Your access token for the UP API.
+    :param access_token: Your access token for the UP API, or a
+                         :class:`kiefer.auth.TokenProvider` which refreshes
+                         expired tokens automatically.
+    :param session: :class:`requests.Session` to send requests with,
+                    see :func:`create_session`. Pass the same session to
+                    several clients to share one connection pool.
+                    If omitted, the client creates its own session.
+    :param cache: response cache for GET requests, e.g.
+                  :class:`kiefer.cache.MemoryCache` or
+                  :class:`kiefer.cache.SQLiteCache`. Writes invalidate the
+                  cached responses of the affected resource.
+    :param rate_limiter: :class:`kiefer.ratelimit.RateLimiter` pacing the
+                         requests, can be shared between clients and threads.
+    :param retry: :class:`kiefer.ratelimit.RetryPolicy` for throttled (429)
+                  and failed (5xx) requests.
+    :param lazy: ``bool``, return :class:`kiefer.util.LazyResponse` objects
+                 which are decoded on first access and expose the raw body.
+    :param hooks: callables receiving a :class:`kiefer.metrics.RequestEvent`
+                  after every request, e.g.
+                  :class:`kiefer.metrics.PrometheusCollector`.
+    :param single_flight: :class:`kiefer.util.SingleFlight`; concurrent GET
+                          requests with the same token, URL and parameters
+                          are sent only once and share the response. Share
+                          it between clients and threads.
+    :param archive: :class:`kiefer.archive.ResponseArchive`; ticks of
+                    completed moves, sleeps and workouts are stored there
+                    and never downloaded again.
+    :param timeout: ``(connect, read)`` timeout in seconds, or a single
+                    ``float`` for both; ``None`` waits forever.
+    :param circuit_breaker: :class:`kiefer.ratelimit.CircuitBreaker`;
+                            while it is open for the API host, requests
+                            raise :class:`CircuitOpenError` immediately.
+    :param hedge: :class:`kiefer.ratelimit.HedgePolicy`, send a second GET
+                  request if the first one is slower than usual.
     """
     BASE_URL = 'https://jawbone.com/nudge/api/v.1.1/'
-
-    def __init__(self, access_token):
-        self.access_token = access_token
-        self._headers = {'Authorization': 'Bearer {}'.format(self.access_token)}
+    STREAM_CHUNK_SIZE = 64 * 1024
+    DEFAULT_TIMEOUT = (5, 60)
+
+    def __init__(self, access_token, session=None, cache=None,
+                 rate_limiter=None, retry=None, lazy=False, hooks=None,
+                 single_flight=None, archive=None, timeout=DEFAULT_TIMEOUT,
+                 circuit_breaker=None, hedge=None):
+        self._set_access_token(access_token)
+        self._owns_session = session is None
+        self.session = create_session() if session is None else session
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self.retry = retry
+        self.lazy = lazy
+        self.hooks = list(hooks or ())
+        self.single_flight = single_flight
+        self.archive = archive
+        self.timeout = timeout
+        self.circuit_breaker = circuit_breaker
+        self.hedge = hedge
+
+    def _set_access_token(self, access_token):
+        if hasattr(access_token, 'get_token'):
+            self.token_provider = access_token
+            self._token_key = access_token.key
+        else:
+            self.token_provider = None
+            self._access_token = self._token_key = access_token
+
+    @property
+    def access_token(self):
+        """The current access token."""
+        if self.token_provider is not None:
+            return self.token_provider.get_token()
+        return self._access_token
+
+    @property
+    def _headers(self):
+        return {'Authorization': 'Bearer {}'.format(self.access_token)}
+
+    def close(self):
+        """Close the underlying session, unless it was passed in by the caller."""
+        if self._owns_session:
+            self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
     # Endpoint implementation
 
@@ -30,6 +203,14 @@ class KieferClient(object):
         """Get list of body events."""
         return self._get('users/@me/body_events', payload=kwargs)
 
+    def iter_body_events(self, prefetch=False, **kwargs):
+        """
+        Iterate over all body events, following the pagination links.
+
+        :param prefetch: ``bool``, fetch the next page in the background.
+        """
+        return self._iter_items('users/@me/body_events', kwargs, prefetch)
+
     def get_body_event(self, xid):
         """
         Get a single body event.
@@ -71,10 +252,35 @@ class KieferClient(object):
         """Get list of heart rates."""
         return self._get('users/@me/heartrates', kwargs)
 
+    def stream_heart_rates(self, **kwargs):
+        """
+        Stream heart rates, see :ref:`streaming`.
+
+        Only the requested page is streamed, use ``start_time``,
+        ``end_time`` and ``limit`` to select the range.
+        """
+        return self._stream('users/@me/heartrates', kwargs)
+
+    def iter_heart_rates(self, prefetch=False, **kwargs):
+        """
+        Iterate over all heart rates, following the pagination links.
+
+        :param prefetch: ``bool``, fetch the next page in the background.
+        """
+        return self._iter_items('users/@me/heartrates', kwargs, prefetch)
+
     def get_custom_events(self, **kwargs):
         """Get list of custom/generic events."""
         return self._get('users/@me/generic_events', kwargs)
 
+    def iter_custom_events(self, prefetch=False, **kwargs):
+        """
+        Iterate over all custom/generic events, following the pagination links.
+
+        :param prefetch: ``bool``, fetch the next page in the background.
+        """
+        return self._iter_items('users/@me/generic_events', kwargs, prefetch)
+
     # Goals
     def get_goals(self):
         """Get list of goals."""
@@ -98,6 +304,14 @@ class KieferClient(object):
         """Get list of meals."""
         return self._get('users/@me/meals', kwargs)
 
+    def iter_meals(self, prefetch=False, **kwargs):
+        """
+        Iterate over all meals, following the pagination links.
+
+        :param prefetch: ``bool``, fetch the next page in the background.
+        """
+        return self._iter_items('users/@me/meals', kwargs, prefetch)
+
     def get_meal(self, xid):
         """
         Get a single meal.
@@ -147,6 +361,14 @@ class KieferClient(object):
         """Get list of moods."""
         return self._get('users/@me/mood', kwargs)
 
+    def iter_moods(self, prefetch=False, **kwargs):
+        """
+        Iterate over all moods, following the pagination links.
+
+        :param prefetch: ``bool``, fetch the next page in the background.
+        """
+        return self._iter_items('users/@me/mood', kwargs, prefetch)
+
     def get_mood(self, xid):
         """
         Get a single mood.
@@ -183,6 +405,14 @@ class KieferClient(object):
         """Get list of moves."""
         return self._get('users/@me/moves', kwargs)
 
+    def iter_moves(self, prefetch=False, **kwargs):
+        """
+        Iterate over all moves, following the pagination links.
+
+        :param prefetch: ``bool``, fetch the next page in the background.
+        """
+        return self._iter_items('users/@me/moves', kwargs, prefetch)
+
     def get_move(self, xid):
         """
         Get a single move.
@@ -191,21 +421,47 @@ class KieferClient(object):
         """
         return self._get('moves/' + xid)
 
-    def get_move_graph(self, xid):
+    def get_move_graph(self, xid, target=None):
         """
         Get graph of a single move.
 
         :param xid: ``str``, move id
+        :param target: see :ref:`graphs`
         """
-        return self._get('/moves/{}/image'.format(xid))
+        return self._download('/moves/{}/image'.format(xid), target)
 
-    def get_move_ticks(self, xid):
+    def get_move_ticks(self, xid, columnar=False):
         """
         Get ticks of a single move.
 
         :param xid: ``str``, move id
+        :param columnar: ``bool``, return :class:`kiefer.ticks.TickColumns`
+                         instead of the raw response
+        """
+        return self._get_archived('/moves/{}/ticks'.format(xid),
+                                  _tick_decoder(columnar))
+
+    def stream_move_ticks(self, xid):
         """
-        return self._get('/moves/{}/ticks'.format(xid))
+        Stream ticks of a single move, see :ref:`streaming`.
+
+        :param xid: ``str``, move id
+        """
+        return self._stream('/moves/{}/ticks'.format(xid))
+
+    # Pub/sub
+    def set_webhook(self, url):
+        """
+        Register a webhook receiving notifications when the user's data
+        changes, see :mod:`kiefer.webhook`.
+
+        :param url: ``str``, URL of the webhook
+        """
+        return self._post('users/@me/pubsub', {'webhook': url})
+
+    def delete_webhook(self):
+        """Stop sending notifications for the user."""
+        return self._delete('users/@me/pubsub')
 
     # Settings
     def get_settings(self):
@@ -217,6 +473,14 @@ class KieferClient(object):
         """Get list of sleeps."""
         return self._get('users/@me/sleeps', kwargs)
 
+    def iter_sleeps(self, prefetch=False, **kwargs):
+        """
+        Iterate over all sleeps, following the pagination links.
+
+        :param prefetch: ``bool``, fetch the next page in the background.
+        """
+        return self._iter_items('users/@me/sleeps', kwargs, prefetch)
+
     def get_sleep(self, xid):
         """
         Get a single sleep.
@@ -225,21 +489,33 @@ class KieferClient(object):
         """
         return self._get('sleeps/' + xid)
 
-    def get_sleep_graph(self, xid):
+    def get_sleep_graph(self, xid, target=None):
         """
         Get graph of a single sleep.
 
         :param xid: ``str``, sleep id
+        :param target: see :ref:`graphs`
         """
-        return self._get('/sleeps/{}/image'.format(xid))
+        return self._download('/sleeps/{}/image'.format(xid), target)
 
-    def get_sleep_phases(self, xid):
+    def get_sleep_phases(self, xid, columnar=False):
         """
         Get sleep phases of a single sleep.
 
         :param xid: ``str``, sleep id
+        :param columnar: ``bool``, return :class:`kiefer.ticks.TickColumns`
+                         instead of the raw response
         """
-        return self._get('/sleeps/{}/ticks'.format(xid))
+        return self._get_archived('/sleeps/{}/ticks'.format(xid),
+                                  _tick_decoder(columnar))
+
+    def stream_sleep_phases(self, xid):
+        """
+        Stream sleep phases of a single sleep, see :ref:`streaming`.
+
+        :param xid: ``str``, sleep id
+        """
+        return self._stream('/sleeps/{}/ticks'.format(xid))
 
     def add_sleep(self, **kwargs):
         """
@@ -252,7 +528,7 @@ class KieferClient(object):
         - tz: ``str``
         - share: ``bool``
         """
-        self._post('/users/@me/sleeps', kwargs)
+        return self._post('/users/@me/sleeps', kwargs)
 
     def delete_sleep(self, xid):
         """
@@ -260,7 +536,7 @@ class KieferClient(object):
 
         :param xid: ``str``, sleep id
         """
-        self._delete('/sleeps/' + xid)
+        return self._delete('/sleeps/' + xid)
 
     # Timezone
     def get_timezone(self, **kwargs):
@@ -272,6 +548,12 @@ class KieferClient(object):
         """Get trends."""
         return self._get('users/@me/trends', kwargs)
 
+    def stream_trends(self, **kwargs):
+        """
+        Stream trends as ``[date, values]`` pairs, see :ref:`streaming`.
+        """
+        return self._stream('users/@me/trends', kwargs, path=('data', 'data'))
+
     # User information
     def get_user_information(self):
         """Get basic information of the user."""
@@ -286,6 +568,14 @@ class KieferClient(object):
         """Get list of workouts."""
         return self._get('users/@me/workouts', kwargs)
 
+    def iter_workouts(self, prefetch=False, **kwargs):
+        """
+        Iterate over all workouts, following the pagination links.
+
+        :param prefetch: ``bool``, fetch the next page in the background.
+        """
+        return self._iter_items('users/@me/workouts', kwargs, prefetch)
+
     def get_workout(self, xid):
         """
         Get a single workout.
@@ -294,21 +584,33 @@ class KieferClient(object):
         """
         return self._get('workouts/' + xid)
 
-    def get_workout_graph(self, xid):
+    def get_workout_graph(self, xid, target=None):
         """
         Get graph for a single workout.
 
         :param xid: ``str``, workout id
+        :param target: see :ref:`graphs`
         """
-        return self._get('/workouts/{}/image'.format(xid))
+        return self._download('/workouts/{}/image'.format(xid), target)
 
-    def get_workout_ticks(self, xid):
+    def get_workout_ticks(self, xid, columnar=False):
         """
         Get ticks for a single workout.
 
         :param xid: ``str``, workout id
+        :param columnar: ``bool``, return :class:`kiefer.ticks.TickColumns`
+                         instead of the raw response
         """
-        return self._get('/workouts/{}/ticks'.format(xid))
+        return self._get_archived('/workouts/{}/ticks'.format(xid),
+                                  _tick_decoder(columnar))
+
+    def stream_workout_ticks(self, xid):
+        """
+        Stream ticks of a single workout, see :ref:`streaming`.
+
+        :param xid: ``str``, workout id
+        """
+        return self._stream('/workouts/{}/ticks'.format(xid))
 
     def add_workout(self, **kwargs):
         """
@@ -340,7 +642,7 @@ class KieferClient(object):
 
         :param xid: ``str``, workout id
         """
-        self._post('/workouts/{}/partialUpdate'.format(xid), kwargs)
+        return self._post('/workouts/{}/partialUpdate'.format(xid), kwargs)
 
     def delete_workout(self, xid):
         """
@@ -348,27 +650,328 @@ class KieferClient(object):
 
         :param xid: ``str, workout id
         """
-        self._delete('/workouts/' + xid)
+        return self._delete('/workouts/' + xid)
+
+    # Batch requests
+    def get_many(self, resource, xids, max_workers=8):
+        """
+        Call a single-item endpoint for many xids concurrently.
+
+        Results are yielded as :class:`kiefer.batch.BatchResult` in order of
+        completion; failed requests are reported as ``error`` instead of
+        aborting the batch:
+
+        ::
+
+            for res in client.get_many('move_ticks', xids, max_workers=8):
+                if res.error is None:
+                    process(res.key, res.result)
+
+        The requests share the client's session. Make sure its
+        ``pool_maxsize`` (see :func:`create_session`) is at least
+        ``max_workers``, otherwise surplus connections are not reused.
+
+        :param resource: ``str``, endpoint name without ``get_`` prefix,
+                         e.g. ``'move_ticks'``, ``'sleep_phases'`` or ``'workout_graph'``
+        :param xids: iterable of xids
+        :param max_workers: ``int``, number of threads
+        """
+        return fan_out(self._endpoint(resource), xids, max_workers)
+
+    def download_many(self, resource, xids, directory, max_workers=8,
+                      overwrite=False):
+        """
+        Download graphs of many xids concurrently to ``directory``.
+
+        Every graph is written to ``<directory>/<xid>.png``; files which
+        already exist are not downloaded again unless ``overwrite`` is set.
+        Results are yielded as :class:`kiefer.batch.BatchResult` with the
+        path of the file as ``result``:
+
+        ::
+
+            for res in client.download_many('sleep_graph', xids, 'graphs/'):
+                if res.error is not None:
+                    print(res.key, res.error)
+
+        :param resource: ``str``, ``'move_graph'``, ``'sleep_graph'`` or
+                         ``'workout_graph'``
+        :param xids: iterable of xids
+        :param directory: ``str``, created if missing
+        :param max_workers: ``int``, number of threads
+        :param overwrite: ``bool``, download existing files again
+        """
+        if not resource.endswith('_graph'):
+            raise KieferClientError(
+                "Can't download '{}', only graphs.".format(resource))
+        method = self._endpoint(resource)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        def download(xid):
+            path = os.path.join(directory, '{}.png'.format(xid))
+            if overwrite or not os.path.exists(path):
+                method(xid, path)
+            return path
+
+        return fan_out(download, xids, max_workers)
 
     # Request helper methods
 
-    def _get(self, endpoint, payload=None):
-        req_url = self.BASE_URL + endpoint
-        r = requests.get(req_url, headers=self._headers, params=payload)
-        validate_response(r, 200, KieferClientError)
-        return r.json()
+    def _endpoint(self, resource):
+        method = getattr(self, 'get_' + resource, None)
+        if method is None:
+            raise KieferClientError("Unknown endpoint 'get_{}'.".format(resource))
+        return method
+
+    def _iter_items(self, endpoint, payload=None, prefetch=False):
+        pages = self._iter_pages(endpoint, payload)
+        if prefetch:
+            pages = prefetch_iter(pages)
+        for page in pages:
+            for item in page['data']['items']:
+                yield item
+
+    def _iter_pages(self, endpoint, payload=None):
+        page = self._get(endpoint, payload)
+        while True:
+            yield page
+            link = next_link(page)
+            if link is None:
+                return
+            page = self._get_url(urljoin(self.BASE_URL, link))
+
+    def _stream(self, endpoint, payload=None, path=('data', 'items')):
+        r = self._send('get', self.BASE_URL + endpoint, params=payload,
+                       stream=True)
+        start = _clock()
+        received = [0]
+
+        def chunks():
+            for chunk in r.iter_content(self.STREAM_CHUNK_SIZE):
+                received[0] += len(chunk)
+                yield chunk
+
+        try:
+            validate_response(r, 200, KieferClientError)
+            for item in iter_items(chunks(), path):
+                yield item
+        finally:
+            r.close()
+            self._emit_response(r, download=_clock() - start,
+                                nbytes=received[0])
+
+    def _download(self, endpoint, target=None):
+        if target is None:
+            r = self._send('get', self.BASE_URL + endpoint)
+            try:
+                validate_response(r, 200, KieferClientError)
+            finally:
+                self._emit_response(r)
+            return memoryview(r.content)
+        r = self._send('get', self.BASE_URL + endpoint, stream=True)
+        start = _clock()
+        counter = [0]
+        try:
+            validate_response(r, 200, KieferClientError)
+            return _write_chunks(target, r.iter_content(self.STREAM_CHUNK_SIZE),
+                                 counter)
+        finally:
+            r.close()
+            self._emit_response(r, download=_clock() - start,
+                                nbytes=counter[0])
+
+    def _get(self, endpoint, payload=None, decoder=None):
+        return self._get_url(self.BASE_URL + endpoint, payload, decoder)
+
+    def _get_archived(self, endpoint, decoder=None):
+        if self.archive is None:
+            return self._get(endpoint, decoder=decoder)
+        key = endpoint.strip('/')
+        raw = self.archive.get(key)
+        if raw is not None:
+            body = LazyResponse(raw) if self.lazy else loads(raw)
+        else:
+            r = self._send('get', self.BASE_URL + endpoint)
+            body = self._read(r, 200)
+            if self.archive.is_settled(body):
+                self.archive.put(key, r.content)
+        return body if decoder is None else decoder(body)
+
+    def _get_url(self, req_url, payload=None, decoder=None):
+        body = self._get_body(req_url, payload)
+        return body if decoder is None else decoder(body)
+
+    def _get_body(self, req_url, payload=None):
+        if self.single_flight is None:
+            return self._fetch_body(req_url, payload)
+        return self.single_flight.do(
+            cache_key(self._token_key, req_url, payload),
+            lambda: self._fetch_body(req_url, payload))
+
+    def _fetch_body(self, req_url, payload=None):
+        key = entry = headers = None
+        if self.cache is not None:
+            key = cache_key(self._token_key, req_url, payload)
+            entry = self.cache.get(key)
+            if entry is not None:
+                if entry.is_fresh():
+                    return entry.body
+                headers = entry.conditional_headers()
+        r = self._send('get', req_url, headers=headers, params=payload)
+        if entry is not None and r.status_code == 304:
+            body = entry.body
+            self._emit_response(r)
+        else:
+            body = self._read(r, 200)
+        if key is not None:
+            tag = cache_tag(self._token_key, req_url[len(self.BASE_URL):])
+            self.cache.set(key, tag, self.cache.create_entry(body, r.headers))
+        return body
 
     def _post(self, endpoint, payload):
         req_url = self.BASE_URL + endpoint
-        r = requests.post(req_url, headers=self._headers, data=payload)
+        r = self._send('post', req_url, data=payload)
         # Expected status should be an integer, but since Jawbone messes up
         # status codes (e.g. create workout return 200 instead of 201) we have
         # to check for multiple status codes -.-
-        validate_response(r, [200, 201], KieferClientError)
-        return r.json()
+        body = self._read(r, [200, 201])
+        self._invalidate(endpoint)
+        return body
 
     def _delete(self, endpoint):
         req_url = self.BASE_URL + endpoint
-        r = requests.delete(req_url, headers=self._headers)
-        validate_response(r, 200, KieferClientError)
-        return r.json()
+        r = self._send('delete', req_url)
+        body = self._read(r, 200)
+        self._invalidate(endpoint)
+        return body
+
+    def _send(self, method, req_url, headers=None, **kwargs):
+        start = _clock()
+        attempt = 0
+        refreshed = False
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(self._token_key)
+            token = self.access_token
+            req_headers = {'Authorization': 'Bearer {}'.format(token)}
+            req_headers.update(headers or {})
+            sent = _clock()
+            try:
+                r = self._call(method, req_url, headers=req_headers, **kwargs)
+            except Exception as e:
+                if self.hooks:
+                    self._emit(method, req_url, 0, 0.0, 0.0, 0.0, start, 0,
+                               attempt, type(e).__name__)
+                raise
+            # Used by _emit_response()
+            r.kiefer_stats = (method, req_url, start, _clock() - sent, attempt)
+            if self.rate_limiter is not None:
+                self.rate_limiter.update(self._token_key, r.status_code,
+                                         r.headers)
+            if r.status_code == 401 and self.token_provider is not None \
+                    and not refreshed:
+                # Refresh once, concurrent callers wait for the new token
+                self.token_provider.refresh(token)
+                refreshed = True
+                continue
+            if self.retry is None or not self.retry.should_retry(
+                    method, r.status_code, attempt):
+                return r
+            time.sleep(self.retry.delay(attempt, r.headers.get('Retry-After')))
+            attempt += 1
+
+    def _call(self, method, req_url, **kwargs):
+        if self.timeout is not None:
+            kwargs['timeout'] = self.timeout
+        breaker = self.circuit_breaker
+        host = urlsplit(req_url).netloc
+        if breaker is not None and not breaker.allow(host):
+            raise CircuitOpenError(
+                'Circuit open for {}, not sending request.'.format(host))
+        # None if the request neither completed nor failed, e.g. on
+        # KeyboardInterrupt
+        success = None
+        try:
+            if self.hedge is not None and method == 'get' and \
+                    not kwargs.get('stream'):
+                r = self._hedged_get(req_url, kwargs)
+            else:
+                r = getattr(self.session, method)(req_url, **kwargs)
+            success = r.status_code < 500
+        except requests.RequestException:
+            success = False
+            raise
+        finally:
+            if breaker is not None:
+                if success is None:
+                    breaker.release(host)
+                else:
+                    breaker.record(host, success)
+        return r
+
+    def _hedged_get(self, req_url, kwargs):
+        hedge = self.hedge
+        start = _clock()
+        delay = hedge.delay()
+        pending = [hedge.executor.submit(self.session.get, req_url, **kwargs)]
+        # The hedge is a request of its own, only send it if the rate
+        # limiter has room for it right now
+        if delay is not None and not wait(pending, timeout=delay)[0] and (
+                self.rate_limiter is None or
+                self.rate_limiter.try_acquire(self._token_key)):
+            pending.append(hedge.executor.submit(self.session.get, req_url,
+                                                 **kwargs))
+        error = None
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.remove(future)
+                if future.exception() is None:
+                    hedge.observe(_clock() - start)
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    def _read(self, r, expected_status):
+        decode = 0.0
+        try:
+            validate_response(r, expected_status, KieferClientError)
+            decode_start = _clock()
+            body = self._decode(r)
+            decode = _clock() - decode_start
+        finally:
+            self._emit_response(r, decode)
+        return body
+
+    def _decode(self, r):
+        if self.lazy:
+            return LazyResponse(r.content)
+        return loads(r.content)
+
+    def _emit_response(self, r, decode=0.0, download=None, nbytes=None):
+        if not self.hooks:
+            return
+        method, req_url, start, elapsed, retries = r.kiefer_stats
+        # requests measures until the headers are parsed; without stream=True
+        # the body is read before the session call returns
+        ttfb = r.elapsed.total_seconds()
+        if download is None:
+            download = max(elapsed - ttfb, 0.0)
+        if nbytes is None:
+            nbytes = len(r.content)
+        self._emit(method, req_url, r.status_code, ttfb, download, decode,
+                   start, nbytes, retries)
+
+    def _emit(self, method, req_url, status, ttfb, download, decode, start,
+              nbytes, retries, error=None):
+        event = RequestEvent(method.upper(),
+                             endpoint_template(req_url, self.BASE_URL),
+                             status, ttfb, download, decode, _clock() - start,
+                             nbytes, retries, error)
+        for hook in self.hooks:
+            hook(event)
+
+    def _invalidate(self, endpoint):
+        if self.cache is not None:
+            self.cache.invalidate(cache_tag(self._token_key, endpoint))
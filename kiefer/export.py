@@ -0,0 +1,386 @@
+"""
+Bulk export of UP data to JSONL, CSV or Parquet files.
+
+:class:`Exporter` pages through the list endpoints of every user, flattens
+each item (``details.steps`` instead of a nested ``details`` dict) and
+writes it to ``<directory>/<user>/<resource>.<format>``. Only one page per
+user is held in memory, Parquet rows are buffered up to one row group.
+
+After every durable write the position in the output file and the link of
+the next page are committed to a state store, so an interrupted export
+continues where it stopped: text files are truncated to the last committed
+offset, Parquet parts written after the last commit are removed. Each user
+and resource is exported exactly once this way; delete the state to export
+again.
+
+::
+
+    exporter = Exporter('export/', fmt='csv',
+                        state_store=JSONFileStateStore('export.json'))
+    exporter.export_users({'alice': client_a, 'bob': client_b}, max_workers=4)
+"""
+import csv
+import glob
+import io
+import json
+import os
+import sys
+
+from kiefer.batch import fan_out
+from kiefer.sync import MemoryStateStore, RESOURCES
+from kiefer.util import next_link
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+try:
+    from urllib.parse import urljoin
+except ImportError:
+    from urlparse import urljoin
+
+
+#: Tick resources, mapped to the list resource of their parents and the
+#: client method returning the ticks of a single parent item
+TICK_RESOURCES = {
+    'move_ticks': ('moves', 'get_move_ticks'),
+    'sleep_phases': ('sleeps', 'get_sleep_phases'),
+    'workout_ticks': ('workouts', 'get_workout_ticks'),
+}
+
+
+#: Column holding fields missing from the columns of a CSV or Parquet file
+EXTRA_FIELD = '_extra'
+
+
+def _is_field_name(key):
+    return bool(key) and (key[0].isalpha() or key[0] == '_')
+
+
+def flatten(item, sep='.', prefix=''):
+    """
+    Flatten nested dicts into a single level.
+
+    Lists are encoded as JSON strings, and so are dicts keyed by data
+    instead of field names, e.g. hourly totals keyed by ``YYYYMMDDHH``,
+    which would otherwise add different columns for every item.
+
+    ::
+
+        >>> flatten({'xid': 'a', 'details': {'steps': 5}})
+        {'xid': 'a', 'details.steps': 5}
+
+    :param item: ``dict``
+    :param sep: ``str``, separator of nested keys
+    """
+    flat = {}
+    for key, value in item.items():
+        name = prefix + key
+        if isinstance(value, dict) and all(_is_field_name(k) for k in value):
+            flat.update(flatten(value, sep, name + sep))
+        elif isinstance(value, (dict, list)):
+            flat[name] = json.dumps(value)
+        else:
+            flat[name] = value
+    return flat
+
+
+class JSONLinesWriter(object):
+    """
+    Writes one JSON object per line.
+
+    Writers are created by :class:`Exporter` with the path of the output
+    file and the position of the last commit, or ``None`` for a new file.
+    """
+    extension = 'jsonl'
+
+    def __init__(self, path, position=None):
+        self.path = path
+        self._file = io.open(path, 'ab' if position is not None else 'wb')
+        if position is not None:
+            self._file.truncate(position)
+
+    def _encode(self, rows):
+        return b''.join(json.dumps(row, sort_keys=True).encode('utf-8') + b'\n'
+                        for row in rows)
+
+    def write(self, rows):
+        """Write a ``list`` of flat ``dict`` rows."""
+        self._file.write(self._encode(rows))
+
+    def commit(self):
+        """
+        Make the written rows durable.
+
+        :return: position to resume from, or ``None`` if nothing was
+                 committed
+        """
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return self._file.tell()
+
+    def close(self):
+        self._file.close()
+
+
+def _move_extra(rows, fields):
+    """
+    Move the fields of ``rows`` which are not in ``fields`` to a JSON
+    object in :data:`EXTRA_FIELD`.
+    """
+    moved = []
+    for row in rows:
+        extra = dict((k, v) for k, v in row.items() if k not in fields)
+        if extra:
+            row = dict((k, v) for k, v in row.items() if k in fields)
+            row[EXTRA_FIELD] = json.dumps(extra, sort_keys=True)
+        moved.append(row)
+    return moved
+
+
+if sys.version_info.major == 2:
+    # The csv module of Python 2 reads and writes byte strings
+    _CSVBuffer = io.BytesIO
+
+    def _csv_value(value):
+        return value.encode('utf-8') if isinstance(value, unicode) else value
+
+    def _read_header(path):
+        with open(path, 'rb') as f:
+            return [name.decode('utf-8') for name in next(csv.reader(f))]
+else:
+    _CSVBuffer = io.StringIO
+
+    def _csv_value(value):
+        return value
+
+    def _read_header(path):
+        with io.open(path, 'r', newline='') as f:
+            return next(csv.reader(f))
+
+
+class CSVWriter(JSONLinesWriter):
+    """
+    Writes CSV with a header row.
+
+    The columns are taken from the first rows written; fields which only
+    appear later are written as JSON object to the ``_extra`` column.
+    """
+    extension = 'csv'
+
+    def __init__(self, path, position=None):
+        super(CSVWriter, self).__init__(path, position)
+        self.fields = None
+        if position:
+            self.fields = _read_header(path)
+
+    def _encode(self, rows):
+        if not rows:
+            return b''
+        buf = _CSVBuffer()
+        writer = csv.writer(buf)
+        if self.fields is None:
+            self.fields = sorted(set(key for row in rows for key in row) |
+                                 set([EXTRA_FIELD]))
+            writer.writerow([_csv_value(field) for field in self.fields])
+        for row in _move_extra(rows, self.fields):
+            writer.writerow([_csv_value(row.get(field))
+                             for field in self.fields])
+        data = buf.getvalue()
+        return data if isinstance(data, bytes) else data.encode('utf-8')
+
+
+class ParquetWriter(object):
+    """
+    Writes Parquet, requires `pyarrow`_.
+
+    Output is a directory of part files of at most ``row_group_size`` rows,
+    each written atomically. Rows are buffered until at least
+    ``row_group_size`` rows are committed; the last part of a commit may
+    be smaller. The schema is inferred from the first part and read from
+    it again when an export resumes; fields which only appear later are
+    written as JSON object to the ``_extra`` column.
+
+    .. _pyarrow: https://arrow.apache.org/docs/python/
+    """
+    extension = 'parquet'
+    row_group_size = 50000
+
+    def __init__(self, path, position=None):
+        if pyarrow is None:
+            raise ImportError('Parquet export requires pyarrow.')
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._part = position or 0
+        for part in glob.glob(os.path.join(path, 'part-*.parquet')):
+            if int(os.path.basename(part)[5:-8]) >= self._part:
+                os.remove(part)
+        self._rows = []
+        self.schema = None
+        if self._part:
+            self.schema = pyarrow.parquet.read_schema(
+                self._part_path(0)).remove_metadata()
+
+    def _part_path(self, part):
+        return os.path.join(self.path, 'part-{:05d}.parquet'.format(part))
+
+    def write(self, rows):
+        self._rows.extend(rows)
+
+    def commit(self):
+        if len(self._rows) < self.row_group_size:
+            return None
+        self._flush()
+        return self._part
+
+    def _flush(self):
+        if not self._rows:
+            return
+        rows = self._rows
+        if self.schema is None:
+            fields = sorted(set(key for row in rows for key in row))
+            columns = dict((field, [row.get(field) for row in rows])
+                           for field in fields)
+            columns[EXTRA_FIELD] = pyarrow.array([None] * len(rows),
+                                                 pyarrow.string())
+            self.schema = pyarrow.Table.from_pydict(columns).schema
+        else:
+            # Columns which were always empty in the first part have no
+            # type which could hold values
+            fields = set(field.name for field in self.schema
+                         if not pyarrow.types.is_null(field.type))
+            rows = _move_extra(rows, fields)
+        for start in range(0, len(rows), self.row_group_size):
+            chunk = rows[start:start + self.row_group_size]
+            table = pyarrow.Table.from_pydict(
+                dict((name, [row.get(name) for row in chunk])
+                     for name in self.schema.names), schema=self.schema)
+            path = self._part_path(self._part)
+            pyarrow.parquet.write_table(table, path + '.tmp')
+            os.rename(path + '.tmp', path)
+            self._part += 1
+        self._rows = []
+
+    def close(self):
+        self._flush()
+
+
+WRITERS = {
+    'jsonl': JSONLinesWriter,
+    'csv': CSVWriter,
+    'parquet': ParquetWriter,
+}
+
+
+class Exporter(object):
+    """
+    Exports resources of many users to files.
+
+    :param directory: ``str``, output directory
+    :param fmt: ``str``, ``'jsonl'``, ``'csv'`` or ``'parquet'``
+    :param resources: names of ``kiefer.sync.RESOURCES`` or
+                      ``TICK_RESOURCES``, defaults to moves, sleeps,
+                      workouts and their ticks
+    :param state_store: state store as used by
+                        :class:`kiefer.sync.SyncEngine`, e.g.
+                        :class:`kiefer.sync.JSONFileStateStore`
+    :param page_limit: ``int``, items requested per page
+    :param params: ``dict`` of additional query parameters, e.g.
+                   ``start_time``
+    """
+    DEFAULT_RESOURCES = ('moves', 'sleeps', 'workouts', 'move_ticks',
+                         'sleep_phases', 'workout_ticks')
+
+    def __init__(self, directory, fmt='jsonl', resources=None,
+                 state_store=None, page_limit=100, params=None):
+        if fmt not in WRITERS:
+            raise ValueError("Unknown format '{}'.".format(fmt))
+        self.directory = directory
+        self.writer_cls = WRITERS[fmt]
+        self.resources = list(resources or self.DEFAULT_RESOURCES)
+        for resource in self.resources:
+            if resource not in RESOURCES and resource not in TICK_RESOURCES:
+                raise ValueError("Unknown resource '{}'.".format(resource))
+        self.state_store = state_store or MemoryStateStore()
+        self.page_limit = page_limit
+        self.params = dict(params or {})
+
+    def export_users(self, clients, max_workers=4):
+        """
+        Export all users in parallel, one thread per user.
+
+        :param clients: ``dict`` mapping user keys to clients
+        :param max_workers: ``int``, number of users exported concurrently
+        :return: iterator of :class:`kiefer.batch.BatchResult` with the user
+                 as ``key`` and the result of :meth:`export_user`
+        """
+        return fan_out(lambda user: self.export_user(user, clients[user]),
+                       clients, max_workers)
+
+    def export_user(self, user, client):
+        """
+        Export all resources of a user.
+
+        :return: ``dict`` mapping resource names to the number of rows
+                 written in this run
+        """
+        return dict((resource, self.export_resource(user, client, resource))
+                    for resource in self.resources)
+
+    def export_resource(self, user, client, resource):
+        """
+        Export a single resource of a user.
+
+        :return: ``int``, number of rows written in this run
+        """
+        state = self.state_store.get(user, 'export:' + resource) or {}
+        if state.get('done'):
+            return 0
+        user_dir = os.path.join(self.directory, str(user))
+        if not os.path.isdir(user_dir):
+            os.makedirs(user_dir)
+        path = os.path.join(user_dir, '{}.{}'.format(
+            resource, self.writer_cls.extension))
+        writer = self.writer_cls(path, state.get('position'))
+
+        parent, tick_method = TICK_RESOURCES.get(resource, (resource, None))
+        if state.get('next') is not None:
+            page = client._get_url(urljoin(client.BASE_URL, state['next']))
+        else:
+            params = dict(self.params, limit=self.page_limit)
+            page = getattr(client, RESOURCES[parent])(**params)
+
+        count = 0
+        done = False
+        try:
+            while True:
+                items = page['data']['items']
+                if tick_method is None:
+                    rows = [flatten(item) for item in items]
+                    writer.write(rows)
+                    count += len(rows)
+                else:
+                    for item in items:
+                        ticks = getattr(client, tick_method)(item['xid'])
+                        rows = [dict(flatten(tick), xid=item['xid'])
+                                for tick in ticks['data']['items']]
+                        writer.write(rows)
+                        count += len(rows)
+                link = next_link(page)
+                if link is None:
+                    done = True
+                    break
+                position = writer.commit()
+                if position is not None:
+                    self.state_store.set(user, 'export:' + resource,
+                                         {'next': link, 'position': position})
+                page = client._get_url(urljoin(client.BASE_URL, link))
+        finally:
+            if done:
+                writer.commit()
+            writer.close()
+        self.state_store.set(user, 'export:' + resource, {'done': True})
+        return count
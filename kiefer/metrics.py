@@ -0,0 +1,227 @@
+"""
+Request instrumentation.
+
+Clients accept a list of *hooks*, callables which receive a
+:class:`RequestEvent` after every request:
+
+::
+
+    collector = PrometheusCollector()
+    client = KieferClient(access_token, hooks=[collector])
+    ...
+    print(collector.render())
+
+The latency of a request is split into the time until the response
+headers arrived (``ttfb``, including DNS lookup, connecting and the TLS
+handshake), the time to read the body (``download``) and the time to
+decode it (``decode``).
+"""
+import bisect
+import threading
+from collections import namedtuple
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+
+RequestEvent = namedtuple('RequestEvent', [
+    'method', 'endpoint', 'status', 'ttfb', 'download', 'decode', 'total',
+    'bytes', 'retries', 'error'])
+RequestEvent.__new__.__defaults__ = (None,)
+RequestEvent.__doc__ = """
+Metrics of a single request.
+
+``endpoint`` is the path template, e.g. ``moves/{xid}/ticks``, ``status``
+the HTTP status of the last attempt, ``retries`` the number of retried
+attempts. Times are in seconds; ``total`` includes rate limiting and
+retries.
+
+``error`` is the class name of the exception a request failed with, e.g.
+``'ReadTimeout'`` or ``'CircuitOpenError'``, and ``None`` otherwise.
+Requests which failed before a response arrived have ``status`` 0.
+"""
+
+# Path segments followed by an xid
+_COLLECTIONS = frozenset(['body_events', 'heartrates', 'generic_events',
+                          'meals', 'mood', 'moves', 'sleeps', 'workouts'])
+
+
+def endpoint_template(url, base_url=''):
+    """
+    Return the endpoint of ``url`` with xids replaced by ``{xid}``.
+
+    :param url: ``str``, request URL
+    :param base_url: ``str``, API base URL whose path is removed
+    """
+    path = urlsplit(url).path
+    base = urlsplit(base_url).path
+    if base and path.startswith(base):
+        path = path[len(base):]
+    segments = [s for s in path.split('/') if s]
+    for i in range(1, len(segments)):
+        if segments[i - 1] in _COLLECTIONS:
+            segments[i] = '{xid}'
+    return '/'.join(segments)
+
+
+class HistogramCollector(object):
+    """
+    Collects latency histograms and counters per method and endpoint.
+
+    Thread-safe, a single collector can be shared by all clients of a
+    process.
+
+    :param buckets: upper bounds of the latency buckets in seconds
+    """
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    PHASES = ('ttfb', 'download', 'decode')
+
+    def __init__(self, buckets=None):
+        self.buckets = tuple(sorted(buckets or self.BUCKETS))
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def __call__(self, event):
+        key = (event.method, event.endpoint)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {
+                    'count': 0, 'sum': 0.0, 'bytes': 0, 'retries': 0,
+                    'buckets': [0] * (len(self.buckets) + 1),
+                    'phases': dict.fromkeys(self.PHASES, 0.0),
+                    'status': {}, 'exceptions': {}}
+            series['count'] += 1
+            series['sum'] += event.total
+            series['bytes'] += event.bytes
+            series['retries'] += event.retries
+            series['buckets'][bisect.bisect_left(self.buckets,
+                                                 event.total)] += 1
+            for phase in self.PHASES:
+                series['phases'][phase] += getattr(event, phase)
+            series['status'][event.status] = \
+                series['status'].get(event.status, 0) + 1
+            if event.error is not None:
+                series['exceptions'][event.error] = \
+                    series['exceptions'].get(event.error, 0) + 1
+
+    def _quantile(self, counts, count, q):
+        rank = q * count
+        seen = 0
+        for bound, n in zip(self.buckets, counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def summary(self):
+        """
+        Return a ``dict`` mapping ``(method, endpoint)`` to a summary with
+        the request count, error count (status >= 400 or an exception),
+        counts per exception, retries, bytes, mean latency, mean time per
+        phase and the p50/p95/p99 latency (upper bound of the bucket).
+        """
+        result = {}
+        with self._lock:
+            for key, s in self._series.items():
+                count = s['count']
+                result[key] = {
+                    'count': count,
+                    'errors': sum(n for status, n in s['status'].items()
+                                  if status >= 400 or status == 0),
+                    'exceptions': dict(s['exceptions']),
+                    'retries': s['retries'],
+                    'bytes': s['bytes'],
+                    'mean': s['sum'] / count,
+                    'p50': self._quantile(s['buckets'], count, 0.5),
+                    'p95': self._quantile(s['buckets'], count, 0.95),
+                    'p99': self._quantile(s['buckets'], count, 0.99),
+                }
+                for phase in self.PHASES:
+                    result[key][phase] = s['phases'][phase] / count
+        return result
+
+    def reset(self):
+        """Drop all collected data."""
+        with self._lock:
+            self._series = {}
+
+
+def _labels(**labels):
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('"', '\\"'))
+                          for name, value in sorted(labels.items())) + '}'
+
+
+class PrometheusCollector(HistogramCollector):
+    """
+    :class:`HistogramCollector` which renders its data in the Prometheus
+    text exposition format, e.g. to be served on a ``/metrics`` endpoint.
+
+    :param prefix: ``str``, prefix of the metric names
+    """
+
+    def __init__(self, buckets=None, prefix='kiefer'):
+        super(PrometheusCollector, self).__init__(buckets)
+        self.prefix = prefix
+
+    def render(self):
+        """Return all metrics as ``str``."""
+        p = self.prefix
+        lines = [
+            '# HELP {}_request_duration_seconds Request latency.'.format(p),
+            '# TYPE {}_request_duration_seconds histogram'.format(p)]
+        with self._lock:
+            series = sorted(self._series.items())
+            for (method, endpoint), s in series:
+                cumulative = 0
+                for bound, n in zip(self.buckets + (float('inf'),),
+                                    s['buckets']):
+                    cumulative += n
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append('{}_request_duration_seconds_bucket{} {}'.format(
+                        p, _labels(method=method, endpoint=endpoint, le=le),
+                        cumulative))
+                labels = _labels(method=method, endpoint=endpoint)
+                lines.append('{}_request_duration_seconds_sum{} {!r}'.format(
+                    p, labels, s['sum']))
+                lines.append('{}_request_duration_seconds_count{} {}'.format(
+                    p, labels, s['count']))
+
+            lines += ['# HELP {}_request_phase_seconds_total Time spent per '
+                      'request phase.'.format(p),
+                      '# TYPE {}_request_phase_seconds_total counter'.format(p)]
+            for (method, endpoint), s in series:
+                for phase in self.PHASES:
+                    lines.append('{}_request_phase_seconds_total{} {!r}'.format(
+                        p, _labels(method=method, endpoint=endpoint,
+                                   phase=phase), s['phases'][phase]))
+
+            lines += ['# HELP {}_requests_total Requests by status.'.format(p),
+                      '# TYPE {}_requests_total counter'.format(p)]
+            for (method, endpoint), s in series:
+                for status, n in sorted(s['status'].items()):
+                    lines.append('{}_requests_total{} {}'.format(
+                        p, _labels(method=method, endpoint=endpoint,
+                                   status=status), n))
+
+            lines += ['# HELP {}_request_exceptions_total Requests failed '
+                      'with an exception.'.format(p),
+                      '# TYPE {}_request_exceptions_total counter'.format(p)]
+            for (method, endpoint), s in series:
+                for error, n in sorted(s['exceptions'].items()):
+                    lines.append('{}_request_exceptions_total{} {}'.format(
+                        p, _labels(method=method, endpoint=endpoint,
+                                   error=error), n))
+
+            for name, field, help_text in (
+                    ('response_bytes_total', 'bytes', 'Response body bytes.'),
+                    ('request_retries_total', 'retries', 'Retried attempts.')):
+                lines += ['# HELP {}_{} {}'.format(p, name, help_text),
+                          '# TYPE {}_{} counter'.format(p, name)]
+                for (method, endpoint), s in series:
+                    lines.append('{}_{}{} {}'.format(
+                        p, name, _labels(method=method, endpoint=endpoint),
+                        s[field]))
+        return '\n'.join(lines) + '\n'
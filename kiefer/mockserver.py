@@ -0,0 +1,354 @@
+"""
+Local stand-in for the Jawbone UP API.
+
+:class:`MockUPServer` serves the endpoints used by
+:class:`kiefer.client.KieferClient` with generated data. Latency, page and
+payload sizes, throttling and token expiry are configurable, which makes it
+useful for integration tests and benchmarks:
+
+::
+
+    with MockUPServer(latency=0.02, items=500) as server:
+        client = server.client('token')
+        moves = list(client.iter_moves())
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+
+API_PREFIX = '/nudge/api/v.1.1/'
+TOKEN_PATH = '/auth/oauth2/token'
+
+# Resource name in list URLs -> resource name in item URLs
+LIST_RESOURCES = {
+    'body_events': 'body_events',
+    'heartrates': 'heartrates',
+    'generic_events': 'generic_events',
+    'meals': 'meals',
+    'mood': 'mood',
+    'moves': 'moves',
+    'sleeps': 'sleeps',
+    'workouts': 'workouts',
+    'bandevents': 'bandevents',
+    'friends': 'friends',
+}
+TICK_RESOURCES = ('moves', 'sleeps', 'workouts')
+_ITEM_PATH = re.compile(r'^(\w+)/([\w-]+)(?:/(ticks|image|partialUpdate))?$')
+
+# Smallest valid PNG, padded up to the configured image size
+_PNG = (b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01'
+        b'\x08\x06\x00\x00\x00\x1f\x15\xc4\x89\x00\x00\x00\nIDATx\x9cc\x00\x01'
+        b'\x00\x00\x05\x00\x01\r\n-\xb4\x00\x00\x00\x00IEND\xaeB`\x82')
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class MockUPServer(object):
+    """
+    Threaded HTTP server imitating the UP API.
+
+    :param host: ``str``, interface to bind to
+    :param port: ``int``, ``0`` picks a free port
+    :param latency: ``float``, seconds every request is delayed
+    :param page_size: ``int``, default number of items per page
+    :param items: ``int``, number of items of every list resource
+    :param tick_count: ``int``, number of ticks of every move/sleep/workout
+    :param image_size: ``int``, size of graph images in bytes
+    :param throttle_rate: ``float``, fraction of requests answered with 429
+    :param retry_after: ``int``, ``Retry-After`` of throttled responses
+    :param token_ttl: ``float``, seconds after its first use an access
+                      token expires, ``None`` for tokens that never expire
+    :param seed: seed for the random generator, for reproducible runs
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, page_size=10,
+                 items=100, tick_count=1440, image_size=20 * 1024,
+                 throttle_rate=0.0, retry_after=1, token_ttl=None, seed=None):
+        self.latency = latency
+        self.page_size = page_size
+        self.items = items
+        self.tick_count = tick_count
+        self.image_size = image_size
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.token_ttl = token_ttl
+        self.request_count = 0
+        self.now = int(time.time())
+        self._random = random.Random(seed)
+        self._tokens = {}
+        self._expired = set()
+        self._created = []
+        self._lock = threading.Lock()
+        self._httpd = _ThreadingHTTPServer((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def url(self):
+        """Root URL of the server."""
+        host, port = self._httpd.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    @property
+    def base_url(self):
+        """Replacement for :attr:`KieferClient.BASE_URL`."""
+        return self.url + API_PREFIX
+
+    def client(self, access_token, client_cls=None, **kwargs):
+        """
+        Create a client talking to this server.
+
+        :param access_token: ``str``
+        :param client_cls: client class, defaults to
+                           :class:`kiefer.client.KieferClient`
+        :param kwargs: passed on to the client
+        """
+        if client_cls is None:
+            from kiefer.client import KieferClient as client_cls
+        client = client_cls(access_token, **kwargs)
+        client.BASE_URL = self.base_url
+        return client
+
+    def start(self):
+        """Serve requests in a background thread."""
+        self._thread = threading.Thread(target=self._httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and close the socket."""
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def expire_token(self, access_token):
+        """Make all further requests with ``access_token`` fail with 401."""
+        with self._lock:
+            self._expired.add(access_token)
+
+    # Request handling
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are written separately, don't let Nagle's
+            # algorithm delay the body
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                server._handle(self, 'GET')
+
+            def do_POST(self):
+                server._handle(self, 'POST')
+
+            def do_DELETE(self):
+                server._handle(self, 'DELETE')
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def _handle(self, handler, method):
+        with self._lock:
+            self.request_count += 1
+        length = int(handler.headers.get('Content-Length') or 0)
+        form = parse_qs(handler.rfile.read(length).decode('utf-8'))
+        if self.latency:
+            time.sleep(self.latency)
+        url = urlparse(handler.path)
+        query = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+
+        if url.path == TOKEN_PATH:
+            return self._send_json(handler, 200, self._refresh_token(form))
+        if self._random.random() < self.throttle_rate:
+            headers = {'Retry-After': str(self.retry_after)}
+            return self._send_error(handler, 429, 'rate_limit_exceeded',
+                                    'Too many requests', headers)
+        if not self._authorized(handler.headers.get('Authorization', '')):
+            return self._send_error(handler, 401, 'authorization_error',
+                                    'Invalid or expired access token')
+        if not url.path.startswith(API_PREFIX):
+            return self._send_error(handler, 404, 'not_found', url.path)
+
+        endpoint = url.path[len(API_PREFIX):].strip('/')
+        try:
+            status, body = self._route(method, endpoint, query)
+        except KeyError:
+            return self._send_error(handler, 404, 'not_found', endpoint)
+        if isinstance(body, bytes):
+            return self._send(handler, status, body, 'image/png')
+        self._send_json(handler, status, body)
+
+    def _authorized(self, header):
+        token = header[len('Bearer '):]
+        with self._lock:
+            if not token or token in self._expired:
+                return False
+            first_use = self._tokens.setdefault(token, time.time())
+            if self.token_ttl is not None and \
+                    time.time() - first_use > self.token_ttl:
+                self._expired.add(token)
+                return False
+        return True
+
+    def _refresh_token(self, form):
+        token = 'token-' + hashlib.sha1(
+            str(self._random.random()).encode('utf-8')).hexdigest()[:12]
+        return {'access_token': token,
+                'refresh_token': 'refresh-' + token,
+                'token_type': 'Bearer',
+                'expires_in': self.token_ttl or 31536000}
+
+    def _route(self, method, endpoint, query):
+        if endpoint.startswith('users/@me'):
+            resource = endpoint[len('users/@me'):].strip('/')
+            if method == 'POST':
+                if resource == 'goals':
+                    return 200, self._envelope(self._goals())
+                return 201, self._envelope(self._create(resource))
+            if resource == '':
+                return 200, self._envelope({'xid': 'user', 'first': 'Kiefer',
+                                            'last': 'Mock'})
+            if resource in ('goals', 'settings', 'timezone'):
+                return 200, self._envelope(self._goals())
+            if resource == 'trends':
+                return 200, self._envelope(self._trends(query))
+            if resource == 'refreshToken':
+                return 200, self._envelope({'refresh_token': 'refresh'})
+            return 200, self._envelope(self._list(LIST_RESOURCES[resource],
+                                                  endpoint, query))
+
+        match = _ITEM_PATH.match(endpoint)
+        if match is None:
+            raise KeyError(endpoint)
+        resource, xid, action = match.groups()
+        if method == 'DELETE':
+            return 200, self._envelope({})
+        if action == 'partialUpdate':
+            return 200, self._envelope(dict(self._item(resource, 0), xid=xid))
+        if action == 'ticks' and resource in TICK_RESOURCES:
+            return 200, self._envelope(self._ticks(xid))
+        if action == 'image':
+            return 200, (_PNG + b'\x00' * self.image_size)[:max(
+                self.image_size, len(_PNG))]
+        index = int(xid.rsplit('-', 1)[-1]) if xid[-1].isdigit() else 0
+        return 200, self._envelope(dict(self._item(resource, index), xid=xid))
+
+    # Generated data
+
+    @staticmethod
+    def _envelope(data):
+        return {'meta': {'code': 200}, 'data': data}
+
+    def _item(self, resource, index):
+        created = self.now - index * 3600
+        return {'xid': '{}-{}'.format(resource, index),
+                'title': '{} {}'.format(resource, index),
+                'type': resource,
+                'time_created': created,
+                'time_updated': created + 60,
+                'time_completed': created + 1800,
+                'date': int(time.strftime('%Y%m%d', time.gmtime(created))),
+                'details': {'steps': 1000 + index, 'calories': 80.5,
+                            'distance': 750, 'tz': 'Europe/Berlin'}}
+
+    def _create(self, resource):
+        with self._lock:
+            self._created.append(resource)
+            index = self.items + len(self._created)
+        return self._item(resource, index)
+
+    def _list(self, resource, endpoint, query):
+        limit = int(query.get('limit', self.page_size))
+        offset = int(query.get('page_token', 0))
+        updated_after = int(query.get('updated_after', 0))
+        start_time = int(query.get('start_time', 0))
+        end_time = int(query.get('end_time', 2 ** 62))
+        items = []
+        index = offset
+        while index < self.items and len(items) < limit:
+            item = self._item(resource, index)
+            index += 1
+            if item['time_created'] < start_time:
+                break
+            if item['time_updated'] > updated_after and \
+                    item['time_created'] <= end_time:
+                items.append(item)
+        links = {}
+        if index < self.items and len(items) == limit:
+            next_query = dict(query, page_token=index)
+            links['next'] = '{}{}?{}'.format(API_PREFIX, endpoint, '&'.join(
+                '{}={}'.format(k, v) for k, v in sorted(next_query.items())))
+        return {'items': items, 'links': links, 'size': len(items)}
+
+    def _ticks(self, xid):
+        start = self.now - self.tick_count * 60
+        ticks = [{'time': start + i * 60, 'steps': i % 120,
+                  'distance': (i % 120) * 0.75, 'calories': 1.25,
+                  'active_time': 60, 'speed': 1.1, 'depth': i % 3 + 1}
+                 for i in range(self.tick_count)]
+        return {'items': ticks, 'links': {}, 'size': len(ticks)}
+
+    def _trends(self, query):
+        days = int(query.get('num_buckets', self.items))
+        return {'earliest': self.now - days * 86400,
+                'data': [[int(time.strftime('%Y%m%d', time.gmtime(
+                    self.now - i * 86400))), {'m_steps': 8000 + i,
+                                              's_duration': 25000}]
+                         for i in range(days)]}
+
+    def _goals(self):
+        return {'move_steps': 10000, 'sleep_total': 28800,
+                'body_weight': 75.0, 'tz': 'Europe/Berlin'}
+
+    # Responses
+
+    def _send_error(self, handler, status, error_type, detail, headers=None):
+        body = {'meta': {'code': status, 'error_type': error_type,
+                         'error_detail': detail}, 'data': {}}
+        self._send_json(handler, status, body, headers)
+
+    def _send_json(self, handler, status, body, headers=None):
+        raw = json.dumps(body).encode('utf-8')
+        headers = dict(headers or {})
+        if status == 200 and handler.command == 'GET':
+            etag = '"{}"'.format(hashlib.md5(raw).hexdigest())
+            if handler.headers.get('If-None-Match') == etag:
+                return self._send(handler, 304, b'', None, {'ETag': etag})
+            headers['ETag'] = etag
+        self._send(handler, status, raw, 'application/json', headers)
+
+    @staticmethod
+    def _send(handler, status, raw, content_type, headers=None):
+        handler.send_response(status)
+        if content_type:
+            handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(raw)))
+        for key, value in (headers or {}).items():
+            handler.send_header(key, value)
+        handler.end_headers()
+        handler.wfile.write(raw)
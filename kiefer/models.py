@@ -0,0 +1,243 @@
+"""
+Typed, memory efficient result objects.
+
+The endpoints return items as nested dicts. For long histories it is
+cheaper to convert them to the classes of this module: they store the
+documented fields in ``__slots__``, so an object needs no per-instance
+``__dict__`` and attribute access is a plain slot lookup. The nested
+``details`` dict is kept as it is and only converted to a typed object on
+first access.
+
+::
+
+    from kiefer.models import Move
+
+    for move in Move.from_items(client.iter_moves()):
+        print(move.date, move.details.steps)
+
+Fields which are not listed in a class' ``FIELDS`` are dropped. Missing
+fields are ``None``. Tick batches are represented by
+:class:`kiefer.ticks.TickColumns`, single ticks by :class:`Tick`.
+"""
+from kiefer.ticks import TickColumns
+
+
+class Record(object):
+    """
+    Base class of all result objects.
+
+    Subclasses list their attributes in ``FIELDS``, which also serves as
+    ``__slots__``.
+    """
+    __slots__ = ()
+    FIELDS = ()
+
+    def __init__(self, **kwargs):
+        for field in self.FIELDS:
+            setattr(self, field, kwargs.pop(field, None))
+        if kwargs:
+            raise TypeError('Unknown fields: {}'.format(', '.join(sorted(kwargs))))
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build an object from a decoded item, ignoring unknown keys."""
+        obj = cls.__new__(cls)
+        get = data.get
+        for field in cls.FIELDS:
+            setattr(obj, field, get(field))
+        return obj
+
+    @classmethod
+    def from_items(cls, items):
+        """Convert an iterable of item dicts lazily, e.g. ``iter_moves()``."""
+        for item in items:
+            yield cls.from_dict(item)
+
+    @classmethod
+    def from_response(cls, response):
+        """Convert the items of a list response, e.g. of ``get_moves()``."""
+        return [cls.from_dict(item) for item in response['data']['items']]
+
+    def to_dict(self):
+        """Return the fields as ``dict``."""
+        return dict((field, getattr(self, field)) for field in self.FIELDS)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.to_dict() == other.to_dict()
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, ', '.join(
+            '{}={!r}'.format(field, getattr(self, field))
+            for field in self.FIELDS if getattr(self, field) is not None))
+
+
+class Item(Record):
+    """
+    Base class of items with a nested ``details`` object.
+
+    ``DETAILS`` is the :class:`Record` subclass the details are converted to
+    on first access of :attr:`details`.
+    """
+    __slots__ = ('_details',)
+    DETAILS = None
+
+    def __init__(self, details=None, **kwargs):
+        super(Item, self).__init__(**kwargs)
+        self._details = details
+
+    @classmethod
+    def from_dict(cls, data):
+        obj = super(Item, cls).from_dict(data)
+        obj._details = data.get('details')
+        return obj
+
+    @property
+    def details(self):
+        """Typed details, decoded on first access."""
+        details = self._details
+        if isinstance(details, dict):
+            details = self._details = self.DETAILS.from_dict(details)
+        return details
+
+    def to_dict(self):
+        data = super(Item, self).to_dict()
+        details = self.details
+        data['details'] = details.to_dict() if details is not None else None
+        return data
+
+
+def _record(name, fields, base=Record, details=None, doc=None):
+    attrs = {'__slots__': tuple(fields), 'FIELDS': tuple(fields),
+             '__doc__': doc}
+    if details is not None:
+        attrs['DETAILS'] = details
+    return type(name, (base,), attrs)
+
+
+_ITEM = ('xid', 'title', 'type', 'sub_type', 'date', 'time_created',
+         'time_updated', 'time_completed')
+_PLACE = ('place_lat', 'place_lon', 'place_acc', 'place_name')
+
+
+MoveDetails = _record('MoveDetails', (
+    'distance', 'km', 'steps', 'active_time', 'longest_active',
+    'inactive_time', 'longest_idle', 'calories', 'bmr_day', 'bmr',
+    'bg_calories', 'wo_calories', 'wo_time', 'wo_active_time', 'wo_count',
+    'wo_longest', 'sunrise', 'sunset', 'tz', 'tzs'),
+    doc='Details of a :class:`Move`.')
+
+Move = _record('Move', _ITEM + ('snapshot_image',), Item, MoveDetails,
+               doc='A move (daily activity summary).')
+
+SleepDetails = _record('SleepDetails', (
+    'smart_alarm_fire', 'awake_time', 'asleep_time', 'awakenings', 'rem',
+    'light', 'deep', 'awake', 'duration', 'quality', 'tz'),
+    doc='Details of a :class:`Sleep`.')
+
+Sleep = _record('Sleep', _ITEM + _PLACE + ('snapshot_image',), Item,
+                SleepDetails, doc='A sleep.')
+
+WorkoutDetails = _record('WorkoutDetails', (
+    'steps', 'time', 'bg_active_time', 'meters', 'km', 'intensity',
+    'calories', 'bmr', 'bg_calories', 'bmr_calories', 'tz'),
+    doc='Details of a :class:`Workout`.')
+
+Workout = _record('Workout', _ITEM + _PLACE + ('snapshot_image', 'image'),
+                  Item, WorkoutDetails, doc='A workout.')
+
+MealDetails = _record('MealDetails', (
+    'num_foods', 'num_drinks', 'calories', 'sodium', 'fiber',
+    'saturated_fat', 'unsaturated_fat', 'polyunsaturated_fat',
+    'monounsaturated_fat', 'cholesterol', 'carbohydrate', 'protein',
+    'sugar', 'potassium', 'calcium', 'iron', 'vitamin_a', 'vitamin_c',
+    'accuracy', 'tz'),
+    doc='Details of a :class:`Meal`.')
+
+Meal = _record('Meal', _ITEM + _PLACE + ('note', 'photo', 'image'), Item,
+               MealDetails, doc='A meal.')
+
+MoodDetails = _record('MoodDetails', ('tz',), doc='Details of a :class:`Mood`.')
+
+Mood = _record('Mood', _ITEM, Item, MoodDetails, doc='A mood.')
+
+BodyEventDetails = _record('BodyEventDetails', ('tz',),
+                           doc='Details of a :class:`BodyEvent`.')
+
+BodyEvent = _record('BodyEvent', _ITEM + _PLACE + (
+    'weight', 'body_fat', 'lean_mass', 'bmi', 'note', 'image'), Item,
+    BodyEventDetails, doc='A body event (weight measurement).')
+
+HeartRateDetails = _record('HeartRateDetails', ('tz',),
+                           doc='Details of a :class:`HeartRate`.')
+
+HeartRate = _record('HeartRate', _ITEM + _PLACE + ('resting_heartrate',),
+                    Item, HeartRateDetails, doc='A resting heart rate.')
+
+Tick = _record('Tick', (
+    'time', 'steps', 'distance', 'active_time', 'calories', 'speed',
+    'aerobic', 'depth'),
+    doc='A single tick of a move, sleep or workout, see also '
+        ':class:`kiefer.ticks.TickColumns`.')
+
+
+class Trend(Record):
+    """
+    Values of a single day, as returned by ``get_trends()``.
+    """
+    __slots__ = FIELDS = (
+        'date', 'weight', 'height', 'gender', 'age', 'bmr', 'body_fat',
+        'm_steps', 'm_distance', 'm_active_time', 'm_calories',
+        'm_total_calories', 'm_lcit', 'm_lcat', 's_duration', 's_quality',
+        's_light', 's_deep', 's_awake', 's_awakenings', 's_asleep_time',
+        's_awake_time', 's_bedtime', 'e_calories', 'e_protein', 'e_carbs',
+        'e_fat', 'e_sugar', 'e_fiber', 'e_sodium', 'e_cholesterol',
+        'e_sat_fat', 'e_unsat_fat', 'e_caffeine')
+
+    @classmethod
+    def from_pair(cls, pair):
+        """Build a trend from a ``[date, values]`` pair."""
+        obj = cls.from_dict(pair[1])
+        obj.date = pair[0]
+        return obj
+
+    @classmethod
+    def from_items(cls, items):
+        """Convert ``[date, values]`` pairs lazily, e.g. ``stream_trends()``."""
+        for pair in items:
+            yield cls.from_pair(pair)
+
+    @classmethod
+    def from_response(cls, response):
+        """Convert the response of ``get_trends()``."""
+        return [cls.from_pair(pair) for pair in response['data']['data']]
+
+
+MODELS = {
+    'moves': Move,
+    'sleeps': Sleep,
+    'workouts': Workout,
+    'meals': Meal,
+    'moods': Mood,
+    'body_events': BodyEvent,
+    'heartrates': HeartRate,
+    'trends': Trend,
+    'ticks': Tick,
+}
+
+
+def from_response(resource, response):
+    """
+    Convert a list response to typed objects.
+
+    :param resource: ``str``, key of ``MODELS``, e.g. ``'moves'``; for
+                     ``'ticks'`` a :class:`kiefer.ticks.TickColumns` is returned
+    :param response: decoded response
+    """
+    if resource == 'ticks':
+        return TickColumns.from_response(response)
+    return MODELS[resource].from_response(response)
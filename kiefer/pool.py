@@ -0,0 +1,224 @@
+"""
+Multi-process worker pool for syncing many users.
+
+Decoding JSON is CPU bound, so one process can't keep up with thousands of
+users. :class:`WorkerPool` shards the users over several processes by a
+stable hash of the user key. Every process has its own connection-pooled
+session and runs ``threads`` jobs concurrently. A process which has worked
+through its own shard takes pending jobs from the shards of the others, so
+a few slow users don't leave cores idle.
+
+::
+
+    pool = WorkerPool(SyncJob('state/', 'data/'), processes=8, threads=16)
+    for res in pool.run(access_tokens):
+        if res.error is not None:
+            print(res.key, res.error)
+    print(pool.stats)
+
+The job is sent to the worker processes, so it must be picklable, e.g. a
+module level function or a :class:`SyncJob`.
+"""
+import multiprocessing
+import os
+import time
+import traceback
+import zlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from kiefer.client import KieferClient, create_session
+from kiefer.sync import JSONFileStateStore, JSONLinesSink, SyncEngine
+
+
+PoolResult = namedtuple('PoolResult', ['key', 'shard', 'worker', 'result',
+                                       'error', 'seconds'])
+PoolResult.__doc__ = """
+Outcome of a single job of a :class:`WorkerPool`.
+
+``shard`` is the shard the key was assigned to, ``worker`` the process
+which ran it; they differ if the job was stolen. ``error`` is the formatted
+exception of a failed job.
+"""
+
+
+def shard_of(key, shards):
+    """Return the shard of ``key``, stable across processes and runs."""
+    return zlib.crc32(str(key).encode('utf-8')) % shards
+
+
+class SyncJob(object):
+    """
+    Job syncing one user with a :class:`kiefer.sync.SyncEngine`.
+
+    State is kept in one JSON file per user, so processes never write the
+    same file.
+
+    :param state_directory: ``str``, directory of the state files
+    :param sink_directory: ``str``, output directory of the
+                           :class:`kiefer.sync.JSONLinesSink`
+    :param resources: names of the resources to sync
+    :param page_limit: ``int``, items requested per page
+    :param base_url: ``str``, overrides :attr:`KieferClient.BASE_URL`
+    :param client_kwargs: passed on to :class:`kiefer.client.KieferClient`
+    """
+
+    def __init__(self, state_directory, sink_directory, resources=None,
+                 page_limit=100, base_url=None, **client_kwargs):
+        self.state_directory = state_directory
+        self.sink_directory = sink_directory
+        self.resources = resources
+        self.page_limit = page_limit
+        self.base_url = base_url
+        self.client_kwargs = client_kwargs
+
+    def __call__(self, user, access_token, session):
+        client = KieferClient(access_token, session=session,
+                              **self.client_kwargs)
+        if self.base_url is not None:
+            client.BASE_URL = self.base_url
+        if not os.path.isdir(self.state_directory):
+            try:
+                os.makedirs(self.state_directory)
+            except OSError:
+                pass  # created by another process
+        state_store = JSONFileStateStore(
+            os.path.join(self.state_directory, '{}.json'.format(user)))
+        engine = SyncEngine(state_store, JSONLinesSink(self.sink_directory),
+                            self.resources, self.page_limit)
+        return engine.sync_user(user, client)
+
+
+def _worker(index, queues, unclaimed, results, func, threads):
+    session = create_session(pool_maxsize=threads)
+    # Own shard first, then the others, starting with the next one
+    order = [queues[(index + i) % len(queues)] for i in range(len(queues))]
+
+    def next_job():
+        # Queues may look empty while the parent is still filling them,
+        # so only stop once every job has been taken by some worker
+        while unclaimed.value > 0:
+            for q in order:
+                try:
+                    job = q.get(timeout=0.01)
+                except queue.Empty:
+                    continue
+                with unclaimed.get_lock():
+                    unclaimed.value -= 1
+                return job
+        return None
+
+    def run():
+        while True:
+            job = next_job()
+            if job is None:
+                return
+            shard, key, value = job
+            start = time.time()
+            try:
+                result, error = func(key, value, session), None
+            except Exception:
+                result, error = None, traceback.format_exc()
+            results.put(PoolResult(key, shard, index, result, error,
+                                   time.time() - start))
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for future in [executor.submit(run) for _ in range(threads)]:
+            future.result()
+    session.close()
+
+
+class WorkerPool(object):
+    """
+    Runs ``func(key, value, session)`` for many keys on a process pool.
+
+    :param func: picklable callable, e.g. :class:`SyncJob`
+    :param processes: ``int``, number of worker processes, defaults to the
+                      number of CPUs
+    :param threads: ``int``, concurrent jobs per process
+    """
+
+    def __init__(self, func, processes=None, threads=8):
+        self.func = func
+        self.processes = processes or multiprocessing.cpu_count()
+        self.threads = threads
+        self.stats = None
+
+    def _reset_stats(self):
+        self.stats = {
+            'done': 0, 'failed': 0, 'stolen': 0, 'seconds': 0.0,
+            'items': {},
+            'shards': [{'assigned': 0, 'done': 0, 'failed': 0, 'stolen': 0,
+                        'seconds': 0.0} for _ in range(self.processes)],
+        }
+
+    def _record(self, res):
+        stats = self.stats
+        worker = stats['shards'][res.worker]
+        key = 'failed' if res.error is not None else 'done'
+        stats[key] += 1
+        worker[key] += 1
+        worker['seconds'] += res.seconds
+        if res.shard != res.worker:
+            stats['stolen'] += 1
+            worker['stolen'] += 1
+        if isinstance(res.result, dict):
+            for name, count in res.result.items():
+                if isinstance(count, int):
+                    stats['items'][name] = stats['items'].get(name, 0) + count
+
+    def run(self, jobs, progress=None):
+        """
+        Run all jobs and yield a :class:`PoolResult` for each as it
+        completes.
+
+        ``stats`` holds the progress of the run: totals, items per
+        resource (for jobs returning ``dict`` objects of counts) and, per
+        process, the number of assigned, done, failed and stolen jobs and
+        the time spent in them.
+
+        :param jobs: ``dict`` mapping keys (e.g. users) to values (e.g.
+                     access tokens)
+        :param progress: callable receiving ``stats`` after every job
+        """
+        self._reset_stats()
+        start = time.time()
+        queues = [multiprocessing.Queue() for _ in range(self.processes)]
+        unclaimed = multiprocessing.Value('l', len(jobs))
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(
+            target=_worker,
+            args=(i, queues, unclaimed, results, self.func, self.threads))
+            for i in range(self.processes)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        for key, value in jobs.items():
+            shard = shard_of(key, self.processes)
+            self.stats['shards'][shard]['assigned'] += 1
+            queues[shard].put((shard, key, value))
+        try:
+            for _ in range(len(jobs)):
+                while True:
+                    try:
+                        res = results.get(timeout=1)
+                        break
+                    except queue.Empty:
+                        if not any(w.is_alive() for w in workers):
+                            raise RuntimeError('All workers exited with '
+                                               'pending jobs.')
+                self._record(res)
+                self.stats['seconds'] = time.time() - start
+                if progress is not None:
+                    progress(self.stats)
+                yield res
+        finally:
+            for worker in workers:
+                worker.join(timeout=5)
+                if worker.is_alive():
+                    worker.terminate()
@@ -0,0 +1,345 @@
+"""
+Client-side rate limiting, retries and failure handling.
+
+A :class:`RateLimiter` paces requests with token buckets, one per access
+token and optionally one for the whole app. It is thread-safe and never
+blocks while holding its lock, so the same instance can be shared by
+threads and by :class:`kiefer.aio.AsyncKieferClient` instances.
+
+:class:`CircuitBreaker` stops sending requests to a failing host for a
+while, :class:`HedgePolicy` sends a second GET request when the first one
+takes unusually long.
+"""
+import bisect
+import collections
+import email.utils
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    _clock = time.monotonic
+except AttributeError:
+    _clock = time.time
+
+
+class TokenBucket(object):
+    """
+    Token bucket that refills at ``rate`` tokens per second.
+
+    :param rate: ``float``, sustained requests per second
+    :param capacity: ``float``, maximum burst size, defaults to ``rate``
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self._tokens = self.capacity
+        self._updated = _clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self):
+        """
+        Take a token and return the number of seconds to wait before the
+        request may be sent.
+        """
+        with self._lock:
+            self._refill(_clock())
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+    def try_take(self):
+        """Take a token if one is available right now, return ``True`` if so."""
+        with self._lock:
+            self._refill(_clock())
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def give_back(self):
+        """Return a token taken with :meth:`try_take`."""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + 1)
+
+    def pause(self, seconds):
+        """Hand out no tokens for the next ``seconds`` seconds."""
+        with self._lock:
+            self._refill(_clock())
+            self._tokens = min(self._tokens, -seconds * self.rate)
+
+
+def parse_retry_after(value):
+    """
+    Parse a ``Retry-After`` header into seconds.
+
+    :param value: ``str``, delay in seconds or an HTTP date
+    :return: ``float`` or ``None``
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        parsed = email.utils.parsedate_tz(value)
+        if parsed is None:
+            return None
+        return max(0.0, email.utils.mktime_tz(parsed) - time.time())
+
+
+class RateLimiter(object):
+    """
+    Paces requests per access token and per app.
+
+    :param per_token: ``float``, requests per second for each access token
+    :param per_app: ``float``, requests per second for all tokens together
+    :param burst: ``float``, bucket capacity, defaults to one second worth
+                  of requests
+    """
+
+    def __init__(self, per_token=None, per_app=None, burst=None):
+        self.per_token = per_token
+        self.burst = burst
+        self._app_bucket = TokenBucket(per_app, burst) if per_app else None
+        self._token_buckets = {}
+        self._lock = threading.Lock()
+
+    def _buckets(self, access_token):
+        buckets = []
+        if self.per_token:
+            with self._lock:
+                if access_token not in self._token_buckets:
+                    self._token_buckets[access_token] = TokenBucket(
+                        self.per_token, self.burst)
+                buckets.append(self._token_buckets[access_token])
+        if self._app_bucket is not None:
+            buckets.append(self._app_bucket)
+        return buckets
+
+    def reserve(self, access_token):
+        """
+        Reserve a request for ``access_token``.
+
+        :return: ``float``, seconds to wait before sending it
+        """
+        return max([b.reserve() for b in self._buckets(access_token)] or [0.0])
+
+    def acquire(self, access_token):
+        """Block until a request for ``access_token`` may be sent."""
+        delay = self.reserve(access_token)
+        if delay > 0:
+            time.sleep(delay)
+
+    def try_acquire(self, access_token):
+        """
+        Take a request for ``access_token`` only if it may be sent without
+        waiting.
+
+        :return: ``bool``
+        """
+        taken = []
+        for bucket in self._buckets(access_token):
+            if not bucket.try_take():
+                for b in taken:
+                    b.give_back()
+                return False
+            taken.append(bucket)
+        return True
+
+    def update(self, access_token, status_code, headers):
+        """
+        Adjust to the rate limit state reported by the API.
+
+        A 429 response or an exhausted ``X-RateLimit-Remaining`` header pause
+        the buckets of the token (and the app) until the limit resets.
+
+        :param access_token: ``str``
+        :param status_code: ``int``, HTTP status of the response
+        :param headers: response headers
+        """
+        pause = None
+        if status_code == 429:
+            pause = parse_retry_after(headers.get('Retry-After')) or 1.0
+        elif headers.get('X-RateLimit-Remaining') == '0':
+            reset = headers.get('X-RateLimit-Reset')
+            if reset:
+                reset = float(reset)
+                # The reset is either a unix timestamp or a delay in seconds
+                pause = reset - time.time() if reset > 1e9 else reset
+        if pause:
+            for bucket in self._buckets(access_token):
+                bucket.pause(pause)
+
+
+class RetryPolicy(object):
+    """
+    Exponential backoff with full jitter for throttled and failed requests.
+
+    429 responses are retried for every method, server errors only for
+    idempotent ones.
+
+    :param max_retries: ``int``, maximum number of retries per request
+    :param backoff: ``float``, base delay in seconds
+    :param max_backoff: ``float``, maximum delay in seconds
+    :param retry_statuses: server error statuses to retry
+    """
+    idempotent_methods = ('get', 'delete')
+
+    def __init__(self, max_retries=5, backoff=0.5, max_backoff=60,
+                 retry_statuses=(500, 502, 503, 504)):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_statuses = retry_statuses
+
+    def should_retry(self, method, status_code, attempt):
+        """
+        Decide whether a response should be retried.
+
+        :param method: ``str``, lower case HTTP method
+        :param status_code: ``int``
+        :param attempt: ``int``, number of retries so far
+        """
+        if attempt >= self.max_retries:
+            return False
+        if status_code == 429:
+            return True
+        return (status_code in self.retry_statuses and
+                method.lower() in self.idempotent_methods)
+
+    def delay(self, attempt, retry_after=None):
+        """
+        Seconds to wait before the next attempt.
+
+        :param attempt: ``int``, number of retries so far
+        :param retry_after: value of the ``Retry-After`` header, which takes
+                            precedence over the backoff
+        """
+        seconds = parse_retry_after(retry_after)
+        if seconds is not None:
+            return seconds
+        return random.uniform(0, min(self.max_backoff,
+                                     self.backoff * 2 ** attempt))
+
+
+class CircuitBreaker(object):
+    """
+    Per-host circuit breaker.
+
+    After ``failure_threshold`` consecutive failures (connection errors,
+    timeouts or 5xx responses) the circuit of the host *opens* and requests
+    fail immediately. After ``reset_timeout`` seconds a single trial request
+    is let through; if it succeeds the circuit closes again, otherwise it
+    stays open for another ``reset_timeout``.
+
+    :param failure_threshold: ``int``, consecutive failures opening the circuit
+    :param reset_timeout: ``float``, seconds until a trial request is allowed
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = {}
+        self._opened = {}
+        self._trial = set()
+        self._lock = threading.Lock()
+
+    def allow(self, host):
+        """Return ``True`` if a request to ``host`` may be sent."""
+        with self._lock:
+            opened = self._opened.get(host)
+            if opened is None:
+                return True
+            if host in self._trial or _clock() - opened < self.reset_timeout:
+                return False
+            self._trial.add(host)
+            return True
+
+    def record(self, host, success):
+        """
+        Record the outcome of a request to ``host``.
+
+        :param success: ``bool``, ``False`` for connection errors, timeouts
+                        and server errors
+        """
+        with self._lock:
+            self._trial.discard(host)
+            if success:
+                self._failures.pop(host, None)
+                self._opened.pop(host, None)
+                return
+            failures = self._failures[host] = self._failures.get(host, 0) + 1
+            if failures >= self.failure_threshold or host in self._opened:
+                self._opened[host] = _clock()
+
+    def release(self, host):
+        """
+        Forget a trial request to ``host`` whose outcome is unknown, e.g.
+        because it was cancelled, so the next request can be the trial.
+        """
+        with self._lock:
+            self._trial.discard(host)
+
+    def is_open(self, host):
+        """Return ``True`` while requests to ``host`` are rejected."""
+        with self._lock:
+            return host in self._opened
+
+
+class HedgePolicy(object):
+    """
+    Hedged GET requests.
+
+    If a GET request has not been answered after the ``quantile`` of the
+    recent latencies, a second, identical request is sent and the first
+    response is used. The second request is skipped if the client's rate
+    limiter has no request to spare. Requests run on a thread pool owned by
+    the policy, which can be shared by many clients.
+
+    :param quantile: ``float``, latency quantile after which to hedge
+    :param window: ``int``, number of recent latencies to keep
+    :param min_samples: ``int``, latencies needed before hedging starts
+    :param min_delay: ``float``, lower bound of the hedging delay in seconds
+    :param max_workers: ``int``, size of the thread pool
+    """
+
+    def __init__(self, quantile=0.95, window=1000, min_samples=20,
+                 min_delay=0.01, max_workers=32):
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self._latencies = collections.deque(maxlen=window)
+        self._sorted = []
+        self._lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def observe(self, seconds):
+        """Record the latency of a request."""
+        with self._lock:
+            if len(self._latencies) == self._latencies.maxlen:
+                oldest = self._latencies[0]
+                del self._sorted[bisect.bisect_left(self._sorted, oldest)]
+            self._latencies.append(seconds)
+            bisect.insort(self._sorted, seconds)
+
+    def delay(self):
+        """
+        Seconds to wait for the first response before hedging, or ``None``
+        while there are too few samples.
+        """
+        with self._lock:
+            if len(self._sorted) < self.min_samples:
+                return None
+            index = min(len(self._sorted) - 1,
+                        int(self.quantile * len(self._sorted)))
+            return max(self.min_delay, self._sorted[index])
+
+    def shutdown(self):
+        """Shut down the thread pool."""
+        self.executor.shutdown(wait=False)
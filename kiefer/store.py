@@ -0,0 +1,246 @@
+"""
+Local time-series store for synced UP data.
+
+:class:`TimeSeriesStore` keeps items in sqlite, indexed by user, resource
+and ``time_created`` and by ``xid``, and remembers which time ranges were
+fetched completely. :class:`LocalHistory` answers ``get_*`` calls from the
+store and only requests the parts of a range it hasn't seen yet:
+
+::
+
+    store = TimeSeriesStore('history.db')
+    history = LocalHistory(client, store, user='alice')
+    history.get_sleeps(start_time=start, end_time=end)   # fetches the range
+    history.get_sleeps(start_time=start, end_time=end)   # served locally
+
+The store can also be used as sink of a :class:`kiefer.sync.SyncEngine`.
+"""
+import calendar
+import datetime
+import json
+import sqlite3
+import threading
+import time
+
+from kiefer.sync import RESOURCES
+
+# Dates are local to the user, whose UTC offset is between -12 and +14 hours
+_DATE_BEFORE = 14 * 60 * 60
+_DATE_AFTER = 36 * 60 * 60
+
+
+def date_range(date):
+    """
+    Return a ``(start, end)`` time range containing the whole day ``date``
+    in every time zone.
+
+    :param date: ``int`` or ``str``, ``YYYYMMDD``
+    """
+    day = datetime.datetime.strptime(str(date), '%Y%m%d')
+    midnight = calendar.timegm(day.timetuple())
+    return midnight - _DATE_BEFORE, midnight + _DATE_AFTER
+
+
+class TimeSeriesStore(object):
+    """
+    sqlite store of UP items.
+
+    :param path: ``str``, path of the database file
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS items ('
+                'user TEXT, resource TEXT, xid TEXT, time INTEGER, '
+                'date INTEGER, updated INTEGER, body TEXT, '
+                'PRIMARY KEY (user, resource, xid))')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS items_time '
+                               'ON items (user, resource, time)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS items_xid '
+                               'ON items (xid)')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS coverage ('
+                'user TEXT, resource TEXT, start INTEGER, end INTEGER)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS coverage_key '
+                               'ON coverage (user, resource)')
+
+    def put_items(self, user, resource, items):
+        """
+        Insert or update items in bulk.
+
+        :param user: ``str``, user key
+        :param resource: ``str``, name in ``kiefer.sync.RESOURCES``
+        :param items: iterable of item dicts
+        """
+        rows = [(user, resource, item['xid'], item.get('time_created'),
+                 item.get('date'), item.get('time_updated'),
+                 json.dumps(item)) for item in items]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?, ?, ?)',
+                rows)
+        return len(rows)
+
+    # Sink interface of kiefer.sync.SyncEngine
+    write = put_items
+
+    def get_item(self, xid):
+        """Return the item with ``xid`` or ``None``."""
+        with self._lock:
+            row = self._conn.execute('SELECT body FROM items WHERE xid = ?',
+                                     (xid,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def query(self, user, resource, start_time=None, end_time=None,
+              date=None, updated_after=None, limit=None):
+        """
+        Return stored items, newest first like the API.
+
+        Takes the same filters as the ``get_*`` methods of the client.
+        """
+        sql = 'SELECT body FROM items WHERE user = ? AND resource = ?'
+        args = [user, resource]
+        for column, op, value in (('time', '>=', start_time),
+                                  ('time', '<=', end_time),
+                                  ('date', '=', date),
+                                  ('updated', '>', updated_after)):
+            if value is not None:
+                sql += ' AND {} {} ?'.format(column, op)
+                args.append(int(value))
+        sql += ' ORDER BY time DESC'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            args.append(int(limit))
+        with self._lock:
+            rows = self._conn.execute(sql, args).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def _coverage(self, user, resource):
+        return self._conn.execute(
+            'SELECT start, end FROM coverage WHERE user = ? AND resource = ? '
+            'ORDER BY start', (user, resource)).fetchall()
+
+    def mark_covered(self, user, resource, start, end):
+        """Record that all items between ``start`` and ``end`` are stored."""
+        with self._lock, self._conn:
+            merged = []
+            for s, e in sorted(self._coverage(user, resource) + [(start, end)]):
+                if merged and s <= merged[-1][1] + 1:
+                    merged[-1][1] = max(merged[-1][1], e)
+                else:
+                    merged.append([s, e])
+            self._conn.execute(
+                'DELETE FROM coverage WHERE user = ? AND resource = ?',
+                (user, resource))
+            self._conn.executemany(
+                'INSERT INTO coverage VALUES (?, ?, ?, ?)',
+                [(user, resource, s, e) for s, e in merged])
+
+    def gaps(self, user, resource, start, end):
+        """
+        Return the parts of ``start`` to ``end`` which are not covered, as a
+        list of ``(start, end)`` tuples.
+        """
+        with self._lock:
+            covered = self._coverage(user, resource)
+        gaps = []
+        cursor = start
+        for s, e in covered:
+            if e < cursor:
+                continue
+            if s > end:
+                break
+            if s > cursor:
+                gaps.append((cursor, s - 1))
+            cursor = e + 1
+        if cursor <= end:
+            gaps.append((cursor, end))
+        return gaps
+
+    def close(self):
+        self._conn.close()
+
+
+def _getter(resource, method):
+    def get(self, **kwargs):
+        return self.get(resource, **kwargs)
+    get.__name__ = method
+    get.__doc__ = 'Like :func:`KieferClient.{}`, served from the store.'.format(
+        method)
+    return get
+
+
+class LocalHistory(object):
+    """
+    Serves the list endpoints of a client from a :class:`TimeSeriesStore`.
+
+    Only calls with a ``date`` or a ``start_time`` and no arguments other
+    than ``end_time``, ``updated_after`` and ``limit`` are answered locally;
+    other calls, e.g. ``get_moves(limit=10)``, go to the client. Missing
+    parts of the requested range are fetched, stored and marked as covered,
+    except for the last ``recent`` seconds, which may still change and are
+    always fetched.
+
+    Responses have the same shape as the API responses, without pagination
+    links: all items of the range are returned at once.
+
+    :param client: :class:`kiefer.client.KieferClient`
+    :param store: :class:`TimeSeriesStore`
+    :param user: ``str``, key of the client's user in the store
+    :param recent: ``float``, seconds before now which are never covered
+    """
+    LOCAL_ARGS = frozenset(['start_time', 'end_time', 'date', 'updated_after',
+                            'limit'])
+
+    def __init__(self, client, store, user, recent=24 * 60 * 60):
+        self.client = client
+        self.store = store
+        self.user = user
+        self.recent = recent
+
+    def get(self, resource, **kwargs):
+        """
+        Get items of ``resource``, e.g. ``'moves'``, using the same keyword
+        arguments as the client's ``get_*`` methods.
+        """
+        if not set(kwargs) <= self.LOCAL_ARGS or (
+                kwargs.get('date') is None and
+                kwargs.get('start_time') is None):
+            # Without a start the whole history would be fetched
+            return getattr(self.client, RESOURCES[resource])(**kwargs)
+        now = int(time.time())
+        if kwargs.get('date') is not None:
+            start, end = date_range(kwargs['date'])
+        else:
+            start = int(kwargs['start_time'])
+            end = int(kwargs.get('end_time') or now)
+        end = min(end, now)
+        stable = now - int(self.recent)
+        for gap_start, gap_end in self.store.gaps(self.user, resource,
+                                                  start, end):
+            self.fetch(resource, gap_start, gap_end)
+            if gap_start <= stable:
+                self.store.mark_covered(self.user, resource, gap_start,
+                                        min(gap_end, stable))
+        items = self.store.query(self.user, resource, **kwargs)
+        return {'meta': {'code': 200},
+                'data': {'items': items, 'size': len(items), 'links': {}}}
+
+    def fetch(self, resource, start, end):
+        """Fetch all items between ``start`` and ``end`` into the store."""
+        method = 'iter_' + RESOURCES[resource][len('get_'):]
+        items = getattr(self.client, method)(start_time=start, end_time=end)
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= 1000:
+                self.store.put_items(self.user, resource, batch)
+                batch = []
+        self.store.put_items(self.user, resource, batch)
+
+
+for _resource, _method in RESOURCES.items():
+    setattr(LocalHistory, _method, _getter(_resource, _method))
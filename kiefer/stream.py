@@ -0,0 +1,144 @@
+"""
+Incremental parsing of large list responses.
+
+:class:`ItemStreamParser` is fed the response body chunk by chunk and
+returns the elements of one list inside the document (``data.items`` by
+default) as soon as they are complete, so memory use is bounded by the
+size of a single item instead of the whole response.
+"""
+import codecs
+import json
+
+_ARRAY = object()
+_WHITESPACE = ' \t\r\n,'
+
+
+class ItemStreamParser(object):
+    """
+    Incremental parser for the items of a JSON list.
+
+    ::
+
+        parser = ItemStreamParser(('data', 'items'))
+        for chunk in chunks:
+            for item in parser.feed(chunk):
+                ...
+        parser.close()
+
+    :param path: keys leading to the list, e.g. ``('data', 'items')``
+    """
+
+    def __init__(self, path=('data', 'items')):
+        self.path = list(path)
+        self._decoder = json.JSONDecoder()
+        self._text = codecs.getincrementaldecoder('utf-8')()
+        self._buf = ''
+        self._pos = 0
+        self._state = 'seek'
+        # One entry per open container: the current key of an object
+        # or _ARRAY for arrays
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._chars = []
+        self._last_string = None
+
+    def feed(self, data):
+        """
+        Add a chunk of the response body.
+
+        :param data: ``bytes`` or ``str``
+        :return: ``list`` of items completed by this chunk
+        """
+        if isinstance(data, bytes):
+            data = self._text.decode(data)
+        if self._state == 'done':
+            return []
+        self._buf = self._buf[self._pos:] + data
+        self._pos = 0
+        items = []
+        if self._state == 'seek':
+            self._seek()
+        if self._state == 'items':
+            self._parse_items(items)
+        return items
+
+    def close(self):
+        """
+        Signal the end of the body.
+
+        :raises ValueError: if the body ended inside the list
+        """
+        if self._state == 'items':
+            raise ValueError('Response ended before the end of the item list.')
+
+    def _seek(self):
+        buf, i = self._buf, self._pos
+        while i < len(buf):
+            c = buf[i]
+            i += 1
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    self._last_string = ''.join(self._chars)
+                else:
+                    self._chars.append(c)
+            elif c == '"':
+                self._in_string = True
+                self._chars = []
+            elif c == ':':
+                if self._stack and self._stack[-1] is not _ARRAY:
+                    self._stack[-1] = self._last_string
+            elif c == '{':
+                self._stack.append(None)
+            elif c == '[':
+                if self._stack == self.path:
+                    self._state = 'items'
+                    break
+                self._stack.append(_ARRAY)
+            elif c in '}]':
+                self._stack.pop()
+        self._pos = i
+
+    def _parse_items(self, items):
+        buf, pos = self._buf, self._pos
+        while True:
+            while pos < len(buf) and buf[pos] in _WHITESPACE:
+                pos += 1
+            if pos == len(buf):
+                break
+            if buf[pos] == ']':
+                self._state = 'done'
+                pos += 1
+                break
+            try:
+                item, end = self._decoder.raw_decode(buf, pos)
+            except ValueError:
+                # Item is not complete yet
+                break
+            if not isinstance(item, (dict, list)) and (
+                    end == len(buf) or buf[end] not in _WHITESPACE + ']'):
+                # A number might continue in the next chunk, e.g. "3." or
+                # "3e", accept it only once a delimiter follows
+                break
+            items.append(item)
+            pos = end
+        self._pos = pos
+
+
+def iter_items(chunks, path=('data', 'items')):
+    """
+    Yield the items of a list inside a JSON document given as chunks.
+
+    :param chunks: iterable of ``bytes`` or ``str``
+    :param path: keys leading to the list
+    """
+    parser = ItemStreamParser(path)
+    for chunk in chunks:
+        for item in parser.feed(chunk):
+            yield item
+    parser.close()
@@ -0,0 +1,176 @@
+"""
+Incremental synchronisation of UP data.
+
+:class:`SyncEngine` remembers, per user and resource type, the newest
+``time_updated`` it has seen (the *high-water mark*) and only requests items
+updated after it on the next run. Items are handed to a *sink* page by page;
+progress is committed to a *state store* after every page, so an
+interrupted run resumes where it stopped.
+
+Delivery is at-least-once: after a crash the last page may be written to
+the sink again, so sinks should upsert items by ``xid``.
+"""
+import json
+import os
+import threading
+
+try:
+    from urllib.parse import urljoin
+except ImportError:
+    from urlparse import urljoin
+
+from kiefer.util import atomic_write, next_link
+
+
+RESOURCES = {
+    'moves': 'get_moves',
+    'sleeps': 'get_sleeps',
+    'workouts': 'get_workouts',
+    'meals': 'get_meals',
+    'moods': 'get_moods',
+    'body_events': 'get_body_events',
+    'heartrates': 'get_heart_rates',
+}
+
+
+class MemoryStateStore(object):
+    """Keeps sync state in memory, mainly useful for testing."""
+
+    def __init__(self):
+        self._state = {}
+        self._lock = threading.Lock()
+
+    def get(self, user, resource):
+        """Return the state ``dict`` of ``user`` and ``resource`` or ``None``."""
+        with self._lock:
+            state = self._state.get((user, resource))
+            return dict(state) if state is not None else None
+
+    def set(self, user, resource, state):
+        """Store the state ``dict`` of ``user`` and ``resource``."""
+        with self._lock:
+            self._state[(user, resource)] = dict(state)
+
+
+class JSONFileStateStore(MemoryStateStore):
+    """
+    Keeps sync state in a JSON file, which is replaced atomically on every
+    update.
+
+    :param path: ``str``, path of the state file
+    """
+
+    def __init__(self, path):
+        super(JSONFileStateStore, self).__init__()
+        self.path = path
+        if os.path.isfile(path):
+            with open(path) as f:
+                for user, resources in json.load(f).items():
+                    for resource, state in resources.items():
+                        self._state[(user, resource)] = state
+
+    def set(self, user, resource, state):
+        with self._lock:
+            self._state[(user, resource)] = dict(state)
+            data = {}
+            for (u, r), s in self._state.items():
+                data.setdefault(u, {})[r] = s
+            atomic_write(self.path, json.dumps(data, sort_keys=True))
+
+
+class JSONLinesSink(object):
+    """
+    Appends synced items to ``<directory>/<user>/<resource>.jsonl``.
+
+    :param directory: ``str``, output directory
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def write(self, user, resource, items):
+        user_dir = os.path.join(self.directory, str(user))
+        if not os.path.isdir(user_dir):
+            os.makedirs(user_dir)
+        with open(os.path.join(user_dir, resource + '.jsonl'), 'a') as f:
+            for item in items:
+                f.write(json.dumps(item) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def _updated(item):
+    return item.get('time_updated') or item.get('time_created') or 0
+
+
+class SyncEngine(object):
+    """
+    Fetches everything that changed since the last run.
+
+    ::
+
+        engine = SyncEngine(JSONFileStateStore('state.json'),
+                            JSONLinesSink('data/'))
+        engine.sync_user('user_xid', KieferClient(access_token))
+
+    :param state_store: e.g. :class:`JSONFileStateStore`
+    :param sink: object with a ``write(user, resource, items)`` method,
+                 e.g. :class:`JSONLinesSink`
+    :param resources: names of the resources to sync, see ``RESOURCES``
+    :param page_limit: ``int``, items requested per page
+    """
+
+    def __init__(self, state_store, sink, resources=None, page_limit=100):
+        self.state_store = state_store
+        self.sink = sink
+        self.resources = list(resources or sorted(RESOURCES))
+        self.page_limit = page_limit
+
+    def sync_user(self, user, client):
+        """
+        Sync all resources of a user.
+
+        :param user: ``str``, key identifying the user in state and sink
+        :param client: :class:`kiefer.client.KieferClient` of that user
+        :return: ``dict`` mapping resource names to the number of new items
+        """
+        return dict((resource, self.sync_resource(user, client, resource))
+                    for resource in self.resources)
+
+    def sync_resource(self, user, client, resource):
+        """
+        Sync a single resource of a user.
+
+        :return: ``int``, number of items written to the sink
+        """
+        state = self.state_store.get(user, resource) or {}
+        high_water_mark = state.get('high_water_mark')
+        pending = state.get('pending')
+        if pending is not None:
+            # Resume an interrupted run at the page after the last commit
+            page = client._get_url(urljoin(client.BASE_URL, pending['next']))
+            run_max = pending['max']
+        else:
+            params = {'limit': self.page_limit}
+            if high_water_mark is not None:
+                params['updated_after'] = high_water_mark
+            page = getattr(client, RESOURCES[resource])(**params)
+            run_max = high_water_mark
+
+        count = 0
+        while True:
+            items = page['data']['items']
+            if items:
+                self.sink.write(user, resource, items)
+                count += len(items)
+                run_max = max(run_max or 0, max(_updated(i) for i in items))
+            link = next_link(page)
+            if link is None:
+                break
+            state['pending'] = {'next': link, 'max': run_max}
+            self.state_store.set(user, resource, state)
+            page = client._get_url(urljoin(client.BASE_URL, link))
+
+        self.state_store.set(user, resource,
+                             {'high_water_mark': run_max, 'pending': None})
+        return count
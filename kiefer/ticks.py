@@ -0,0 +1,181 @@
+"""
+Compact, column-oriented representation of tick data.
+
+Tick endpoints (:func:`KieferClient.get_move_ticks`,
+:func:`KieferClient.get_sleep_phases`, :func:`KieferClient.get_workout_ticks`)
+return one small dict per minute. :class:`TickColumns` stores each field
+in a single :class:`array.array` instead, or a NumPy array if NumPy is
+installed, which takes a fraction of the memory and allows fast
+aggregations.
+"""
+from array import array
+from collections import OrderedDict
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def _column(values):
+    if all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+        return array('q', values)
+    return array('d', (float('nan') if v is None else v for v in values))
+
+
+class TickColumns(object):
+    """
+    Tick data with one array per field, ordered by ``time``.
+
+    ::
+
+        ticks = client.get_move_ticks(xid, columnar=True)
+        ticks['steps']            # array of steps per tick
+        ticks.daily_totals('steps')
+
+    :param columns: ``dict`` mapping field names to arrays of equal length,
+                    must contain ``time``
+    """
+    __slots__ = ('columns',)
+
+    def __init__(self, columns):
+        self.columns = OrderedDict(columns)
+
+    @classmethod
+    def from_items(cls, items, fields=None, use_numpy=True):
+        """
+        Build columns from a list of tick dicts.
+
+        :param items: ``list`` of ``dict``
+        :param fields: field names to keep, defaults to all fields
+        :param use_numpy: ``bool``, use NumPy arrays if NumPy is installed
+        """
+        items = sorted(items, key=lambda item: item['time'])
+        if fields is None:
+            fields = sorted(set(key for item in items for key in item))
+        fields = ['time'] + [field for field in fields if field != 'time']
+        columns = OrderedDict()
+        for field in fields:
+            columns[field] = _column([item.get(field) for item in items])
+            if use_numpy and numpy is not None:
+                columns[field] = numpy.frombuffer(
+                    columns[field], dtype=numpy.dtype(columns[field].typecode))
+        return cls(columns)
+
+    @classmethod
+    def from_response(cls, response, fields=None, use_numpy=True):
+        """
+        Build columns from a decoded ticks response.
+
+        :param response: ``dict`` as returned by the tick endpoints
+        """
+        return cls.from_items(response['data']['items'], fields, use_numpy)
+
+    def __len__(self):
+        return len(self.columns['time'])
+
+    def __getitem__(self, field):
+        return self.columns[field]
+
+    def __contains__(self, field):
+        return field in self.columns
+
+    @property
+    def fields(self):
+        return list(self.columns)
+
+    def _numpy(self):
+        return numpy is not None and isinstance(self.columns['time'],
+                                                numpy.ndarray)
+
+    def resample(self, seconds, fields=None):
+        """
+        Sum fields over fixed time buckets.
+
+        :param seconds: ``int``, bucket size, e.g. ``3600`` for hourly values
+        :param fields: fields to sum, defaults to all fields except ``time``
+        :return: :class:`TickColumns` with one row per non-empty bucket,
+                 ``time`` being the start of the bucket
+        """
+        if fields is None:
+            fields = [f for f in self.columns if f != 'time']
+        time = self.columns['time']
+        columns = OrderedDict()
+        if self._numpy():
+            buckets = time // seconds * seconds
+            starts, index = numpy.unique(buckets, return_inverse=True)
+            columns['time'] = starts
+            for field in fields:
+                values = numpy.nan_to_num(self.columns[field].astype('float64'))
+                columns[field] = numpy.bincount(index, weights=values,
+                                                minlength=len(starts))
+            return TickColumns(columns)
+
+        sums = OrderedDict()
+        for i, t in enumerate(time):
+            row = sums.setdefault(t // seconds * seconds, [0.0] * len(fields))
+            for j, field in enumerate(fields):
+                value = self.columns[field][i]
+                if value == value:  # skip NaN
+                    row[j] += value
+        columns['time'] = array('q', sums)
+        for j, field in enumerate(fields):
+            columns[field] = array('d', (row[j] for row in sums.values()))
+        return TickColumns(columns)
+
+    def daily_totals(self, field, utc_offset=0):
+        """
+        Sum a field per day.
+
+        :param field: ``str``, e.g. ``'steps'``
+        :param utc_offset: ``int``, seconds to add to ``time`` to get local
+                           time, days start at local midnight
+        :return: ``dict`` mapping the start of each day (unix timestamp,
+                 local midnight) to the total
+        """
+        shifted = TickColumns(OrderedDict(
+            [('time', self._shift(self.columns['time'], utc_offset)),
+             (field, self.columns[field])]))
+        daily = shifted.resample(_SECONDS_PER_DAY, [field])
+        return OrderedDict((int(t) - utc_offset, float(v))
+                           for t, v in zip(daily['time'], daily[field]))
+
+    @staticmethod
+    def _shift(values, offset):
+        if numpy is not None and isinstance(values, numpy.ndarray):
+            return values + offset
+        return array(values.typecode, (v + offset for v in values))
+
+    def window_sums(self, field, size):
+        """
+        Rolling sums over ``size`` consecutive ticks.
+
+        Missing values (NaN) count as zero, like in :meth:`resample`.
+
+        :param field: ``str``, e.g. ``'calories'``
+        :param size: ``int``, number of ticks per window, at least 1
+        :return: array with ``len(self) - size + 1`` sums
+        """
+        if size < 1:
+            raise ValueError('Window size must be at least 1.')
+        values = self.columns[field]
+        if self._numpy():
+            cumsum = numpy.concatenate(
+                ([0.0], numpy.cumsum(numpy.nan_to_num(values.astype('float64')))))
+            return cumsum[size:] - cumsum[:-size]
+
+        sums = array('d')
+        total = 0.0
+        for i, value in enumerate(values):
+            # NaN != NaN, it must never enter the running total
+            if value == value:
+                total += value
+            if i >= size:
+                old = values[i - size]
+                if old == old:
+                    total -= old
+            if i >= size - 1:
+                sums.append(total)
+        return sums
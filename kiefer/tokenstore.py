@@ -0,0 +1,242 @@
+"""
+Persistent token stores for :class:`kiefer.auth.KieferAuth`.
+
+The UP API rotates refresh tokens: after a refresh, the old refresh token
+stops working. When many processes work with the same user, they have to
+share the tokens, otherwise each process refreshes on its own and
+invalidates the tokens of all others.
+
+A token store keeps the tokens of every user and offers a lock per user
+across processes. :meth:`KieferAuth.refresh_access_token` holds that lock
+while it refreshes, and skips the refresh if another process already stored
+a new token. Refreshes of different users don't wait for each other.
+Loaded tokens are cached in the process and only read again when the store
+has changed.
+"""
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from kiefer.util import atomic_write
+
+
+class MemoryTokenStore(object):
+    """
+    Keeps tokens in memory; shared by threads, but not by processes.
+
+    Tokens are ``dict`` objects with the keys ``access_token``,
+    ``refresh_token`` and ``expires_at``.
+    """
+
+    def __init__(self):
+        self._tokens = {}
+        self._lock = threading.RLock()
+        self._user_locks = {}
+        # Nesting depth of lock() per user, only changed by the thread
+        # holding the user's lock
+        self._depth = {}
+
+    def load(self, user):
+        """Return the token ``dict`` of ``user`` or ``None``."""
+        with self._lock:
+            token = self._tokens.get(user)
+            return dict(token) if token is not None else None
+
+    def save(self, user, token):
+        """Store the token ``dict`` of ``user``."""
+        with self._lock:
+            self._tokens[user] = dict(token)
+
+    def _user_lock(self, user):
+        with self._lock:
+            return self._user_locks.setdefault(user, threading.RLock())
+
+    @contextlib.contextmanager
+    def lock(self, user):
+        """
+        Context manager serialising refreshes of ``user``'s tokens. It is
+        reentrant and doesn't block other users.
+        """
+        with self._user_lock(user):
+            if self._depth.get(user):
+                # Already held by this thread
+                yield
+                return
+            self._depth[user] = 1
+            try:
+                with self._acquire(user):
+                    yield
+            finally:
+                del self._depth[user]
+
+    @contextlib.contextmanager
+    def _acquire(self, user):
+        # Excludes other processes in persistent stores
+        yield
+
+
+@contextlib.contextmanager
+def _flock(path):
+    if fcntl is None:
+        yield
+        return
+    with open(path, 'a') as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+class FileTokenStore(MemoryTokenStore):
+    """
+    Keeps tokens of all users in a JSON file.
+
+    Updates replace the file atomically while holding an exclusive
+    ``fcntl`` lock on ``<path>.lock``, which is only held for the write.
+    :meth:`lock` takes a separate ``fcntl`` lock for each user, in the
+    directory ``<path>.locks``. The file is only read again after it was
+    replaced.
+
+    :param path: ``str``, path of the token file
+    """
+
+    def __init__(self, path):
+        super(FileTokenStore, self).__init__()
+        self.path = path
+        self._stat = None
+
+    def _file_stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime, st.st_size, st.st_ino
+
+    def _reload(self):
+        stat = self._file_stat()
+        if stat != self._stat:
+            if stat is None:
+                self._tokens = {}
+            else:
+                with open(self.path) as f:
+                    self._tokens = json.load(f)
+            self._stat = stat
+
+    def load(self, user):
+        with self._lock:
+            self._reload()
+            return super(FileTokenStore, self).load(user)
+
+    def save(self, user, token):
+        with self._lock, _flock(self.path + '.lock'):
+            self._reload()
+            self._tokens[user] = dict(token)
+            atomic_write(self.path, json.dumps(self._tokens, sort_keys=True))
+            self._stat = self._file_stat()
+
+    def _acquire(self, user):
+        directory = self.path + '.locks'
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                pass  # created by another process
+        name = hashlib.sha1(user.encode('utf-8')).hexdigest()
+        return _flock(os.path.join(directory, name))
+
+
+class SQLiteTokenStore(MemoryTokenStore):
+    """
+    Keeps tokens in a sqlite database.
+
+    :meth:`lock` takes a lease on the user's row of a ``locks`` table,
+    which excludes other processes from refreshing that user. A lease
+    expires after ``lock_timeout`` seconds, so a crashed process doesn't
+    block the user forever; it should be longer than a refresh can take.
+    Cached tokens are used as long as sqlite's ``data_version`` shows no
+    commit by another connection.
+
+    :param path: ``str``, path of the database file
+    :param lock_timeout: ``float``, seconds until a lease expires
+    """
+    poll_interval = 0.05
+
+    def __init__(self, path, lock_timeout=120):
+        super(SQLiteTokenStore, self).__init__()
+        self.lock_timeout = lock_timeout
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None,
+                                     check_same_thread=False)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS tokens ('
+                           'user TEXT PRIMARY KEY, access_token TEXT, '
+                           'refresh_token TEXT, expires_at REAL)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS locks ('
+                           'user TEXT PRIMARY KEY, owner TEXT, expires REAL)')
+        self._version = None
+
+    def _reload(self):
+        version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+        if version != self._version:
+            rows = self._conn.execute(
+                'SELECT user, access_token, refresh_token, expires_at '
+                'FROM tokens').fetchall()
+            self._tokens = dict(
+                (row[0], {'access_token': row[1], 'refresh_token': row[2],
+                          'expires_at': row[3]}) for row in rows)
+            self._version = version
+
+    def load(self, user):
+        with self._lock:
+            self._reload()
+            return super(SQLiteTokenStore, self).load(user)
+
+    def save(self, user, token):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO tokens VALUES (?, ?, ?, ?)',
+                (user, token['access_token'], token.get('refresh_token'),
+                 token.get('expires_at')))
+            self._tokens[user] = dict(token)
+
+    def _take_lease(self, user, owner):
+        with self._lock:
+            now = time.time()
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute(
+                    'SELECT expires FROM locks WHERE user = ?',
+                    (user,)).fetchone()
+                if row is not None and row[0] > now:
+                    return False
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO locks VALUES (?, ?, ?)',
+                    (user, owner, now + self.lock_timeout))
+                return True
+            finally:
+                self._conn.execute('COMMIT')
+
+    @contextlib.contextmanager
+    def _acquire(self, user):
+        owner = uuid.uuid4().hex
+        while not self._take_lease(user, owner):
+            time.sleep(self.poll_interval)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._conn.execute(
+                    'DELETE FROM locks WHERE user = ? AND owner = ?',
+                    (user, owner))
+
+    def close(self):
+        self._conn.close()
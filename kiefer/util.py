@@ -1,3 +1,90 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+
+def _text_loads(data):
+    # json.loads only accepts bytes since Python 3.6
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+
+_STDLIB_LOADS = json.loads if sys.version_info >= (3, 6) or \
+    sys.version_info < (3,) else _text_loads
+_json_loads = _STDLIB_LOADS
+
+
+def set_json_backend(name='auto'):
+    """
+    Select the library used to decode API responses.
+
+    :param name: ``'json'`` (standard library, default), ``'ujson'``,
+                 ``'orjson'`` or ``'auto'`` for the fastest one installed
+    :return: name of the selected backend
+    """
+    global _json_loads
+    candidates = ['orjson', 'ujson', 'json'] if name == 'auto' else [name]
+    for candidate in candidates:
+        try:
+            module = __import__(candidate)
+        except ImportError:
+            if name != 'auto':
+                raise
+            continue
+        _json_loads = _STDLIB_LOADS if module is json else module.loads
+        return candidate
+
+
+def loads(data):
+    """
+    Decode a JSON document with the selected backend,
+    see :func:`set_json_backend`.
+
+    :param data: ``bytes`` or ``str``
+    """
+    return _json_loads(data)
+
+
+class LazyResponse(Mapping):
+    """
+    Read-only mapping around an undecoded response body.
+
+    The body is decoded on first access, callers that only pass the
+    response on can use :attr:`raw` without ever decoding it.
+
+    :param raw: ``bytes``, response body
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+        self._decoded = None
+
+    @property
+    def decoded(self):
+        """The decoded body."""
+        if self._decoded is None:
+            self._decoded = loads(self.raw)
+        return self._decoded
+
+    def __getitem__(self, key):
+        return self.decoded[key]
+
+    def __iter__(self):
+        return iter(self.decoded)
+
+    def __len__(self):
+        return len(self.decoded)
+
+
 # Expected status should be an integer, but since Jawbone messes up
 # status codes (e.g. create workout return 200 instead of 201) we need
 # a way to check for multiple status codes -.-
@@ -9,15 +96,152 @@ def validate_response(req, expected_status, exception_cls=Exception):
     :param expected_status: :class:`int` or :class:`list`
     :param exception_cls: (Custom) exception class
     """
+    return check_status(req.status_code, lambda: loads(req.content),
+                        expected_status, exception_cls)
+
+
+def check_status(status_code, get_body, expected_status,
+                 exception_cls=Exception):
+    """
+    Transport independent variant of :func:`validate_response`.
+
+    :param status_code: :class:`int`, HTTP status of the response
+    :param get_body: callable returning the decoded response body
+    :param expected_status: :class:`int` or :class:`list`
+    :param exception_cls: (Custom) exception class; the raised exception
+                          has the HTTP status as ``status_code`` attribute
+    """
     def raise_error():
-        error_type = req.json()['meta']['error_type']
-        error_detail = req.json()['meta']['error_detail']
-        raise exception_cls('{}: {}'.format(error_type, error_detail))
+        try:
+            meta = get_body()['meta']
+            message = '{}: {}'.format(meta['error_type'], meta['error_detail'])
+        except (ValueError, KeyError, TypeError):
+            # e.g. an HTML error page of a proxy
+            message = 'http_error: status {}'.format(status_code)
+        error = exception_cls(message)
+        error.status_code = status_code
+        raise error
 
     if isinstance(expected_status, int):
-        if req.status_code != expected_status:
+        if status_code != expected_status:
             raise_error()
     else:
-        if req.status_code not in expected_status:
+        if status_code not in expected_status:
             raise_error()
     return True
+
+
+def next_link(page):
+    """
+    Return the link to the next page of a list response or ``None``.
+
+    :param page: decoded list response
+    """
+    return page['data'].get('links', {}).get('next') or None
+
+
+_EXHAUSTED = object()
+
+
+def prefetch_iter(iterable):
+    """
+    Iterate over ``iterable`` while its next element is already being
+    produced in a background thread.
+
+    At most one element is computed ahead, so memory stays bounded.
+
+    :param iterable: any iterable, e.g. a generator of API pages
+    """
+    iterator = iter(iterable)
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        future = executor.submit(next, iterator, _EXHAUSTED)
+        while True:
+            value = future.result()
+            if value is _EXHAUSTED:
+                return
+            future = executor.submit(next, iterator, _EXHAUSTED)
+            yield value
+    finally:
+        executor.shutdown(wait=False)
+
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent calls with the same key.
+
+    While a call for a key is running, further calls for that key wait for
+    it and get the same result (or exception) instead of running again.
+    Completed calls are not remembered.
+
+    ::
+
+        flight = SingleFlight()
+        flight.do(key, lambda: fetch(url))
+
+    Pass an instance as ``single_flight`` to several
+    :class:`kiefer.client.KieferClient` objects to coalesce identical GET
+    requests across all of them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        """
+        Return ``func()``, or the result of the running call for ``key``.
+
+        :param key: hashable key identifying the call
+        :param func: callable without arguments
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            result = func()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def __len__(self):
+        return len(self._calls)
+
+
+def _replace(src, dst):
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+    else:
+        if os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+def atomic_write(path, data):
+    """
+    Write ``data`` to ``path`` without ever leaving a partial file behind.
+
+    :param path: ``str``, target file
+    :param data: ``str``, file content
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.kiefer-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        _replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
@@ -0,0 +1,331 @@
+"""
+Receiver for UP pub/sub notifications.
+
+Instead of polling every user for changes, register a webhook with
+:func:`KieferClient.set_webhook <kiefer.client.KieferClient.set_webhook>`.
+The UP API then posts a notification whenever a user creates, updates or
+deletes an item:
+
+::
+
+    {"notification_timestamp": "1372787949",
+     "events": [{"user_xid": "...", "event_xid": "...", "type": "move",
+                 "action": "updation", "timestamp": 1372787849,
+                 "secret_hash": "..."}]}
+
+:class:`WebhookReceiver` is a WSGI application which verifies the events and
+puts them on an :class:`EventQueue`. Events for the same item which arrive
+before the first one was handled are merged. A :class:`Dispatcher` takes
+events from the queue and fetches the changed items with the user's client:
+
+::
+
+    queue = EventQueue()
+    receiver = WebhookReceiver(client_id, client_secret, queue)
+    dispatcher = Dispatcher(clients.get, handle, queue, max_workers=8)
+    dispatcher.start()
+    wsgiref.simple_server.make_server('', 8000, receiver).serve_forever()
+
+For aiohttp applications, see :func:`kiefer.aio.create_webhook_app`.
+"""
+import hashlib
+import heapq
+import hmac
+import itertools
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+
+from kiefer.batch import fan_out
+from kiefer.client import KieferClientError
+from kiefer.ratelimit import RetryPolicy
+
+# Event types with a single-item endpoint
+EVENT_ENDPOINTS = {
+    'body': 'get_body_event',
+    'meal': 'get_meal',
+    'mood': 'get_mood',
+    'move': 'get_move',
+    'sleep': 'get_sleep',
+    'workout': 'get_workout',
+}
+
+
+def secret_hash(client_id, client_secret):
+    """Return the ``secret_hash`` the UP API adds to every event."""
+    return hashlib.sha256(
+        (client_id + client_secret).encode('utf-8')).hexdigest()
+
+
+def verify_event(event, client_id, client_secret):
+    """Return ``True`` if ``event`` was sent for the app ``client_id``."""
+    expected = secret_hash(client_id, client_secret)
+    return hmac.compare_digest(str(event.get('secret_hash', '')), expected)
+
+
+def event_key(event):
+    """Return the ``(user_xid, type, event_xid)`` tuple identifying an item."""
+    return event.get('user_xid'), event.get('type'), event.get('event_xid')
+
+
+class EventQueue(object):
+    """
+    Thread-safe FIFO queue of pending events.
+
+    An event for an item which is already queued replaces the queued event
+    in place, so each item is fetched at most once, with the latest action.
+    Events put back with :meth:`retry` are queued again after a delay.
+    """
+
+    def __init__(self):
+        self._events = OrderedDict()
+        # Heap of (due time, sequence number, event)
+        self._delayed = []
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self.received = 0
+        self.coalesced = 0
+
+    def put(self, event):
+        key = event_key(event)
+        with self._cond:
+            self.received += 1
+            if key in self._events:
+                self.coalesced += 1
+            self._events[key] = event
+            self._cond.notify()
+
+    def retry(self, event, delay):
+        """Queue ``event`` again in ``delay`` seconds."""
+        with self._cond:
+            heapq.heappush(self._delayed, (time.time() + delay,
+                                           next(self._sequence), event))
+            self._cond.notify()
+
+    def _release_due(self, now):
+        while self._delayed and self._delayed[0][0] <= now:
+            event = heapq.heappop(self._delayed)[2]
+            # A newer event for the same item replaces the retried one
+            self._events.setdefault(event_key(event), event)
+
+    def get_many(self, max_events=None, timeout=None):
+        """
+        Remove and return up to ``max_events`` events, oldest first.
+
+        Blocks up to ``timeout`` seconds (forever if ``None``) until at least
+        one event is queued and returns an empty list on timeout.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while True:
+                now = time.time()
+                self._release_due(now)
+                if self._events:
+                    break
+                if deadline is not None and deadline <= now:
+                    return []
+                # Wake up for the timeout or the next retry, whichever is first
+                wake = [t for t in (deadline, self._delayed and
+                                    self._delayed[0][0]) if t]
+                self._cond.wait(min(wake) - now if wake else None)
+            events = []
+            while self._events and (max_events is None or
+                                    len(events) < max_events):
+                events.append(self._events.popitem(last=False)[1])
+            return events
+
+    def __len__(self):
+        """Number of queued events, including those waiting for a retry."""
+        with self._cond:
+            return len(self._events) + len(self._delayed)
+
+
+class WebhookReceiver(object):
+    """
+    WSGI application receiving pub/sub notifications.
+
+    Events with a wrong ``secret_hash`` are dropped. The response is sent as
+    soon as the events are queued; they are handled by a :class:`Dispatcher`.
+
+    :param client_id: ``str``, client id of your app
+    :param client_secret: ``str``, app secret of your app
+    :param queue: :class:`EventQueue`, created if omitted
+    :param max_body: ``int``, largest accepted notification in bytes
+    """
+
+    def __init__(self, client_id, client_secret, queue=None,
+                 max_body=1024 * 1024):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.queue = queue if queue is not None else EventQueue()
+        self.max_body = max_body
+        self.rejected = 0
+
+    def handle(self, body):
+        """
+        Verify and queue the events of a notification.
+
+        Transport independent, used by the WSGI and the aiohttp application.
+
+        :param body: ``bytes``, request body
+        :return: ``(status, message)`` tuple
+        """
+        try:
+            events = json.loads(body.decode('utf-8'))['events']
+        except (ValueError, KeyError, TypeError):
+            return 400, 'Invalid notification'
+        if not isinstance(events, list):
+            return 400, 'Invalid notification'
+        accepted = 0
+        for event in events:
+            if isinstance(event, dict) and \
+                    verify_event(event, self.client_id, self.client_secret):
+                self.queue.put(event)
+                accepted += 1
+            else:
+                self.rejected += 1
+        if events and not accepted:
+            return 403, 'Invalid secret_hash'
+        return 200, 'OK'
+
+    def __call__(self, environ, start_response):
+        if environ['REQUEST_METHOD'] != 'POST':
+            status, message = 405, 'Method not allowed'
+        else:
+            try:
+                length = int(environ.get('CONTENT_LENGTH') or 0)
+            except ValueError:
+                length = -1
+            if length < 0 or length > self.max_body:
+                status, message = 413, 'Invalid content length'
+            else:
+                status, message = self.handle(environ['wsgi.input'].read(length))
+        body = message.encode('utf-8')
+        start_response('{} {}'.format(status, message),
+                       [('Content-Type', 'text/plain'),
+                        ('Content-Length', str(len(body)))])
+        return [body]
+
+
+class Dispatcher(object):
+    """
+    Fetches the items of queued events and passes them to ``handler``.
+
+    ``handler(event, item)`` is called for every event; ``item`` is the
+    response of the single-item endpoint, e.g.
+    :func:`KieferClient.get_move <kiefer.client.KieferClient.get_move>`, or
+    ``None`` for deletions and event types without such an endpoint.
+
+    Events are delivered at least once: if the fetch or the handler fails
+    with a transient error (connection errors, timeouts, 429 and 5xx
+    responses), the event is put back on the queue with exponential
+    backoff. Events failing with other errors, e.g. a 404 response or a bug
+    in the handler, or more than ``max_retries`` times are dropped; they
+    are still returned by :meth:`dispatch` and passed to the
+    ``error_handler`` of :meth:`start`.
+
+    :param get_client: callable returning the client of a ``user_xid``,
+                       e.g. ``clients.get``
+    :param handler: callable receiving ``(event, item)``
+    :param queue: :class:`EventQueue`, e.g. the queue of a
+                  :class:`WebhookReceiver`
+    :param max_workers: ``int``, number of concurrent fetches
+    :param batch_size: ``int``, maximum number of events taken from the
+                       queue at once
+    :param max_retries: ``int``, retries per event, ``None`` retries until
+                        the event succeeds
+    :param retry: :class:`kiefer.ratelimit.RetryPolicy` computing the backoff
+    """
+
+    def __init__(self, get_client, handler, queue, max_workers=8,
+                 batch_size=100, max_retries=5, retry=None):
+        self.get_client = get_client
+        self.handler = handler
+        self.queue = queue
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry = retry or RetryPolicy(max_backoff=300)
+        self._attempts = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _handle(self, event):
+        item = None
+        method = EVENT_ENDPOINTS.get(event.get('type'))
+        if method is not None and event.get('action') != 'deletion':
+            client = self.get_client(event.get('user_xid'))
+            if client is None:
+                raise KieferClientError(
+                    "No client for user '{}'.".format(event.get('user_xid')))
+            item = getattr(client, method)(event['event_xid'])
+        self.handler(event, item)
+        return item
+
+    @staticmethod
+    def _is_transient(error):
+        if isinstance(error, requests.RequestException):
+            return True
+        status_code = getattr(error, 'status_code', None)
+        return status_code is not None and (status_code == 429 or
+                                            status_code >= 500)
+
+    def _settle(self, res):
+        key = event_key(res.key)
+        with self._lock:
+            if res.error is None:
+                self._attempts.pop(key, None)
+                return
+            attempt = self._attempts.get(key, 0)
+            if not self._is_transient(res.error) or (
+                    self.max_retries is not None and
+                    attempt >= self.max_retries):
+                self._attempts.pop(key, None)
+                return
+            self._attempts[key] = attempt + 1
+        self.queue.retry(res.key, self.retry.delay(attempt))
+
+    def dispatch(self, timeout=None):
+        """
+        Handle the events queued now, waiting up to ``timeout`` seconds for
+        the first one.
+
+        :return: list of :class:`kiefer.batch.BatchResult` with the event as
+                 ``key`` and the fetched item as ``result``; failed events
+                 are included and retried later if the error is transient
+        """
+        events = self.queue.get_many(self.batch_size, timeout)
+        results = list(fan_out(self._handle, events, self.max_workers))
+        for res in results:
+            self._settle(res)
+        return results
+
+    def start(self, error_handler=None):
+        """
+        Dispatch events on a background thread until :meth:`stop` is called.
+
+        :param error_handler: callable receiving every failed
+                              :class:`kiefer.batch.BatchResult`, also for
+                              events which will be retried
+        """
+        def run():
+            while not self._stopped.is_set():
+                for res in self.dispatch(timeout=0.1):
+                    if res.error is not None and error_handler is not None:
+                        error_handler(res)
+
+        self._stopped.clear()
+        self._thread = threading.Thread(target=run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread after the current batch."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
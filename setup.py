@@ -1,7 +1,10 @@
+import sys
 from setuptools import setup
 
 
 requirements = ['requests-oauthlib==0.5.0', ]
+if sys.version_info.major == 2:
+    requirements.append('futures')
 
 long_description = open('README.rst').read()
 
@@ -15,5 +18,7 @@ setup(
     license='MIT',
     url='https://github.com/andygoldschmidt/kiefer',
     packages=['kiefer', ],
-    install_requires=requirements
+    install_requires=requirements,
+    extras_require={'aio': ['aiohttp'], 'parquet': ['pyarrow']},
+    entry_points={'console_scripts': ['kiefer = kiefer.cli:main']},
 )
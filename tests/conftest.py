@@ -0,0 +1,6 @@
+import sys
+
+collect_ignore = []
+if sys.version_info < (3, 6):
+    # asyncio support uses async generators
+    collect_ignore.append('test_aio.py')
@@ -0,0 +1,230 @@
+import asyncio
+import json
+from urllib.parse import urlsplit
+
+import pytest
+
+pytest.importorskip('aiohttp')
+
+from kiefer.aio import AsyncKieferClient
+from kiefer.client import KieferClientError
+
+
+class FakeResponse(object):
+    def __init__(self, status, body):
+        self.status = status
+        self.body = body
+
+    async def read(self):
+        return json.dumps(self.body).encode('utf-8')
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+class FakeSession(object):
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        self.calls.append((method, url, kwargs))
+        return self.responses.pop(0)
+
+
+def _run(coro):
+    return asyncio.new_event_loop().run_until_complete(coro)
+
+
+def test_aio_get_endpoint():
+    session = FakeSession(FakeResponse(200, {'data': {'xid': 'abc'}}))
+    client = AsyncKieferClient('access_token', session=session)
+    assert _run(client.get_move('abc')) == {'data': {'xid': 'abc'}}
+    method, url, kwargs = session.calls[0]
+    assert method == 'GET'
+    assert url == 'https://jawbone.com/nudge/api/v.1.1/moves/abc'
+    assert kwargs['headers'] == {'Authorization': 'Bearer access_token'}
+
+
+def test_aio_post_encodes_payload():
+    session = FakeSession(FakeResponse(201, {'data': {}}))
+    client = AsyncKieferClient('access_token', session=session)
+    _run(client.add_body_event(weight=85.0, share=True))
+    method, url, kwargs = session.calls[0]
+    assert method == 'POST'
+    assert kwargs['data'] == {'weight': '85.0', 'share': 'True'}
+
+
+def test_aio_error_status():
+    error = {'meta': {'error_type': 'CustomError',
+                      'error_detail': 'custom error detail'}}
+    session = FakeSession(FakeResponse(404, error))
+    client = AsyncKieferClient('access_token', session=session)
+    with pytest.raises(KieferClientError):
+        _run(client.delete_sleep('abc'))
+
+
+def test_aio_hooks():
+    events = []
+    session = FakeSession(FakeResponse(404, {'meta': {
+        'error_type': 'not_found', 'error_detail': 'unknown sleep'}}))
+    client = AsyncKieferClient('access_token', session=session,
+                               hooks=[events.append])
+    with pytest.raises(KieferClientError):
+        _run(client.delete_sleep('abc'))
+    assert [(e.method, e.endpoint, e.status, e.retries) for e in events] == \
+        [('DELETE', 'sleeps/{xid}', 404, 0)]
+
+
+def test_aio_hooks_failed_requests():
+    from kiefer.client import CircuitOpenError
+    from kiefer.ratelimit import CircuitBreaker
+
+    class FailingResponse(FakeResponse):
+        async def __aenter__(self):
+            raise asyncio.TimeoutError()
+
+    class SlowResponse(FakeResponse):
+        async def __aenter__(self):
+            await asyncio.sleep(10)
+
+    events = []
+    session = FakeSession(SlowResponse(200, {}), FailingResponse(200, {}),
+                          FailingResponse(200, {}))
+    client = AsyncKieferClient('access_token', session=session,
+                               circuit_breaker=CircuitBreaker(
+                                   failure_threshold=2, reset_timeout=60),
+                               hooks=[events.append])
+
+    async def main():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(client.get_goals(), 0.05)
+        with pytest.raises(asyncio.TimeoutError):
+            await client.get_goals()
+        with pytest.raises(asyncio.TimeoutError):
+            [tick async for tick in client.stream_move_ticks('a')]
+        with pytest.raises(CircuitOpenError):
+            await client.get_goals()
+
+    _run(main())
+    assert [(e.endpoint, e.status, e.error) for e in events] == [
+        ('users/@me/goals', 0, 'CancelledError'),
+        ('users/@me/goals', 0, 'TimeoutError'),
+        ('moves/{xid}/ticks', 0, 'TimeoutError'),
+        ('users/@me/goals', 0, 'CircuitOpenError')]
+
+
+@pytest.mark.parametrize('prefetch', [False, True])
+def test_aio_iter_items(prefetch):
+    session = FakeSession(
+        FakeResponse(200, {'data': {'items': [{'xid': 'a'}],
+                                    'links': {'next': '/nudge/api/v.1.1/x'}}}),
+        FakeResponse(200, {'data': {'items': [{'xid': 'b'}], 'links': {}}}))
+    client = AsyncKieferClient('access_token', session=session)
+
+    async def collect():
+        return [item['xid'] async for item in client.iter_moves(prefetch=prefetch)]
+
+    assert _run(collect()) == ['a', 'b']
+    assert session.calls[1][1] == 'https://jawbone.com/nudge/api/v.1.1/x'
+
+
+def test_aio_get_many():
+    session = FakeSession(FakeResponse(200, {'data': 1}),
+                          FakeResponse(404, {'meta': {'error_type': 'E',
+                                                      'error_detail': 'd'}}))
+    client = AsyncKieferClient('access_token', session=session)
+
+    async def collect():
+        return [res async for res in client.get_many('sleep_phases', ['a', 'b'])]
+
+    results = _run(collect())
+    assert sorted(res.error is None for res in results) == [False, True]
+
+
+def test_aio_graph(tmpdir):
+    class ImageResponse(FakeResponse):
+        async def read(self):
+            return self.body
+
+    session = FakeSession(ImageResponse(200, b'\x89PNG'),
+                          ImageResponse(200, b'\x89PNG'))
+    client = AsyncKieferClient('access_token', session=session)
+    assert _run(client.get_move_graph('a')).tobytes() == b'\x89PNG'
+    path = str(tmpdir.join('b.png'))
+    assert _run(client.get_sleep_graph('b', path)) == 4
+    assert tmpdir.join('b.png').read_binary() == b'\x89PNG'
+
+
+def test_aio_single_flight():
+    from kiefer.aio import AsyncSingleFlight
+    session = FakeSession(FakeResponse(200, {'data': {'xid': 'user'}}))
+    flight = AsyncSingleFlight()
+    clients = [AsyncKieferClient('access_token', session=session,
+                                 single_flight=flight) for _ in range(3)]
+
+    async def main():
+        return await asyncio.gather(*[c.get_user_information()
+                                      for c in clients])
+
+    results = _run(main())
+    assert len(session.calls) == 1 and len(flight) == 0
+    assert all(r == {'data': {'xid': 'user'}} for r in results)
+
+
+def test_aio_webhook_app():
+    from aiohttp.test_utils import TestClient, TestServer
+    from kiefer.aio import create_webhook_app
+    from kiefer.webhook import WebhookReceiver, secret_hash
+
+    receiver = WebhookReceiver('client_id', 'secret')
+    event = {'user_xid': 'user', 'event_xid': 'a', 'type': 'move',
+             'action': 'creation', 'secret_hash': secret_hash('client_id',
+                                                              'secret')}
+
+    async def main():
+        async with TestClient(TestServer(
+                create_webhook_app(receiver, '/hook'))) as http:
+            ok = await http.post('/hook', data=json.dumps({'events': [event]}))
+            bad = await http.post('/hook', data=b'{}')
+            return ok.status, bad.status
+
+    assert _run(main()) == (200, 400)
+    assert len(receiver.queue) == 1
+
+
+def test_aio_circuit_trial_recorded_for_streams_and_cancellation(mocker):
+    from kiefer.ratelimit import CircuitBreaker
+
+    class Content(object):
+        async def iter_chunked(self, size):
+            yield b'{"data": {"items": [{"time": 1}]}}'
+
+    class StreamResponse(FakeResponse):
+        content = Content()
+
+    class SlowResponse(FakeResponse):
+        async def __aenter__(self):
+            await asyncio.sleep(10)
+
+    now = mocker.patch('kiefer.ratelimit._clock', return_value=100.0)
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    session = FakeSession(SlowResponse(200, {}), StreamResponse(200, {}),
+                          FakeResponse(200, {'data': 1}))
+    client = AsyncKieferClient('access_token', session=session,
+                               circuit_breaker=breaker)
+    breaker.record(urlsplit(client.BASE_URL).netloc, False)
+    now.return_value = 111.0
+
+    async def main():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(client.get_goals(), 0.05)
+        # The cancelled trial was released, the stream is the next trial
+        ticks = [tick async for tick in client.stream_move_ticks('a')]
+        return ticks, await client.get_goals()
+
+    assert _run(main()) == ([{'time': 1}], {'data': 1})
+    assert not breaker.is_open(urlsplit(client.BASE_URL).netloc)
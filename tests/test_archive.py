@@ -0,0 +1,46 @@
+from kiefer.archive import ResponseArchive
+from kiefer.mockserver import MockUPServer
+
+
+def test_archive_put_get(tmpdir):
+    archive = ResponseArchive(str(tmpdir), codec='zlib')
+    assert archive.get('moves/a/ticks') is None
+    archive.put('moves/a/ticks', b'{"data": 1}' * 100)
+    archive.put('moves/b/ticks', b'{"data": 2}')
+    assert archive.get('moves/a/ticks') == b'{"data": 1}' * 100
+    assert tmpdir.join('segments.dat').size() < 1100
+    archive.put('moves/b/ticks', b'{"data": 3}')
+    assert archive.get('moves/b/ticks') == b'{"data": 3}'
+    archive.close()
+
+    # A partially written index entry is ignored
+    with open(str(tmpdir.join('index.jsonl')), 'a') as f:
+        f.write('["moves/c/ticks", 1')
+    reopened = ResponseArchive(str(tmpdir), codec=None)
+    assert len(reopened) == 2 and 'moves/c/ticks' not in reopened
+    assert reopened.get('moves/a/ticks') == b'{"data": 1}' * 100
+
+
+def test_archive_picks_up_other_writers(tmpdir):
+    reader = ResponseArchive(str(tmpdir))
+    writer = ResponseArchive(str(tmpdir))
+    writer.put('sleeps/a/ticks', b'phases')
+    assert reader.get('sleeps/a/ticks') == b'phases'
+
+
+def test_archive_client(tmpdir):
+    settled = ResponseArchive(str(tmpdir.join('settled')), settle_time=0)
+    recent = ResponseArchive(str(tmpdir.join('recent')), settle_time=1e10)
+    with MockUPServer(tick_count=60) as server:
+        client = server.client('token', archive=settled)
+        ticks = client.get_sleep_phases('sleeps-1')
+        assert client.get_sleep_phases('sleeps-1') == ticks
+        assert client.get_sleep_phases('sleeps-1', columnar=True)['time'][0] \
+            == ticks['data']['items'][0]['time']
+        assert server.request_count == 1
+        assert 'sleeps/sleeps-1/ticks' in settled
+
+        client = server.client('token', archive=recent)
+        client.get_move_ticks('moves-1')
+        client.get_move_ticks('moves-1')
+        assert server.request_count == 3 and len(recent) == 0
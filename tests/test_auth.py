@@ -1,6 +1,9 @@
 import os
+import threading
+import time
 import pytest
-from kiefer.auth import KieferAuth
+from kiefer.auth import KieferAuth, TokenProvider
+from kiefer.mockserver import MockUPServer
 
 
 def test_auth_init_env_vars_set():
@@ -42,3 +45,48 @@ def test_auth_set_refresh_token():
     auth = KieferAuth('tests/testconfig.json')
     auth.set_refresh_token('abc')
     assert auth.refresh_token == 'abc'
+
+
+@pytest.fixture
+def provider(mocker):
+    auth = KieferAuth('tests/testconfig.json')
+    auth.set_access_token('old')
+    auth.set_refresh_token('refresh')
+    tokens = iter(['new', 'newer'])
+
+    def refresh():
+        time.sleep(0.05)
+        auth._set_token({'access_token': next(tokens),
+                         'refresh_token': 'refresh', 'expires_in': 3600})
+        return auth.access_token, auth.refresh_token
+
+    mocker.patch.object(auth, 'refresh_access_token', side_effect=refresh)
+    return TokenProvider(auth, refresh_margin=60)
+
+
+def test_auth_token_provider_single_flight(provider):
+    threads = [threading.Thread(target=provider.refresh, args=('old',))
+               for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert provider.auth.refresh_access_token.call_count == 1
+    assert provider.get_token() == 'new'
+    assert provider.key == 'old'
+
+
+def test_auth_token_provider_refreshes_before_expiry(provider):
+    provider.auth.expires_at = time.time() + 30
+    assert provider.expires_soon()
+    assert provider.get_token() == 'new'
+    assert not provider.expires_soon()
+
+
+def test_auth_client_refreshes_on_401(provider):
+    with MockUPServer() as server:
+        server.expire_token('old')
+        client = server.client(provider)
+        assert client.get_goals()['data']['move_steps'] == 10000
+        assert client.access_token == 'new'
+        assert provider.auth.refresh_access_token.call_count == 1
@@ -0,0 +1,42 @@
+from kiefer.backfill import WindowSizer, backfill
+from kiefer.mockserver import MockUPServer
+
+HOUR = 3600
+
+
+def test_backfill_window_sizer():
+    sizer = WindowSizer(initial=100, target_items=10, min_window=50,
+                        max_window=1000)
+    sizer.observe(100, 20)
+    assert sizer.size == 50
+    sizer.observe(100, 5)
+    assert sizer.size == 200
+    sizer.observe(800, 0)
+    assert sizer.size == 1000
+
+
+def test_backfill_time_ordered_without_duplicates():
+    with MockUPServer(items=200, page_size=10, seed=1) as server:
+        client = server.client('token')
+        now = server.now
+        sizer = WindowSizer(initial=20 * HOUR, target_items=10,
+                            min_window=HOUR, max_window=100 * HOUR)
+        items = list(backfill(client, 'moves', now - 199 * HOUR, now,
+                              max_workers=4, sizer=sizer, limit=10))
+    xids = [item['xid'] for item in items]
+    assert len(xids) == len(set(xids)) == 200
+    times = [item['time_created'] for item in items]
+    assert times == sorted(times)
+    # Windows shrink towards one page of 10 hourly items; the last window is
+    # cut at end_time and may finish last, so the final size varies
+    assert HOUR <= sizer.size < 20 * HOUR
+
+
+def test_backfill_early_exit():
+    with MockUPServer(items=50, seed=1) as server:
+        client = server.client('token')
+        gen = backfill(client, 'sleeps', server.now - 49 * HOUR, server.now,
+                       max_workers=2)
+        first = next(gen)
+        gen.close()
+    assert first['xid'] == 'sleeps-49'
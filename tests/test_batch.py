@@ -0,0 +1,133 @@
+import time
+
+import pytest
+import requests
+from kiefer.batch import WriteQueue, fan_out, get_many_users
+from kiefer.client import KieferClient, KieferClientError
+
+
+def test_batch_fan_out_collects_errors():
+    def func(key):
+        if key == 3:
+            raise ValueError('boom')
+        return key * 2
+
+    results = {res.key: res for res in fan_out(func, range(10), max_workers=2)}
+    assert sorted(results) == list(range(10))
+    assert results[4].result == 8 and results[4].error is None
+    assert isinstance(results[3].error, ValueError)
+    assert results[3].result is None
+
+
+def test_batch_client_get_many(mocker):
+    ticks = mocker.patch.object(KieferClient, 'get_move_ticks',
+                                side_effect=lambda xid: {'xid': xid})
+    client = KieferClient('access_token')
+    results = list(client.get_many('move_ticks', ['a', 'b', 'c']))
+    assert sorted(res.result['xid'] for res in results) == ['a', 'b', 'c']
+    assert ticks.call_count == 3
+
+
+def test_batch_client_get_many_unknown_endpoint():
+    client = KieferClient('access_token')
+    with pytest.raises(KieferClientError):
+        client.get_many('foo', ['a'])
+
+
+def test_batch_get_many_users(mocker):
+    tokens = []
+
+    def get_moves(self, **kwargs):
+        tokens.append(self.access_token)
+        return kwargs
+
+    mocker.patch.object(KieferClient, 'get_moves', get_moves)
+    results = list(get_many_users(['t1', 't2'], 'moves', date=20150601))
+    assert sorted(tokens) == ['t1', 't2']
+    assert all(res.result == {'date': 20150601} for res in results)
+
+
+def test_batch_write_queue_orders_per_token(mocker):
+    mocker.patch('time.sleep')
+    calls = []
+    failures = {'n': 0}
+
+    def add_meal(self, **kwargs):
+        calls.append((self.access_token, kwargs['note']))
+        if kwargs['note'] == 'flaky' and failures['n'] < 2:
+            failures['n'] += 1
+            raise requests.ConnectionError('reset')
+        if kwargs['note'] == 'bad':
+            raise KieferClientError('bad request')
+        return kwargs['note']
+
+    mocker.patch.object(KieferClient, 'add_meal', add_meal)
+    c1, c2 = KieferClient('t1'), KieferClient('t2')
+    queue = WriteQueue(max_workers=4, max_retries=3)
+    queue.add(c1, 'add_meal', note='a')
+    queue.add(c2, 'add_meal', note='bad')
+    queue.add(c1, 'add_meal', note='flaky')
+    queue.add(c1, 'add_meal', note='b')
+    report = queue.run()
+
+    assert [res.index for res in report] == [0, 1, 2, 3]
+    assert [res.result for res in report] == ['a', None, 'flaky', 'b']
+    assert isinstance(report[1].error, KieferClientError)
+    assert report[1].attempts == 1
+    assert report[2].attempts == 3
+    assert [note for token, note in calls if token == 't1'] == \
+        ['a', 'flaky', 'flaky', 'flaky', 'b']
+    assert len(queue) == 0
+
+
+def test_batch_write_queue_retries_only_safe_errors(mocker):
+    def error(status):
+        e = KieferClientError('error')
+        e.status_code = status
+        return e
+
+    errors = {'throttled': [error(429)], 'server': [error(503)],
+              'read': [requests.ReadTimeout('read')],
+              'connect': [requests.ConnectTimeout('connect')]}
+    calls = []
+
+    def send(note):
+        calls.append(note)
+        if errors[note]:
+            raise errors[note].pop()
+        return note
+
+    mocker.patch.object(KieferClient, 'add_meal',
+                        lambda self, note: send(note))
+    mocker.patch.object(KieferClient, 'delete_meal',
+                        lambda self, note: send(note))
+    mocker.patch('time.sleep')
+    client = KieferClient('t')
+    queue = WriteQueue()
+    for note in ('throttled', 'server', 'read', 'connect'):
+        queue.add(client, 'add_meal', note)
+    report = queue.run()
+    assert [res.attempts for res in report] == [2, 1, 1, 2]
+    assert [res.error is None for res in report] == [True, False, False, True]
+
+    errors.update(server=[error(503)], read=[requests.ReadTimeout('read')])
+    queue.add(client, 'delete_meal', 'server')
+    queue.add(client, 'delete_meal', 'read')
+    assert [res.attempts for res in queue.run()] == [2, 2]
+
+
+def test_batch_write_queue_read_timeout_creates_once():
+    from kiefer.mockserver import MockUPServer
+    with MockUPServer(latency=0.3) as server:
+        client = server.client('token', timeout=(1, 0.1))
+        queue = WriteQueue(max_retries=3)
+        queue.add(client, 'add_meal', note='once')
+        res, = queue.run()
+        assert isinstance(res.error, requests.Timeout) and res.attempts == 1
+        time.sleep(0.4)
+        assert server.request_count == 1
+
+
+def test_batch_write_queue_rejects_reads():
+    with pytest.raises(ValueError):
+        WriteQueue().add(KieferClient('t'), 'get_moves')
@@ -0,0 +1,80 @@
+import time
+import requests
+import pytest
+from kiefer.cache import (CacheEntry, MemoryCache, SQLiteCache, cache_key,
+                          cache_tag, resource_name)
+from kiefer.client import KieferClient
+
+
+@pytest.fixture
+def setup(mocker):
+    class Setup:
+        resp = mocker.patch.object(requests.Response, '__init__')
+        resp.status_code = 200
+        resp.headers = {'ETag': '"v1"'}
+        resp.content = b'{"data": {"xid": "abc"}}'
+        req_get = mocker.patch('requests.Session.get', return_value=resp)
+        req_post = mocker.patch('requests.Session.post', return_value=resp)
+        cache = MemoryCache(ttl=60)
+        client = KieferClient('access_token', cache=cache)
+    return Setup
+
+
+def test_cache_resource_name():
+    assert resource_name('users/@me/meals') == 'meals'
+    assert resource_name('/meals/abc/partialUpdate') == 'meals'
+    assert resource_name('users/@me') == 'users'
+    assert resource_name('users/@me/mood?page_token=1') == 'mood'
+
+
+def test_cache_memory_lru_eviction():
+    cache = MemoryCache(maxsize=2)
+    for key in ('a', 'b', 'c'):
+        cache.set(key, 'tag', CacheEntry(key, time.time() + 60))
+    assert cache.get('a') is None
+    assert cache.get('c').body == 'c'
+    assert len(cache) == 2
+    cache.invalidate('tag')
+    assert len(cache) == 0
+
+
+def test_cache_sqlite_roundtrip(tmpdir):
+    cache = SQLiteCache(str(tmpdir.join('cache.db')))
+    cache.set('key', 'tag', CacheEntry({'a': 1}, time.time() + 60, '"v1"'))
+    entry = cache.get('key')
+    assert entry.body == {'a': 1} and entry.etag == '"v1"'
+    cache.invalidate('tag')
+    assert cache.get('key') is None
+
+
+def test_cache_client_serves_fresh_entries(setup):
+    assert setup.client.get_settings() == {'data': {'xid': 'abc'}}
+    assert setup.client.get_settings() == {'data': {'xid': 'abc'}}
+    assert setup.req_get.call_count == 1
+
+
+def test_cache_client_hits_are_copies(setup):
+    setup.client.get_settings()['data']['xid'] = 'changed'
+    setup.client.get_settings()['data']['xid'] = 'changed'
+    assert setup.client.get_settings() == {'data': {'xid': 'abc'}}
+    assert setup.req_get.call_count == 1
+
+
+def test_cache_client_revalidates_stale_entries(setup):
+    setup.cache.ttl = 0
+    setup.client.get_move('abc')
+    setup.resp.status_code = 304
+    setup.resp.content = b''
+    assert setup.client.get_move('abc') == {'data': {'xid': 'abc'}}
+    headers = setup.req_get.call_args[1]['headers']
+    assert headers['If-None-Match'] == '"v1"'
+
+
+def test_cache_client_writes_invalidate(setup):
+    setup.client.get_meals(limit=5)
+    key = cache_key('access_token', KieferClient.BASE_URL + 'users/@me/meals',
+                    {'limit': 5})
+    assert setup.cache.get(key) is not None
+    setup.client.update_meal('abc', note='fish')
+    assert setup.cache.get(key) is None
+    assert cache_tag('other_token', 'meals') != cache_tag('access_token', 'meals')
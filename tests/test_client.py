@@ -1,6 +1,7 @@
+import json
 import requests
 import pytest
-from kiefer.client import KieferClient, KieferClientError
+from kiefer.client import KieferClient, KieferClientError, create_session
 
 
 @pytest.fixture
@@ -8,15 +9,16 @@ def setup(mocker):
     class Setup:
         resp = mocker.patch.object(requests.Response, '__init__')
         resp.status_code = 200
-        resp.json = lambda: {'meta': {'error_type': 'CustomError',
-                                      'error_detail': 'custom error detail'}}
-        req_get = mocker.patch('requests.get')
+        resp.content = json.dumps(
+            {'meta': {'error_type': 'CustomError',
+                      'error_detail': 'custom error detail'}}).encode('utf-8')
+        req_get = mocker.patch('requests.Session.get')
         req_get.return_value = resp
 
-        req_post = mocker.patch('requests.post')
+        req_post = mocker.patch('requests.Session.post')
         req_post.return_value = resp
 
-        req_delete = mocker.patch('requests.delete')
+        req_delete = mocker.patch('requests.Session.delete')
         req_delete.return_value = resp
 
         client = KieferClient('access_token')
@@ -28,13 +30,37 @@ def test_client_client_init():
     client = KieferClient('access_token')
     assert client.access_token == 'access_token'
     assert client._headers['Authorization'] == 'Bearer access_token'
+    assert isinstance(client.session, requests.Session)
+
+
+def test_client_shared_session():
+    session = create_session(pool_maxsize=20)
+    client_a = KieferClient('token_a', session=session)
+    client_b = KieferClient('token_b', session=session)
+    assert client_a.session is client_b.session is session
+    assert session.get_adapter(KieferClient.BASE_URL)._pool_maxsize == 20
+    assert session.headers['Connection'] == 'keep-alive'
+
+
+def test_client_close_keeps_shared_session(mocker):
+    session = create_session()
+    close_mock = mocker.patch.object(session, 'close')
+    with KieferClient('access_token', session=session):
+        pass
+    assert close_mock.call_count == 0
+
+    client = KieferClient('access_token')
+    own_close_mock = mocker.patch.object(client.session, 'close')
+    client.close()
+    assert own_close_mock.call_count == 1
 
 
 def test_client_get_helper(setup):
     req_url = 'https://jawbone.com/nudge/api/v.1.1/myurl'
     setup.client._get('myurl')
     setup.req_get.assert_called_once_with(req_url, params=None,
-                                          headers=setup.headers)
+                                          headers=setup.headers,
+                                          timeout=KieferClient.DEFAULT_TIMEOUT)
 
     setup.resp.status_code = 404
     with pytest.raises(KieferClientError):
@@ -45,7 +71,8 @@ def test_client_post_helper(setup):
     req_url = 'https://jawbone.com/nudge/api/v.1.1/myurl'
     setup.client._post('myurl', payload={})
     setup.req_post.assert_called_once_with(req_url, data={},
-                                           headers=setup.headers)
+                                           headers=setup.headers,
+                                           timeout=KieferClient.DEFAULT_TIMEOUT)
 
     setup.resp.status_code = 404
     with pytest.raises(KieferClientError):
@@ -55,7 +82,8 @@ def test_client_post_helper(setup):
 def test_client_delete_helper(setup):
     req_url = 'https://jawbone.com/nudge/api/v.1.1/myurl'
     setup.client._delete('myurl')
-    setup.req_delete.assert_called_once_with(req_url, headers=setup.headers)
+    setup.req_delete.assert_called_once_with(req_url, headers=setup.headers,
+                                             timeout=KieferClient.DEFAULT_TIMEOUT)
 
     setup.resp.status_code = 404
     with pytest.raises(KieferClientError):
@@ -66,11 +94,58 @@ def test_client_get_band_events(setup):
     url = 'https://jawbone.com/nudge/api/v.1.1/users/@me/bandevents'
     setup.client.get_band_events()
     setup.req_get.assert_called_once_with(url, params=None,
-                                          headers=setup.headers)
+                                          headers=setup.headers,
+                                          timeout=KieferClient.DEFAULT_TIMEOUT)
 
 
 def test_client_get_body_events(setup):
     url = 'https://jawbone.com/nudge/api/v.1.1/users/@me/body_events'
     setup.client.get_body_events()
     setup.req_get.assert_called_once_with(url, params={},
-                                          headers=setup.headers)
+                                          headers=setup.headers,
+                                          timeout=KieferClient.DEFAULT_TIMEOUT)
+
+
+def test_client_webhook(setup):
+    url = 'https://jawbone.com/nudge/api/v.1.1/users/@me/pubsub'
+    setup.client.set_webhook('https://example.com/hook')
+    setup.req_post.assert_called_once_with(
+        url, data={'webhook': 'https://example.com/hook'},
+        headers=setup.headers, timeout=KieferClient.DEFAULT_TIMEOUT)
+    setup.client.delete_webhook()
+    setup.req_delete.assert_called_once_with(
+        url, headers=setup.headers, timeout=KieferClient.DEFAULT_TIMEOUT)
+
+
+def _page(items, next_link=None):
+    links = {'next': next_link} if next_link else {}
+    return {'meta': {'code': 200},
+            'data': {'items': items, 'links': links, 'size': len(items)}}
+
+
+@pytest.mark.parametrize('prefetch', [False, True])
+def test_client_iter_moves_follows_next_links(setup, mocker, prefetch):
+    pages = [_page([{'xid': 'a'}, {'xid': 'b'}],
+                   '/nudge/api/v.1.1/users/@me/moves?page_token=1'),
+             _page([{'xid': 'c'}])]
+    type(setup.resp).content = mocker.PropertyMock(
+        side_effect=lambda: json.dumps(pages.pop(0)).encode('utf-8'))
+    items = setup.client.iter_moves(prefetch=prefetch, limit=2)
+    assert [item['xid'] for item in items] == ['a', 'b', 'c']
+    setup.req_get.assert_any_call(
+        'https://jawbone.com/nudge/api/v.1.1/users/@me/moves',
+        params={'limit': 2}, headers=setup.headers,
+        timeout=KieferClient.DEFAULT_TIMEOUT)
+    setup.req_get.assert_called_with(
+        'https://jawbone.com/nudge/api/v.1.1/users/@me/moves?page_token=1',
+        params=None, headers=setup.headers,
+        timeout=KieferClient.DEFAULT_TIMEOUT)
+
+
+def test_client_iter_is_lazy(setup):
+    setup.resp.content = json.dumps(
+        _page([{'xid': 'a'}], '/nudge/api/v.1.1/next')).encode('utf-8')
+    items = setup.client.iter_sleeps()
+    assert setup.req_get.call_count == 0
+    assert next(items)['xid'] == 'a'
+    assert setup.req_get.call_count == 1
@@ -0,0 +1,150 @@
+import csv
+import json
+import os
+
+import pytest
+from kiefer.cli import main
+from kiefer.export import Exporter, ParquetWriter, flatten
+from kiefer.mockserver import MockUPServer
+from kiefer.sync import JSONFileStateStore
+
+
+@pytest.yield_fixture
+def server():
+    with MockUPServer(items=25, page_size=10, tick_count=3, seed=1) as server:
+        yield server
+
+
+def read_jsonl(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_export_flatten():
+    assert flatten({'xid': 'a', 'details': {'steps': 5, 'tz': {'name': 'x'}},
+                    'tzs': [[1, 'UTC']]}) == {
+        'xid': 'a', 'details.steps': 5, 'details.tz.name': 'x',
+        'tzs': '[[1, "UTC"]]'}
+    assert flatten({'details': {'hourly_totals': {'2015060100': {'steps': 1}}}}) \
+        == {'details.hourly_totals': '{"2015060100": {"steps": 1}}'}
+
+
+def test_export_jsonl(server, tmpdir):
+    exporter = Exporter(str(tmpdir), resources=['moves', 'move_ticks'])
+    results = list(exporter.export_users({'alice': server.client('t1'),
+                                          'bob': server.client('t2')}))
+    assert sorted(res.key for res in results) == ['alice', 'bob']
+    assert all(res.result == {'moves': 25, 'move_ticks': 75} for res in results)
+
+    moves = read_jsonl(str(tmpdir.join('alice', 'moves.jsonl')))
+    assert [m['xid'] for m in moves] == ['moves-{}'.format(i) for i in range(25)]
+    assert 'details.steps' in moves[0]
+    ticks = read_jsonl(str(tmpdir.join('alice', 'move_ticks.jsonl')))
+    assert ticks[0]['xid'] == 'moves-0' and 'time' in ticks[0]
+
+    # Finished exports are not repeated
+    assert exporter.export_user('alice', server.client('t1')) == \
+        {'moves': 0, 'move_ticks': 0}
+
+
+@pytest.mark.parametrize('fmt', ['csv', 'parquet'])
+def test_export_resume(server, tmpdir, mocker, fmt):
+    if fmt == 'parquet':
+        pq = pytest.importorskip('pyarrow.parquet')
+        mocker.patch.object(ParquetWriter, 'row_group_size', 10)
+    state = JSONFileStateStore(str(tmpdir.join('state.json')))
+    exporter = Exporter(str(tmpdir), fmt=fmt, resources=['sleeps'],
+                        state_store=state, page_limit=10)
+    client = server.client('t1')
+    get_url = client._get_url
+    calls = []
+
+    def flaky_get_url(url, *args):
+        calls.append(url)
+        if len(calls) == 2:
+            raise IOError('connection lost')
+        return get_url(url, *args)
+
+    mocker.patch.object(client, '_get_url', flaky_get_url)
+    with pytest.raises(IOError):
+        exporter.export_user('alice', client)
+    assert state.get('alice', 'export:sleeps')['next'] is not None
+
+    state = JSONFileStateStore(str(tmpdir.join('state.json')))
+    exporter = Exporter(str(tmpdir), fmt=fmt, resources=['sleeps'],
+                        state_store=state, page_limit=10)
+    assert exporter.export_user('alice', client) == {'sleeps': 15}
+    path = str(tmpdir.join('alice', 'sleeps.' + fmt))
+    if fmt == 'csv':
+        with open(path) as f:
+            rows = list(csv.DictReader(f))
+    else:
+        rows = pq.read_table(path).to_pylist()
+    assert [row['xid'] for row in rows] == ['sleeps-{}'.format(i) for i in range(25)]
+
+
+def test_export_parquet(server, tmpdir):
+    pq = pytest.importorskip('pyarrow.parquet')
+    exporter = Exporter(str(tmpdir), fmt='parquet', resources=['workouts'])
+    exporter.export_user('alice', server.client('t1'))
+    table = pq.read_table(str(tmpdir.join('alice', 'workouts.parquet')))
+    assert table.num_rows == 25
+
+
+def test_export_cli(server, tmpdir, capsys):
+    tokens = tmpdir.join('tokens.json')
+    tokens.write(json.dumps({'alice': 't1'}))
+    output = str(tmpdir.join('out'))
+    assert main(['export', '--tokens', str(tokens), '--output', output,
+                 '--resources', 'moods', '--base-url', server.base_url]) == 0
+    assert 'alice: 25 moods' in capsys.readouterr().out
+    assert len(read_jsonl(os.path.join(output, 'alice', 'moods.jsonl'))) == 25
+
+
+@pytest.mark.parametrize('fmt', ['csv', 'parquet'])
+def test_export_keeps_fields_of_later_rows(tmpdir, fmt):
+    if fmt == 'parquet':
+        pq = pytest.importorskip('pyarrow.parquet')
+    from kiefer.export import WRITERS
+    writer = WRITERS[fmt](str(tmpdir.join('out')))
+    writer.row_group_size = 1
+    writer.write([{'xid': 'a', 'steps': 1, 'note': None}])
+    writer.commit()
+    writer.write([{'xid': 'b', 'steps': 2, 'calories': 5.5, 'note': 'x'}])
+    writer.commit()
+    writer.close()
+    if fmt == 'csv':
+        with open(str(tmpdir.join('out'))) as f:
+            rows = list(csv.DictReader(f))
+    else:
+        rows = pq.read_table(str(tmpdir.join('out'))).to_pylist()
+    assert rows[0]['_extra'] in ('', None)
+    extra = json.loads(rows[1]['_extra'])
+    if fmt == 'csv':
+        assert rows[1]['note'] == 'x' and extra == {'calories': 5.5}
+    else:
+        # 'note' was empty in the first part, its column has no type
+        assert extra == {'calories': 5.5, 'note': 'x'}
+
+
+def test_export_parquet_resume_keeps_schema(tmpdir):
+    pq = pytest.importorskip('pyarrow.parquet')
+    path = str(tmpdir.join('out'))
+    writer = ParquetWriter(path)
+    writer.row_group_size = 2
+    writer.write([{'a': 1, 'b': None}, {'a': 2, 'b': None}])
+    position = writer.commit()
+    writer.close()
+
+    writer = ParquetWriter(path, position)
+    writer.row_group_size = 2
+    writer.write([{'a': i, 'b': 'x', 'c': 1.5} for i in range(3, 8)])
+    writer.commit()
+    writer.close()
+    assert sorted(os.listdir(path)) == ['part-{:05d}.parquet'.format(i)
+                                        for i in range(4)]
+    table = pq.read_table(path)
+    assert table.schema.names == ['a', 'b', '_extra']
+    rows = table.to_pylist()
+    assert [row['a'] for row in rows] == list(range(1, 8))
+    assert json.loads(rows[-1]['_extra']) == {'b': 'x', 'c': 1.5}
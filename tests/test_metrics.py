@@ -0,0 +1,96 @@
+import pytest
+from kiefer.client import KieferClientError
+from kiefer.metrics import (HistogramCollector, PrometheusCollector,
+                            RequestEvent, endpoint_template)
+from kiefer.mockserver import MockUPServer
+
+BASE_URL = 'https://jawbone.com/nudge/api/v.1.1/'
+
+
+def test_metrics_endpoint_template():
+    assert endpoint_template(BASE_URL + 'users/@me/moves?limit=5',
+                             BASE_URL) == 'users/@me/moves'
+    assert endpoint_template(BASE_URL + '/moves/abc/ticks',
+                             BASE_URL) == 'moves/{xid}/ticks'
+    assert endpoint_template('https://jawbone.com/nudge/api/v.1.1/mood/x1',
+                             BASE_URL) == 'mood/{xid}'
+
+
+def event(total, status=200, endpoint='moves/{xid}'):
+    return RequestEvent('GET', endpoint, status, total / 2, total / 4,
+                        total / 4, total, 100, 1)
+
+
+def test_metrics_histogram_summary():
+    collector = HistogramCollector(buckets=(0.1, 1.0))
+    for total in (0.05, 0.05, 0.5, 2.0):
+        collector(event(total))
+    collector(event(0.05, status=404))
+    summary = collector.summary()[('GET', 'moves/{xid}')]
+    assert summary['count'] == 5 and summary['errors'] == 1
+    assert summary['bytes'] == 500 and summary['retries'] == 5
+    assert summary['p50'] == 0.1 and summary['p95'] == float('inf')
+    assert summary['ttfb'] == pytest.approx(summary['mean'] / 2)
+
+
+def test_metrics_prometheus_render():
+    collector = PrometheusCollector(buckets=(0.1, 1.0))
+    collector(event(0.05))
+    collector(event(0.5))
+    text = collector.render()
+    labels = 'endpoint="moves/{xid}",method="GET"'
+    bucket = 'kiefer_request_duration_seconds_bucket{endpoint="moves/{xid}",' \
+             'le="%s",method="GET"} %d'
+    assert bucket % ('0.1', 1) in text and bucket % ('+Inf', 2) in text
+    assert 'kiefer_request_duration_seconds_count{%s} 2' % labels in text
+    assert 'kiefer_requests_total{%s,status="200"} 2' % labels in text
+    assert 'kiefer_response_bytes_total{%s} 200' % labels in text
+
+
+def test_metrics_client_hooks():
+    events = []
+    with MockUPServer(items=5, tick_count=60, seed=1) as server:
+        client = server.client('token', hooks=[events.append])
+        client.get_move_ticks('moves-1')
+        list(client.stream_move_ticks('moves-2'))
+        client.add_meal(note='fish')
+        server.expire_token('token')
+        with pytest.raises(KieferClientError):
+            client.get_move('moves-1')
+
+    assert [(e.method, e.endpoint, e.status) for e in events] == [
+        ('GET', 'moves/{xid}/ticks', 200),
+        ('GET', 'moves/{xid}/ticks', 200),
+        ('POST', 'users/@me/meals', 201),
+        ('GET', 'moves/{xid}', 401)]
+    ticks, streamed = events[0], events[1]
+    assert ticks.bytes > 0 and ticks.bytes == streamed.bytes
+    assert ticks.total >= ticks.ttfb + ticks.decode
+    assert all(e.retries == 0 for e in events)
+
+
+def test_metrics_failed_requests(mocker):
+    import requests
+    from kiefer.client import CircuitOpenError, KieferClient
+    from kiefer.ratelimit import CircuitBreaker
+
+    events = []
+    collector = PrometheusCollector()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    client = KieferClient('token', hooks=[events.append, collector],
+                          circuit_breaker=breaker)
+    mocker.patch.object(client.session, 'get',
+                        side_effect=requests.ConnectionError('refused'))
+    with pytest.raises(requests.ConnectionError):
+        client.get_move('moves-1')
+    with pytest.raises(CircuitOpenError):
+        client.get_move('moves-1')
+    assert [(e.endpoint, e.status, e.bytes, e.error) for e in events] == [
+        ('moves/{xid}', 0, 0, 'ConnectionError'),
+        ('moves/{xid}', 0, 0, 'CircuitOpenError')]
+    summary = collector.summary()[('GET', 'moves/{xid}')]
+    assert summary['errors'] == 2
+    assert summary['exceptions'] == {'ConnectionError': 1,
+                                     'CircuitOpenError': 1}
+    assert 'kiefer_request_exceptions_total{endpoint="moves/{xid}",' \
+           'error="ConnectionError",method="GET"} 1' in collector.render()
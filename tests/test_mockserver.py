@@ -0,0 +1,126 @@
+import pytest
+from kiefer.cache import MemoryCache
+from kiefer.client import KieferClientError
+from kiefer.mockserver import MockUPServer
+from kiefer.ratelimit import RetryPolicy
+
+
+@pytest.yield_fixture
+def server():
+    with MockUPServer(items=25, page_size=10, tick_count=60, seed=1) as server:
+        yield server
+
+
+def test_mockserver_endpoints(server):
+    client = server.client('token')
+    assert client.get_user_information()['data']['xid'] == 'user'
+    assert client.get_move('moves-3')['data']['xid'] == 'moves-3'
+    assert len(client.get_move_ticks('moves-3')['data']['items']) == 60
+    assert client.get_sleep_phases('sleeps-1', columnar=True)['steps'][1] == 1
+    assert len(client.get_trends(num_buckets=5)['data']['data']) == 5
+    assert client.add_meal(note='fish')['data']['xid'].startswith('meals-')
+    assert client.delete_workout('workouts-1') == {'meta': {'code': 200},
+                                                   'data': {}}
+
+
+def test_mockserver_pagination(server):
+    client = server.client('token')
+    moves = list(client.iter_moves())
+    assert [move['xid'] for move in moves] == [
+        'moves-{}'.format(i) for i in range(25)]
+    assert server.request_count == 3
+
+    since = moves[5]['time_updated']
+    assert len(list(client.iter_moves(updated_after=since))) == 5
+
+
+def test_mockserver_streaming(server):
+    client = server.client('token')
+    assert len(list(client.stream_workout_ticks('workouts-1'))) == 60
+
+
+def test_mockserver_graphs(server, tmpdir):
+    import io
+    client = server.client('token')
+    graph = client.get_move_graph('moves-1')
+    assert isinstance(graph, memoryview)
+    assert graph[:4].tobytes() == b'\x89PNG' and len(graph) == 20 * 1024
+
+    f = io.BytesIO()
+    assert client.get_sleep_graph('sleeps-1', f) == 20 * 1024
+    assert f.getvalue() == graph.tobytes()
+
+    path = str(tmpdir.join('workout.png'))
+    client.get_workout_graph('workouts-1', path)
+    assert tmpdir.join('workout.png').read_binary() == graph.tobytes()
+    assert not tmpdir.join('workout.png.part').exists()
+
+
+def test_mockserver_download_many(server, tmpdir):
+    client = server.client('token')
+    directory = tmpdir.join('graphs')
+    results = list(client.download_many('move_graph', ['moves-1', 'moves-2'],
+                                        str(directory), max_workers=2))
+    assert sorted(res.result for res in results) == [
+        str(directory.join('moves-1.png')), str(directory.join('moves-2.png'))]
+    count = server.request_count
+    results = list(client.download_many('move_graph', ['moves-1', 'moves-3'],
+                                        str(directory)))
+    assert all(res.error is None for res in results)
+    assert server.request_count == count + 1
+    assert len(directory.listdir()) == 3
+
+    server.expire_token('token')
+    res, = client.download_many('move_graph', ['moves-4'], str(directory))
+    assert isinstance(res.error, KieferClientError)
+    assert len(directory.listdir()) == 3
+    with pytest.raises(KieferClientError):
+        client.download_many('moves', ['moves-1'], str(directory))
+
+
+def test_mockserver_etag_revalidation(server):
+    client = server.client('token', cache=MemoryCache(ttl=0))
+    first = client.get_settings()
+    assert client.get_settings() == first
+    assert server.request_count == 2
+
+
+def test_mockserver_throttling(server):
+    server.throttle_rate = 1.0
+    client = server.client('token')
+    with pytest.raises(KieferClientError) as e:
+        client.get_goals()
+    assert 'rate_limit_exceeded' in str(e.value)
+
+    server.throttle_rate = 0.5
+    retrying = server.client('token', retry=RetryPolicy(max_retries=20,
+                                                        backoff=0.001))
+    server.retry_after = 0
+    for _ in range(5):
+        retrying.get_goals()
+
+
+def test_mockserver_token_expiry(server):
+    client = server.client('token')
+    client.get_goals()
+    server.expire_token('token')
+    with pytest.raises(KieferClientError) as e:
+        client.get_goals()
+    assert 'authorization_error' in str(e.value)
+
+
+def test_mockserver_single_flight():
+    from kiefer.batch import fan_out
+    from kiefer.client import create_session
+    from kiefer.util import SingleFlight
+
+    flight = SingleFlight()
+    with MockUPServer(latency=0.2) as server:
+        session = create_session(pool_maxsize=8)
+        clients = [server.client('token', session=session,
+                                 single_flight=flight) for _ in range(8)]
+        results = list(fan_out(lambda c: c.get_goals(), clients, max_workers=8))
+        assert all(res.error is None for res in results)
+        assert server.request_count == 1
+        clients[0].get_goals()
+        assert server.request_count == 2
@@ -0,0 +1,52 @@
+import pytest
+from kiefer.models import (Move, MoveDetails, Sleep, Tick, Trend,
+                           from_response)
+from kiefer.ticks import TickColumns
+
+
+MOVE = {'xid': 'm1', 'title': '10,000 steps', 'date': 20150601,
+        'time_created': 1433116800, 'unknown': 'ignored',
+        'details': {'steps': 10000, 'km': 7.5, 'tz': 'Europe/Berlin'}}
+
+
+def test_models_move_from_dict():
+    move = Move.from_dict(MOVE)
+    assert move.xid == 'm1' and move.date == 20150601
+    assert move.time_completed is None
+    assert not hasattr(move, '__dict__')
+    assert isinstance(move._details, dict)
+    assert move.details.steps == 10000
+    assert isinstance(move._details, MoveDetails)
+    assert move.details is move.details
+    data = move.to_dict()
+    assert data['details']['km'] == 7.5 and 'unknown' not in data
+
+
+def test_models_slots_reject_new_attributes():
+    move = Move(xid='m1')
+    with pytest.raises(AttributeError):
+        move.foo = 1
+    with pytest.raises(TypeError):
+        Move(foo=1)
+
+
+def test_models_from_response():
+    sleeps = from_response('sleeps', {'data': {'items': [
+        {'xid': 's1', 'details': {'deep': 3600}}, {'xid': 's2'}]}})
+    assert [s.xid for s in sleeps] == ['s1', 's2']
+    assert sleeps[0].details.deep == 3600 and sleeps[1].details is None
+    assert sleeps[0] == Sleep.from_dict({'xid': 's1', 'details': {'deep': 3600}})
+
+
+def test_models_trends_and_ticks():
+    response = {'data': {'data': [[20150601, {'m_steps': 500}],
+                                  [20150602, {'m_steps': 800}]]}}
+    trends = from_response('trends', response)
+    assert [(t.date, t.m_steps) for t in trends] == \
+        [(20150601, 500), (20150602, 800)]
+    assert list(Trend.from_items(response['data']['data']))[1].m_steps == 800
+
+    ticks = {'data': {'items': [{'time': 2, 'steps': 3}, {'time': 1, 'steps': 1}]}}
+    assert isinstance(from_response('ticks', ticks), TickColumns)
+    tick = next(Tick.from_items(ticks['data']['items']))
+    assert (tick.time, tick.steps, tick.speed) == (2, 3, None)
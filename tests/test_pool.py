@@ -0,0 +1,59 @@
+import os
+import time
+
+from kiefer.mockserver import MockUPServer
+from kiefer.pool import SyncJob, WorkerPool, shard_of
+
+
+def square_or_fail(key, value, session):
+    if value < 0:
+        raise ValueError('negative')
+    return {'squares': value * value}
+
+
+def sleep(key, value, session):
+    time.sleep(value)
+
+
+def test_pool_shard_of_is_stable():
+    assert shard_of('user-1', 4) == shard_of('user-1', 4)
+    assert set(shard_of('user-{}'.format(i), 3) for i in range(30)) == {0, 1, 2}
+
+
+def test_pool_collects_results_and_errors():
+    pool = WorkerPool(square_or_fail, processes=2, threads=2)
+    updates = []
+    results = dict((res.key, res) for res in pool.run(
+        {'a': 1, 'b': 2, 'c': 3, 'd': -1}, progress=updates.append))
+    assert results['c'].result == {'squares': 9}
+    assert 'ValueError' in results['d'].error
+    assert pool.stats['done'] == 3 and pool.stats['failed'] == 1
+    assert pool.stats['items'] == {'squares': 14}
+    assert sum(s['assigned'] for s in pool.stats['shards']) == 4
+    assert sum(s['done'] + s['failed'] for s in pool.stats['shards']) == 4
+    assert len(updates) == 4
+
+
+def test_pool_idle_workers_steal_jobs():
+    keys = [k for k in ('job{}'.format(i) for i in range(50))
+            if shard_of(k, 2) == 0][:4]
+    pool = WorkerPool(sleep, processes=2, threads=1)
+    results = list(pool.run(dict((key, 0.2) for key in keys)))
+    assert len(results) == 4
+    assert pool.stats['shards'][0]['assigned'] == 4
+    assert pool.stats['stolen'] == pool.stats['shards'][1]['done'] > 0
+
+
+def test_pool_sync_job(tmpdir):
+    with MockUPServer(items=15, page_size=10, seed=1) as server:
+        job = SyncJob(str(tmpdir.join('state')), str(tmpdir.join('data')),
+                      resources=['moves', 'sleeps'], page_limit=10,
+                      base_url=server.base_url)
+        pool = WorkerPool(job, processes=2, threads=2)
+        users = dict(('user{}'.format(i), 'token{}'.format(i))
+                     for i in range(6))
+        results = list(pool.run(users))
+    assert all(res.error is None for res in results)
+    assert pool.stats['items'] == {'moves': 90, 'sleeps': 90}
+    assert os.path.isfile(str(tmpdir.join('data', 'user3', 'moves.jsonl')))
+    assert os.path.isfile(str(tmpdir.join('state', 'user3.json')))
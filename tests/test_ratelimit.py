@@ -0,0 +1,175 @@
+import time
+
+import requests
+import pytest
+from kiefer.client import CircuitOpenError, KieferClient, KieferClientError
+from kiefer.ratelimit import (CircuitBreaker, HedgePolicy, RateLimiter,
+                              RetryPolicy, TokenBucket, parse_retry_after)
+
+
+def test_ratelimit_token_bucket_paces_requests():
+    bucket = TokenBucket(rate=10, capacity=2)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    bucket.pause(5)
+    assert bucket.reserve() == pytest.approx(5.1, abs=0.02)
+
+
+def test_ratelimit_limiter_per_token_and_app():
+    limiter = RateLimiter(per_token=1, per_app=100, burst=1)
+    assert limiter.reserve('a') == 0
+    assert limiter.reserve('b') == pytest.approx(0.01, abs=0.01)
+    assert limiter.reserve('a') == pytest.approx(1, abs=0.01)
+
+
+def test_ratelimit_limiter_pauses_on_429():
+    limiter = RateLimiter(per_token=10)
+    limiter.update('a', 429, {'Retry-After': '3'})
+    assert limiter.reserve('a') == pytest.approx(3, abs=0.1)
+    assert limiter.reserve('b') == 0
+
+
+def test_ratelimit_parse_retry_after():
+    assert parse_retry_after('2') == 2.0
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+    assert parse_retry_after(None) is None
+
+
+def test_ratelimit_retry_policy():
+    policy = RetryPolicy(max_retries=2, backoff=1)
+    assert policy.should_retry('post', 429, 0)
+    assert policy.should_retry('get', 503, 1)
+    assert not policy.should_retry('post', 503, 0)
+    assert not policy.should_retry('get', 429, 2)
+    assert not policy.should_retry('get', 404, 0)
+    assert 0 <= policy.delay(3) <= 8
+    assert policy.delay(0, '7') == 7
+
+
+def test_ratelimit_client_retries(mocker):
+    throttled = mocker.Mock(status_code=429, headers={'Retry-After': '0'})
+    ok = mocker.Mock(status_code=200, headers={})
+    ok.content = b'{"data": {}}'
+    req_get = mocker.patch('requests.Session.get',
+                           side_effect=[throttled, ok])
+    sleep = mocker.patch('time.sleep')
+    client = KieferClient('access_token', retry=RetryPolicy(),
+                          rate_limiter=RateLimiter(per_token=100))
+    assert client.get_settings() == {'data': {}}
+    assert req_get.call_count == 2
+    sleep.assert_any_call(0.0)
+
+
+def test_ratelimit_client_gives_up(mocker):
+    error = mocker.Mock(status_code=503, headers={})
+    error.content = b'{"meta": {"error_type": "E", "error_detail": "x"}}'
+    req_get = mocker.patch('requests.Session.get', return_value=error)
+    mocker.patch('time.sleep')
+    client = KieferClient('access_token', retry=RetryPolicy(max_retries=2))
+    with pytest.raises(KieferClientError):
+        client.get_settings()
+    assert req_get.call_count == 3
+
+
+def test_ratelimit_circuit_breaker(mocker):
+    now = mocker.patch('kiefer.ratelimit._clock', return_value=100.0)
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+    breaker.record('api', False)
+    breaker.record('api', True)
+    breaker.record('api', False)
+    assert breaker.allow('api') and not breaker.is_open('api')
+    breaker.record('api', False)
+    assert breaker.is_open('api') and not breaker.allow('api')
+    assert breaker.allow('other')
+
+    now.return_value = 111.0
+    assert breaker.allow('api')          # trial request
+    assert not breaker.allow('api')      # only one at a time
+    breaker.record('api', False)
+    assert not breaker.allow('api')
+    now.return_value = 122.0
+    assert breaker.allow('api')
+    breaker.record('api', True)
+    assert not breaker.is_open('api') and breaker.allow('api')
+
+
+def test_ratelimit_circuit_breaker_release(mocker):
+    now = mocker.patch('kiefer.ratelimit._clock', return_value=100.0)
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    breaker.record('api', False)
+    now.return_value = 111.0
+    assert breaker.allow('api')
+    breaker.release('api')   # trial cancelled
+    assert breaker.is_open('api') and breaker.allow('api')
+
+
+def test_ratelimit_client_circuit_breaker(mocker):
+    req_get = mocker.patch('requests.Session.get',
+                           side_effect=requests.ConnectionError('refused'))
+    client = KieferClient('token', circuit_breaker=CircuitBreaker(2, 30))
+    for _ in range(2):
+        with pytest.raises(requests.ConnectionError):
+            client.get_moves()
+    with pytest.raises(CircuitOpenError):
+        client.get_moves()
+    assert req_get.call_count == 2
+
+
+def test_ratelimit_limiter_try_acquire():
+    limiter = RateLimiter(per_token=1, per_app=0.001, burst=1)
+    assert limiter.try_acquire('a')
+    assert not limiter.try_acquire('a')
+    assert not limiter.try_acquire('b')
+    # The token of 'b' taken before the app bucket refused was given back
+    assert limiter._token_buckets['b'].try_take()
+
+
+def test_ratelimit_hedge_policy_delay():
+    hedge = HedgePolicy(quantile=0.9, window=10, min_samples=5, min_delay=0.01)
+    for seconds in (0.1, 0.2, 0.3, 0.4):
+        hedge.observe(seconds)
+    assert hedge.delay() is None
+    for seconds in (0.5, 0.6, 0.7, 0.8, 0.9, 1.0, 0.001):
+        hedge.observe(seconds)
+    # 0.1 dropped out of the window
+    assert hedge.delay() == 1.0
+    hedge.shutdown()
+
+
+def test_ratelimit_client_hedged_get(mocker):
+    slow, fast = mocker.Mock(status_code=200, content=b'{"data": "slow"}'), \
+        mocker.Mock(status_code=200, content=b'{"data": "fast"}')
+    responses = [slow, fast]
+
+    def get(url, **kwargs):
+        r = responses.pop(0)
+        if r is slow:
+            time.sleep(0.5)
+        return r
+
+    req_get = mocker.patch('requests.Session.get', side_effect=get)
+    hedge = HedgePolicy(min_samples=1)
+    hedge.observe(0.05)
+    client = KieferClient('token', hedge=hedge)
+    assert client.get_moves() == {'data': 'fast'}
+    assert req_get.call_count == 2
+    assert req_get.call_args[1]['timeout'] == KieferClient.DEFAULT_TIMEOUT
+    hedge.shutdown()
+
+
+def test_ratelimit_hedge_respects_rate_limiter(mocker):
+    def get(url, **kwargs):
+        time.sleep(0.2)
+        return mocker.Mock(status_code=200, content=b'{"data": 1}',
+                           headers={})
+
+    req_get = mocker.patch('requests.Session.get', side_effect=get)
+    hedge = HedgePolicy(min_samples=1)
+    hedge.observe(0.01)
+    limiter = RateLimiter(per_token=1, burst=1)
+    client = KieferClient('token', hedge=hedge, rate_limiter=limiter)
+    assert client.get_moves() == {'data': 1}
+    # The only token was used by the first request, no hedge was sent
+    assert req_get.call_count == 1
+    hedge.shutdown()
@@ -0,0 +1,83 @@
+import time
+
+from kiefer.mockserver import MockUPServer
+from kiefer.store import LocalHistory, TimeSeriesStore, date_range
+from kiefer.sync import MemoryStateStore, SyncEngine
+
+HOUR = 3600
+
+
+def item(xid, created, date=20150601):
+    return {'xid': xid, 'time_created': created, 'time_updated': created,
+            'date': date}
+
+
+def test_store_query_and_upsert(tmpdir):
+    store = TimeSeriesStore(str(tmpdir.join('store.db')))
+    store.put_items('alice', 'moves', [item('a', 100), item('b', 200),
+                                       item('c', 300, date=20150602)])
+    store.put_items('bob', 'moves', [item('d', 150)])
+    store.put_items('alice', 'moves', [dict(item('a', 100), title='new')])
+    assert [i['xid'] for i in store.query('alice', 'moves')] == ['c', 'b', 'a']
+    assert [i['xid'] for i in store.query('alice', 'moves', start_time=150,
+                                          end_time=300, limit=1)] == ['c']
+    assert [i['xid'] for i in store.query('alice', 'moves',
+                                          date=20150601)] == ['b', 'a']
+    assert store.get_item('a')['title'] == 'new'
+
+
+def test_store_coverage_and_gaps(tmpdir):
+    store = TimeSeriesStore(str(tmpdir.join('store.db')))
+    assert store.gaps('u', 'moves', 0, 100) == [(0, 100)]
+    store.mark_covered('u', 'moves', 10, 20)
+    store.mark_covered('u', 'moves', 40, 50)
+    assert store.gaps('u', 'moves', 0, 100) == [(0, 9), (21, 39), (51, 100)]
+    store.mark_covered('u', 'moves', 21, 39)
+    assert store.gaps('u', 'moves', 15, 45) == []
+    assert store.gaps('u', 'moves', 0, 60) == [(0, 9), (51, 60)]
+
+
+def test_store_date_range():
+    start, end = date_range(20150601)
+    assert end - start == 50 * HOUR
+    assert start == 1433116800 - 14 * HOUR
+
+
+def test_store_local_history(tmpdir):
+    store = TimeSeriesStore(str(tmpdir.join('store.db')))
+    with MockUPServer(items=100, page_size=20, seed=1) as server:
+        client = server.client('token')
+        history = LocalHistory(client, store, 'alice', recent=HOUR)
+        now = server.now
+        first = history.get_sleeps(start_time=now - 80 * HOUR,
+                                   end_time=now - 20 * HOUR)
+        assert first['data']['size'] == 61
+        requests = server.request_count
+        assert history.get_sleeps(start_time=now - 70 * HOUR,
+                                  end_time=now - 30 * HOUR)['data']['size'] == 41
+        assert server.request_count == requests
+
+        # Only the uncovered part is fetched
+        wider = history.get_sleeps(start_time=now - 90 * HOUR,
+                                   end_time=now - 20 * HOUR)
+        assert wider['data']['size'] == 71
+        assert server.request_count == requests + 1
+
+        # Unsupported arguments go to the API
+        assert history.get_sleeps(page_token=5)['data']['items']
+        assert store.query('alice', 'moves') == []
+
+        # So do calls without a range instead of fetching the whole history
+        requests = server.request_count
+        latest = history.get_moves(limit=10)
+        assert latest['data']['size'] == 10 and latest['data']['links']
+        assert server.request_count == requests + 1
+        assert store.query('alice', 'moves') == []
+
+
+def test_store_as_sync_sink(tmpdir):
+    store = TimeSeriesStore(str(tmpdir.join('store.db')))
+    with MockUPServer(items=30, seed=1) as server:
+        engine = SyncEngine(MemoryStateStore(), store, resources=['moods'])
+        assert engine.sync_user('alice', server.client('token')) == {'moods': 30}
+    assert len(store.query('alice', 'moods', end_time=time.time())) == 30
@@ -0,0 +1,66 @@
+import json
+import pytest
+from kiefer.client import KieferClient, KieferClientError
+from kiefer.stream import ItemStreamParser, iter_items
+
+BODY = json.dumps({
+    'meta': {'message': 'items: [ "quoted" \\ ]', 'items': [1, 2]},
+    'data': {'links': {'next': '/x'},
+             'items': [{'xid': 'a', 'steps': 12}, {'xid': 'b', 'note': ']}'}],
+             'size': 2}}).encode('utf-8')
+
+
+def _chunks(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize('size', [1, 7, len(BODY)])
+def test_stream_iter_items_chunked(size):
+    items = list(iter_items(_chunks(BODY, size)))
+    assert items == [{'xid': 'a', 'steps': 12}, {'xid': 'b', 'note': ']}'}]
+
+
+def test_stream_other_path_and_numbers():
+    body = b'{"data": {"earliest": 1, "data": [[20150601, {"s": 1}], 12345]}}'
+    assert list(iter_items(_chunks(body, 3), ('data', 'data'))) == [
+        [20150601, {'s': 1}], 12345]
+
+
+@pytest.mark.parametrize('chunks', [
+    [b'{"data": {"items": [3.', b'5, 4]}}'],
+    [b'{"data": {"items": [1e', b'2, -0.5E-', b'1]}}'],
+    [b'{"data": {"items": [350', b'.0, 0.0', b'5]}}'],
+])
+def test_stream_numbers_split_across_chunks(chunks):
+    expected = json.loads(b''.join(chunks).decode('utf-8'))['data']['items']
+    assert list(iter_items(chunks)) == expected
+
+
+def test_stream_multibyte_characters():
+    body = json.dumps({'data': {'items': [{'title': u'M\xfcsli \u2615'}]}},
+                      ensure_ascii=False).encode('utf-8')
+    assert list(iter_items(_chunks(body, 1)))[0]['title'] == u'M\xfcsli \u2615'
+
+
+def test_stream_truncated_body():
+    parser = ItemStreamParser()
+    assert parser.feed(BODY[:-40]) == [{'xid': 'a', 'steps': 12}]
+    with pytest.raises(ValueError):
+        parser.close()
+
+
+def test_stream_client(mocker):
+    resp = mocker.Mock(status_code=200)
+    resp.iter_content.return_value = _chunks(BODY, 16)
+    req_get = mocker.patch('requests.Session.get', return_value=resp)
+    client = KieferClient('access_token')
+    items = client.stream_move_ticks('abc')
+    assert req_get.call_count == 0
+    assert [item['xid'] for item in items] == ['a', 'b']
+    assert req_get.call_args[1]['stream'] is True
+    assert resp.close.call_count == 1
+
+    resp.status_code = 404
+    resp.content = b'{"meta": {"error_type": "E", "error_detail": "x"}}'
+    with pytest.raises(KieferClientError):
+        list(client.stream_trends())
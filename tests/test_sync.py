@@ -0,0 +1,69 @@
+import json
+import pytest
+from kiefer.client import KieferClient
+from kiefer.sync import (JSONFileStateStore, JSONLinesSink, MemoryStateStore,
+                         SyncEngine)
+
+
+def _page(items, next_link=None):
+    links = {'next': next_link} if next_link else {}
+    return {'data': {'items': items, 'links': links}}
+
+
+class ListSink(object):
+    def __init__(self, fail_after=None):
+        self.items = []
+        self.fail_after = fail_after
+
+    def write(self, user, resource, items):
+        if self.fail_after is not None and len(self.items) >= self.fail_after:
+            raise IOError('disk full')
+        self.items.extend(item['xid'] for item in items)
+
+
+@pytest.fixture
+def client(mocker):
+    client = KieferClient('access_token')
+    pages = {'/next': _page([{'xid': 'c', 'time_updated': 5}])}
+    mocker.patch.object(client, 'get_moves', return_value=_page(
+        [{'xid': 'a', 'time_updated': 10}, {'xid': 'b', 'time_updated': 7}],
+        '/next'))
+    mocker.patch.object(client, '_get_url',
+                        side_effect=lambda url: pages[url[-5:]])
+    return client
+
+
+def test_sync_writes_items_and_high_water_mark(client):
+    state, sink = MemoryStateStore(), ListSink()
+    engine = SyncEngine(state, sink, resources=['moves'])
+    assert engine.sync_user('user', client) == {'moves': 3}
+    assert sink.items == ['a', 'b', 'c']
+    assert state.get('user', 'moves') == {'high_water_mark': 10,
+                                          'pending': None}
+
+    engine.sync_resource('user', client, 'moves')
+    client.get_moves.assert_called_with(limit=100, updated_after=10)
+
+
+def test_sync_resumes_after_crash(client):
+    state = MemoryStateStore()
+    engine = SyncEngine(state, ListSink(fail_after=2), resources=['moves'])
+    with pytest.raises(IOError):
+        engine.sync_user('user', client)
+    assert state.get('user', 'moves')['pending'] == {'next': '/next',
+                                                     'max': 10}
+
+    sink = ListSink()
+    SyncEngine(state, sink, resources=['moves']).sync_user('user', client)
+    assert sink.items == ['c']
+    assert state.get('user', 'moves')['high_water_mark'] == 10
+
+
+def test_sync_file_state_and_sink(client, tmpdir):
+    path = str(tmpdir.join('state.json'))
+    engine = SyncEngine(JSONFileStateStore(path),
+                        JSONLinesSink(str(tmpdir)), resources=['moves'])
+    engine.sync_user('user', client)
+    assert JSONFileStateStore(path).get('user', 'moves')['high_water_mark'] == 10
+    with open(str(tmpdir.join('user', 'moves.jsonl'))) as f:
+        assert [json.loads(line)['xid'] for line in f] == ['a', 'b', 'c']
@@ -0,0 +1,63 @@
+import json
+import pytest
+from kiefer.client import KieferClient
+from kiefer.ticks import TickColumns
+
+DAY = 24 * 60 * 60
+ITEMS = [{'time': DAY + 60, 'steps': 20, 'distance': 1.5},
+         {'time': DAY, 'steps': 10, 'distance': 0.5},
+         {'time': 2 * DAY + 30, 'steps': 5, 'distance': None}]
+
+
+@pytest.fixture(params=[False, True], ids=['array', 'numpy'])
+def ticks(request):
+    if request.param:
+        pytest.importorskip('numpy')
+    return TickColumns.from_items(ITEMS, use_numpy=request.param)
+
+
+def test_ticks_columns(ticks):
+    assert len(ticks) == 3
+    assert ticks.fields == ['time', 'distance', 'steps']
+    assert list(ticks['steps']) == [10, 20, 5]
+    assert ticks['distance'][2] != ticks['distance'][2]  # NaN
+
+
+def test_ticks_resample(ticks):
+    hourly = ticks.resample(3600, ['steps'])
+    assert list(hourly['time']) == [DAY, 2 * DAY]
+    assert list(hourly['steps']) == [30, 5]
+
+
+def test_ticks_daily_totals(ticks):
+    assert ticks.daily_totals('steps') == {DAY: 30, 2 * DAY: 5}
+    assert ticks.daily_totals('steps', utc_offset=-3600) == {
+        DAY + 3600: 5, 3600: 30}
+
+
+def test_ticks_window_sums(ticks):
+    assert list(ticks.window_sums('steps', 2)) == [30, 25]
+    # A missing value doesn't spoil the following windows
+    assert list(ticks.window_sums('distance', 1)) == [0.5, 1.5, 0.0]
+    assert list(ticks.window_sums('distance', 2)) == [2.0, 1.5]
+    with pytest.raises(ValueError):
+        ticks.window_sums('steps', 0)
+
+
+@pytest.mark.parametrize('use_numpy', [False, True], ids=['array', 'numpy'])
+def test_ticks_window_sums_after_missing_value(use_numpy):
+    if use_numpy:
+        pytest.importorskip('numpy')
+    items = [{'time': i, 'steps': None if i == 0 else 10} for i in range(4)]
+    ticks = TickColumns.from_items(items, use_numpy=use_numpy)
+    assert list(ticks.window_sums('steps', 2)) == [10, 20, 20]
+
+
+def test_ticks_client_columnar(mocker):
+    resp = mocker.Mock(status_code=200)
+    resp.content = json.dumps({'data': {'items': ITEMS}}).encode('utf-8')
+    mocker.patch('requests.Session.get', return_value=resp)
+    client = KieferClient('access_token')
+    ticks = client.get_sleep_phases('abc', columnar=True)
+    assert isinstance(ticks, TickColumns)
+    assert client.get_sleep_phases('abc') == {'data': {'items': ITEMS}}
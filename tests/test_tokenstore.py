@@ -0,0 +1,104 @@
+import threading
+import time
+import pytest
+from kiefer.auth import KieferAuth
+from kiefer.tokenstore import FileTokenStore, MemoryTokenStore, SQLiteTokenStore
+
+TOKEN = {'access_token': 'access', 'refresh_token': 'refresh',
+         'expires_at': 1500000000.0}
+
+
+@pytest.fixture(params=['memory', 'file', 'sqlite'])
+def store_factory(request, tmpdir):
+    memory = MemoryTokenStore()
+    factories = {
+        'memory': lambda: memory,
+        'file': lambda: FileTokenStore(str(tmpdir.join('tokens.json'))),
+        'sqlite': lambda: SQLiteTokenStore(str(tmpdir.join('tokens.db'))),
+    }
+    return factories[request.param]
+
+
+def _auth(store, mocker, calls):
+    auth = KieferAuth('tests/testconfig.json', token_store=store, user='u1')
+
+    def refresh():
+        time.sleep(0.05)
+        calls.append(1)
+        auth._set_token({'access_token': 'access{}'.format(len(calls)),
+                         'refresh_token': 'refresh{}'.format(len(calls)),
+                         'expires_in': 3600})
+        return auth.access_token, auth.refresh_token
+
+    mocker.patch.object(auth, '_refresh_access_token', side_effect=refresh)
+    return auth
+
+
+def test_tokenstore_roundtrip(store_factory):
+    store = store_factory()
+    assert store.load('u1') is None
+    store.save('u1', TOKEN)
+    assert store.load('u1') == TOKEN
+    assert store_factory().load('u1') == TOKEN
+
+
+def test_tokenstore_auth_loads_and_saves(store_factory, mocker):
+    store_factory().save('u1', TOKEN)
+    calls = []
+    auth = _auth(store_factory(), mocker, calls)
+    assert auth.access_token == 'access'
+    assert auth.refresh_access_token() == ('access1', 'refresh1')
+    assert store_factory().load('u1')['refresh_token'] == 'refresh1'
+
+
+def test_tokenstore_single_refresh_across_stores(store_factory, mocker):
+    store_factory().save('u1', TOKEN)
+    calls = []
+    auths = [_auth(store_factory(), mocker, calls) for _ in range(5)]
+    threads = [threading.Thread(target=auth.refresh_access_token)
+               for auth in auths]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert set(auth.access_token for auth in auths) == {'access1'}
+
+
+def test_tokenstore_lock_is_per_user(store_factory):
+    holder, other = store_factory(), store_factory()
+    held, release = threading.Event(), threading.Event()
+
+    def hold():
+        with holder.lock('u1'):
+            held.set()
+            release.wait(10)
+
+    def lock_other_user():
+        with other.lock('u2'):
+            other.save('u2', TOKEN)
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    held.wait(5)
+    try:
+        locker = threading.Thread(target=lock_other_user)
+        locker.start()
+        locker.join(2)
+        # u2 was locked and saved while u1 was held
+        assert not locker.is_alive()
+    finally:
+        release.set()
+        thread.join()
+        locker.join()
+    assert store_factory().load('u2') == TOKEN
+
+
+def test_tokenstore_auth_refresh_timeout(mocker):
+    refresh = mocker.patch('requests_oauthlib.OAuth2Session.refresh_token',
+                           return_value={'access_token': 'a',
+                                         'refresh_token': 'r'})
+    auth = KieferAuth('tests/testconfig.json', timeout=(1, 2))
+    auth.refresh_token = 'refresh'
+    auth.refresh_access_token()
+    assert refresh.call_args[1]['timeout'] == (1, 2)
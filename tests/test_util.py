@@ -0,0 +1,83 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from kiefer import util
+from kiefer.client import KieferClient
+from kiefer.util import LazyResponse, SingleFlight, loads, set_json_backend
+
+
+@pytest.yield_fixture
+def restore_backend():
+    yield
+    set_json_backend('json')
+
+
+def test_util_set_json_backend(restore_backend):
+    assert set_json_backend('json') == 'json'
+    assert set_json_backend('auto') in ('orjson', 'ujson', 'json')
+    assert loads(b'{"data": {"items": []}}') == {'data': {'items': []}}
+    with pytest.raises(ImportError):
+        set_json_backend('nojson')
+
+
+def test_util_stdlib_backend_decodes_bytes(mocker, restore_backend):
+    # Python < 3.6 only accepts str in json.loads
+    mocker.patch.object(util, '_STDLIB_LOADS', util._text_loads)
+    json_loads = mocker.patch('json.loads', return_value={})
+    set_json_backend('json')
+    loads(b'{"note": "caf\xc3\xa9"}')
+    json_loads.assert_called_once_with(u'{"note": "caf\xe9"}')
+
+
+def test_util_lazy_response_decodes_once(mocker):
+    spy = mocker.patch.object(util, 'loads', wraps=util.loads)
+    response = LazyResponse(b'{"data": {"items": [1, 2]}, "meta": {}}')
+    assert response.raw.startswith(b'{"data"')
+    assert spy.call_count == 0
+    assert response['data']['items'] == [1, 2]
+    assert sorted(response) == ['data', 'meta']
+    assert spy.call_count == 1
+
+
+def test_util_client_lazy_responses(mocker):
+    resp = mocker.Mock(status_code=200, content=b'{"data": {"xid": "a"}}')
+    mocker.patch('requests.Session.get', return_value=resp)
+    response = KieferClient('access_token', lazy=True).get_move('a')
+    assert isinstance(response, LazyResponse)
+    assert response.raw == resp.content
+    assert response['data']['xid'] == 'a'
+
+
+def test_util_single_flight_coalesces_concurrent_calls():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def func():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {'data': 1}
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        leader = executor.submit(flight.do, 'key', func)
+        started.wait(5)
+        followers = [executor.submit(flight.do, 'key', func) for _ in range(3)]
+        while not all(f.running() for f in followers):
+            time.sleep(0.001)
+        time.sleep(0.05)  # let the followers block on the running call
+        release.set()
+        results = [leader.result()] + [f.result() for f in followers]
+
+    assert len(calls) == 1 and all(r is results[0] for r in results)
+    assert len(flight) == 0
+    assert flight.do('key', lambda: 2) == 2
+
+
+def test_util_single_flight_shares_errors():
+    flight = SingleFlight()
+    with pytest.raises(ValueError):
+        flight.do('key', lambda: int('x'))
+    assert len(flight) == 0
@@ -0,0 +1,159 @@
+import io
+import json
+import time
+
+from kiefer.client import KieferClientError
+from kiefer.mockserver import MockUPServer
+from kiefer.webhook import (Dispatcher, EventQueue, WebhookReceiver,
+                            secret_hash, verify_event)
+
+HASH = secret_hash('client_id', 'secret')
+
+
+def event(xid, type='move', action='updation', user='user', hash=HASH):
+    return {'user_xid': user, 'event_xid': xid, 'type': type,
+            'action': action, 'timestamp': 1, 'secret_hash': hash}
+
+
+def post(receiver, body, method='POST'):
+    body = body if isinstance(body, bytes) else json.dumps(body).encode('utf-8')
+    status = []
+    environ = {'REQUEST_METHOD': method, 'CONTENT_LENGTH': str(len(body)),
+               'wsgi.input': io.BytesIO(body)}
+    receiver(environ, lambda s, headers: status.append(s))
+    return int(status[0].split()[0])
+
+
+def test_webhook_verify_event():
+    assert HASH == ('3c8261e37ced24e671203e76847c0f1c'
+                    'd0fb742b1e8b805587625f9a81bfc998')
+    assert verify_event(event('a'), 'client_id', 'secret')
+    assert not verify_event(event('a', hash='x'), 'client_id', 'secret')
+    assert not verify_event({}, 'client_id', 'secret')
+
+
+def test_webhook_queue_coalesces_events():
+    queue = EventQueue()
+    queue.put(event('a'))
+    queue.put(event('b'))
+    queue.put(event('a', action='deletion'))
+    queue.put(event('a', user='other'))
+    assert len(queue) == 3 and queue.coalesced == 1
+    events = queue.get_many(max_events=2)
+    assert [(e['event_xid'], e['action']) for e in events] == [
+        ('a', 'deletion'), ('b', 'updation')]
+    assert len(queue.get_many()) == 1
+    assert queue.get_many(timeout=0.01) == []
+
+
+def test_webhook_receiver():
+    receiver = WebhookReceiver('client_id', 'secret')
+    assert post(receiver, {'events': [event('a'), event('b', hash='x')]}) == 200
+    assert len(receiver.queue) == 1 and receiver.rejected == 1
+    assert post(receiver, {'events': [event('c', hash='x')]}) == 403
+    assert post(receiver, b'not json') == 400
+    assert post(receiver, {'events': []}, method='GET') == 405
+    receiver.max_body = 10
+    assert post(receiver, {'events': [event('d')]}) == 413
+    assert len(receiver.queue) == 1
+
+
+def test_webhook_dispatcher():
+    handled = []
+    queue = EventQueue()
+    with MockUPServer(items=10, seed=1) as server:
+        clients = {'user': server.client('token')}
+        dispatcher = Dispatcher(clients.get,
+                                lambda e, item: handled.append((e, item)),
+                                queue)
+        queue.put(event('moves-1'))
+        queue.put(event('moves-1'))
+        queue.put(event('sleeps-2', type='sleep'))
+        queue.put(event('meals-3', type='meal', action='deletion'))
+        queue.put(event('moves-4', user='unknown'))
+        results = dispatcher.dispatch()
+        assert server.request_count == 2
+    assert len(results) == 4 and len(handled) == 3
+    errors = [res for res in results if res.error is not None]
+    assert len(errors) == 1 and isinstance(errors[0].error, KieferClientError)
+    items = dict((e['event_xid'], item) for e, item in handled)
+    assert items['moves-1']['data']['xid'] == 'moves-1'
+    assert items['sleeps-2']['data']['xid'] == 'sleeps-2'
+    assert items['meals-3'] is None
+
+
+def test_webhook_queue_retry():
+    queue = EventQueue()
+    queue.retry(event('a'), 0.05)
+    assert len(queue) == 1
+    assert queue.get_many(timeout=0.01) == []
+    start = time.time()
+    assert [e['event_xid'] for e in queue.get_many(timeout=1)] == ['a']
+    assert time.time() - start < 0.5
+    # A newer event replaces a retried one
+    queue.retry(event('b'), 0)
+    queue.put(event('b', action='deletion'))
+    assert [e['action'] for e in queue.get_many()] == ['deletion']
+    assert len(queue) == 0
+
+
+def test_webhook_dispatcher_retries_transient_errors():
+    import requests
+    from kiefer.ratelimit import RetryPolicy
+
+    flaky = {'failures': 2}
+
+    class Client(object):
+        def get_move(self, xid):
+            if xid == 'flaky' and flaky['failures']:
+                flaky['failures'] -= 1
+                raise requests.ConnectionError('reset')
+            if xid == 'gone':
+                error = KieferClientError('not_found: gone')
+                error.status_code = 404
+                raise error
+            return {'data': {'xid': xid}}
+
+    def handle(e, item):
+        if e['event_xid'] == 'bug':
+            raise KeyError('steps')
+        handled.append(item)
+
+    handled = []
+    queue = EventQueue()
+    dispatcher = Dispatcher(lambda user: Client(), handle, queue,
+                            retry=RetryPolicy(backoff=0.01, max_backoff=0.01))
+    assert dispatcher.max_retries == 5
+    queue.put(event('flaky'))
+    queue.put(event('gone'))
+    queue.put(event('bug'))
+    errors = [res.error for res in dispatcher.dispatch()]
+    assert sum(e is not None for e in errors) == 3
+    assert len(queue) == 1   # only the connection error is retried
+    assert dispatcher.dispatch(timeout=1)[0].error is not None
+    assert dispatcher.dispatch(timeout=1)[0].error is None
+    assert handled == [{'data': {'xid': 'flaky'}}] and len(queue) == 0
+
+    dispatcher.max_retries = 0
+    flaky['failures'] = 1
+    queue.put(event('flaky'))
+    dispatcher.dispatch()
+    assert len(queue) == 0
+
+
+def test_webhook_dispatcher_thread():
+    handled = []
+    queue = EventQueue()
+    dispatcher = Dispatcher(lambda user: None,
+                            lambda e, item: handled.append(e), queue)
+    dispatcher.start()
+    try:
+        queue.put(event('a', action='deletion'))
+        queue.put(event('b', type='heartrate'))
+        for _ in range(100):
+            if len(handled) == 2:
+                break
+            time.sleep(0.01)
+    finally:
+        dispatcher.stop()
+    assert sorted(e['event_xid'] for e in handled) == ['a', 'b']